@@ -4,17 +4,21 @@ from celery import Celery
 from kombu import Exchange, Queue
 
 from dcumiddleware.settings import AppConfig, config_by_name
+from dcumiddleware.utilities.serialization import (SERIALIZER_NAME,
+                                                   register_serializer)
 
 # Grab the correct settings based on environment
 app_settings: AppConfig = config_by_name[os.getenv('sysenv') or 'dev']
 
+register_serializer(app_settings.SERIALIZER_COMPRESS_THRESHOLD)
+
 
 class CeleryConfig:
     broker_transport = 'pyamqp'
     broker_use_ssl = not bool(os.getenv('DISABLESSL', ''))
-    task_serializer = 'pickle'
+    task_serializer = app_settings.TASK_SERIALIZER
     result_serializer = 'pickle'
-    accept_content = ['json', 'pickle']
+    accept_content = ['json', 'pickle', SERIALIZER_NAME]
     imports = 'dcumiddleware.run'
     worker_hijack_root_logger = False
     task_acks_late = True
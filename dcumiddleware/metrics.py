@@ -1,5 +1,72 @@
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from typing import Callable
+
 from elasticapm.metrics.base_metrics import MetricsSet
 
+SUCCESS = 'success'
+FAILURE = 'failure'
+# Upper bounds of the stage.duration.histogram buckets, in milliseconds
+STAGE_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, float('inf'))
+
 
 class Metrics(MetricsSet):
-    pass
+    """
+    The middleware's APM metric set. Besides the counters and gauges recorded throughout the pipeline, it times each
+    pipeline stage and external dependency as stage.duration, labelled with the stage and its outcome.
+    """
+
+    def __init__(self, registry):
+        super().__init__(registry)
+        # The stage metrics by (stage, outcome), so that recording one skips the metric set's lock and label sorting
+        self._stages = {}
+
+    def record_stage(self, stage: str, outcome: str, seconds: float) -> None:
+        metrics = self._stages.get((stage, outcome))
+        if metrics is None:
+            labels = {'stage': stage, 'outcome': outcome}
+            metrics = self._stages[(stage, outcome)] = (
+                self.timer('stage.duration', reset_on_collect=True, unit='us', **labels),
+                self.histogram('stage.duration.histogram', reset_on_collect=True, unit='ms',
+                               buckets=list(STAGE_BUCKETS), **labels)
+            )
+        timer, histogram = metrics
+        timer.update(int(seconds * 1000000))
+        histogram.update(seconds * 1000)
+
+
+@contextmanager
+def timed(metrics, stage: str):
+    """
+    Records the time spent in the block as the named stage, with a failure outcome when it raises.
+    :param metrics: The Metrics set, or None to record nothing
+    """
+    start = time.perf_counter()
+    outcome = FAILURE
+    try:
+        yield
+        outcome = SUCCESS
+    finally:
+        if metrics is not None:
+            metrics.record_stage(stage, outcome, time.perf_counter() - start)
+
+
+def timed_call(metrics, stage: str, fn: Callable) -> Callable:
+    """
+    Wraps fn, e.g. a lookup submitted to an EnrichmentExecutor, so that each call is timed as the named stage.
+    Coroutine functions stay coroutine functions.
+    """
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def timed_coroutine(*args, **kwargs):
+            with timed(metrics, stage):
+                return await fn(*args, **kwargs)
+        return timed_coroutine
+
+    @functools.wraps(fn)
+    def timed_function(*args, **kwargs):
+        with timed(metrics, stage):
+            return fn(*args, **kwargs)
+    return timed_function
@@ -1,30 +1,49 @@
 import logging.config
 import os
 import socket
-from typing import Union
+import time
+from typing import Optional, Union
 from urllib.parse import quote, urlparse
 from uuid import UUID
 
 import yaml
 from celery import Celery, bootsteps, chain
+from celery.signals import task_postrun, task_prerun, worker_process_init
 from celery.utils.log import get_task_logger
 from csetutils.celery import instrument
 from csetutils.services.irm import IRMClient
 from csetutils.services.models.report import ReportStates, ReportUpdate
 from dcdatabase.kelvinmongo import KelvinMongo
 from dcdatabase.phishstorymongo import PhishstoryMongo
-from func_timeout import FunctionTimedOut, func_timeout
 from kombu.common import QoS
-from pymongo import MongoClient, collection
+from pymongo import collection
 
 from dcumiddleware.celeryconfig import CeleryConfig
+from dcumiddleware.metrics import FAILURE, timed, timed_call
 from dcumiddleware.settings import AppConfig, config_by_name
 from dcumiddleware.utilities.apihelper import APIHelper
-from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
-from dcumiddleware.utilities.cmapv2helper import CmapV2Helper
+from dcumiddleware.utilities.asyncclient import AsyncEnrichmentExecutor
+from dcumiddleware.utilities.blacklisthelper import BlacklistHelper
+from dcumiddleware.utilities.blacklistindex import get_index
+from dcumiddleware.utilities.circuitbreaker import (CircuitOpenError,
+                                                    get_breaker)
+from dcumiddleware.utilities.cmapcoalescer import get_coalescer
+from dcumiddleware.utilities.cmapservicehelper import (AsyncCmapServiceHelper,
+                                                       CmapServiceHelper)
+from dcumiddleware.utilities.cmapv2helper import (AsyncCmapV2Helper,
+                                                  CmapV2Helper)
+from dcumiddleware.utilities.dnsresolver import get_resolver
+from dcumiddleware.utilities.enrichment import THREAD_POOL, EnrichmentExecutor
+from dcumiddleware.utilities.incidentcontext import (KEY_PHISHSTORY_STATUS,
+                                                     STATUS_CLOSED,
+                                                     IncidentContext)
+from dcumiddleware.utilities.intakehelper import IntakeHelper
 from dcumiddleware.utilities.kelvinhelper import KelvinHelper
+from dcumiddleware.utilities.mongoclients import get_collection, get_shared
+from dcumiddleware.utilities.retrypolicy import PolicyTask, RetryPolicy
 from dcumiddleware.utilities.routinghelper import RoutingHelper
-from dcumiddleware.utilities.shopperhelper import ShopperApiHelper
+from dcumiddleware.utilities.shopperhelper import (AsyncShopperApiHelper,
+                                                   ShopperApiHelper)
 
 # Grab the correct settings based on environment
 env = os.getenv('sysenv', 'unit-test')
@@ -35,9 +54,10 @@ app.config_from_object(CeleryConfig())
 logger = get_task_logger('celery.tasks')
 log_level = os.getenv('LOG_LEVEL', 'INFO')
 
-ACTION_KEY = 'action'
+ASYNC_ENGINE = 'async'
+FUSED_PIPELINE = 'fused'
+IRM_DEPENDENCY = 'irm'
 BLACKLIST_KEY = 'blacklist'
-BLACKLIST_ENTITY_KEY = 'entity'
 BRAND_KEY = 'brand'
 DATA_KEY = 'data'
 DIABLO_WHMCS = 'Diablo WHMCS'
@@ -81,7 +101,6 @@ TICKET_ID_KEY = '_id'
 VIP_KEY = 'vip'
 
 apm = instrument('middleware', env=env, metric_sets=['dcumiddleware.metrics.Metrics'])
-__db = None
 irm = IRMClient(
     app_settings.SSO_URL,
     app_settings.CMAP_CLIENT_CERT,
@@ -112,72 +131,115 @@ app.steps['consumer'].add(NoChannelGlobalQoS)
 
 # Configure DCU celery metrics
 metricset = apm._metrics.get_metricset('dcumiddleware.metrics.Metrics')
-__bl_collection = None
+# Start times of the running tasks by task id
+_task_starts = {}
+# The async engine only overlaps tickets when they share a process and its event loop, i.e. under the threads pool.
+# A prefork child runs one ticket at a time, and asyncio does not cooperate with gevent or eventlet, so every other
+# pool keeps to the threaded engine.
+use_async_engine = app_settings.ENRICHMENT_ENGINE == ASYNC_ENGINE and app_settings.WORKER_POOL == THREAD_POOL
+if app_settings.ENRICHMENT_ENGINE == ASYNC_ENGINE and not use_async_engine:
+    logger.warning(f'ENRICHMENT_ENGINE={ASYNC_ENGINE} needs WORKER_POOL={THREAD_POOL}, using the threaded engine')
 
 
 def get_bl_mongo_connection() -> collection.Collection:
     """
     Celery works fork the run module into the configured number of processes at start time. PyMongo is not
-    fork safe(see https://pymongo.readthedocs.io/en/stable/faq.html#is-pymongo-fork-safe) so by putting
-    the collection retrieval within the helper function, we ensure that each fork will call and initialize
-    its own MongoClient.
+    fork safe(see https://pymongo.readthedocs.io/en/stable/faq.html#is-pymongo-fork-safe) so the collection
+    is retrieved from the per process client registry rather than at import time.
     """
-    global __bl_collection
-    if not __bl_collection:
-        blacklist_client = MongoClient(app_settings.DBURL)
-        blacklist_db = blacklist_client[app_settings.DB]
-        __bl_collection = blacklist_db[app_settings.BLACKLIST_COLLECTION]
-    return __bl_collection
+    return get_collection(app_settings.DBURL, app_settings.DB, app_settings.BLACKLIST_COLLECTION, app_settings)
 
 
-def is_closed(ticket_id: str):
+def get_incidents_collection() -> collection.Collection:
+    """
+    The phishstory incidents collection, for the bulk operations PhishstoryMongo does not offer. Like the blacklist
+    collection, it shares the pooled client of the worker process.
+    """
+    return get_collection(app_settings.DBURL, app_settings.DB, app_settings.COLLECTION, app_settings)
+
+
+def get_dead_letters_collection() -> collection.Collection:
+    """
+    The intake tasks given up on, which never reached the incidents collection, kept so that they can be replayed.
+    """
+    return get_collection(app_settings.DBURL, app_settings.DB, app_settings.DEAD_LETTER_COLLECTION, app_settings)
+
+
+# How each class of task is retried, see RETRY_POLICIES. _load_and_enrich_data keeps its own fixed retries, after
+# which the ticket is saved as a failed enrichment, and an intake task that is given up on is saved as a dead letter.
+intake_retries = RetryPolicy('intake', app_settings, metricset, get_dead_letters_collection)
+pipeline_retries = RetryPolicy('pipeline', app_settings, metricset)
+attribute_sync_retries = RetryPolicy('attribute_sync', app_settings, metricset)
+
+
+def is_closed(ticket_id: str, incident: IncidentContext = None):
     '''
-    Retrieves the phishstory status of a ticket.
+    Retrieves the current phishstory status of a ticket.
 
     :param ticket_id: The ticket being queried.
+    :param incident: The ticket's context, which keeps the incident read here for reuse by the caller.
     :return: True if the phishstory status of the ticket is closed, False if open, and None if the ticket is not found.
     '''
     try:
-        db = get_db()
-        if ticket_id is not None:
-            data = db.get_incident(ticket_id)
-            if data is not None:
-                return data['phishstory_status'] == 'CLOSED'
-        return None
+        if incident is None:
+            incident = IncidentContext(get_db(), ticket_id, metrics=metricset)
+        return incident.is_closed(refresh=True)
     except Exception as e:
         logging.exception(f'Error querying the phishstory status for ticket {ticket_id}. Error message: {e}')
 
 
-def get_blacklist_info(domain: str, domain_with_subdomain: str, domain_shopper: str, host_shopper: str) -> Union[list, None]:
-    blacklist_collection = get_bl_mongo_connection()
-    domain_bl_record = blacklist_collection.find_one({BLACKLIST_ENTITY_KEY: domain})
-    subdomain_bl_record = blacklist_collection.find_one({BLACKLIST_ENTITY_KEY: domain_with_subdomain})
-    host_shopper_bl_record = blacklist_collection.find_one({BLACKLIST_ENTITY_KEY: host_shopper})
-    domain_shopper_bl_record = blacklist_collection.find_one({BLACKLIST_ENTITY_KEY: domain_shopper})
-
-    # if there are any user_gen matches drop and let GDBS process them.
-    if (domain_bl_record and domain_bl_record.get('category') == 'user_gen') or \
-        (subdomain_bl_record and subdomain_bl_record.get('category') == 'user_gen') or \
-        (host_shopper_bl_record and host_shopper_bl_record.get('category') == 'user_gen') or \
-            (domain_shopper_bl_record and domain_shopper_bl_record.get('category') == 'user_gen'):
-        return None
+def closed_before_enrichment(data: dict) -> bool:
+    '''
+    A cheap check for tickets closed while they waited to be enriched: the status carried on the task, then the
+    status alone read from the incidents collection.
+
+    :param data: The incident the task was given.
+    :return: True if the ticket is closed. When the status cannot be read, False, so that the ticket is enriched and
+    the check after enrichment decides.
+    '''
+    if data.get(KEY_PHISHSTORY_STATUS) == STATUS_CLOSED:
+        return True
+    ticket_id = data.get('ticketId')
+    if ticket_id is None:
+        return False
+    try:
+        with timed(metricset, 'mongo_read'):
+            document = get_incidents_collection().find_one({TICKET_ID_KEY: ticket_id}, {KEY_PHISHSTORY_STATUS: 1})
+    except Exception as e:
+        logging.exception(f'Error querying the phishstory status for ticket {ticket_id}. Error message: {e}')
+        return False
+    return document is not None and document.get(KEY_PHISHSTORY_STATUS) == STATUS_CLOSED
+
+
+@worker_process_init.connect
+def load_blacklist_index(**kwargs):
+    """
+    Loads each worker process's blacklist index at start up rather than on its first ticket.
+    """
+    get_index(get_bl_mongo_connection(), app_settings, metricset)
 
-    if domain_bl_record and domain not in app_settings.ENRICH_ON_SUBDOMAIN:
-        return domain_bl_record.get(ACTION_KEY) if domain_bl_record else None
 
-    if subdomain_bl_record:
-        return subdomain_bl_record.get(ACTION_KEY) if subdomain_bl_record else None
+@task_prerun.connect
+def start_stage_timer(task_id=None, **kwargs):
+    _task_starts[task_id] = time.perf_counter()
 
-    if host_shopper and not domain_shopper:
-        return host_shopper_bl_record.get(ACTION_KEY) if host_shopper_bl_record else None
 
-    if domain_shopper and not host_shopper:
-        return domain_shopper_bl_record.get(ACTION_KEY) if domain_shopper_bl_record else None
+@task_postrun.connect
+def record_stage_timer(task_id=None, task=None, state=None, **kwargs):
+    """
+    Times every task as a pipeline stage named after the task, whose outcome is the task state, e.g. success or retry.
+    """
+    start = _task_starts.pop(task_id, None)
+    if start is not None and metricset is not None:
+        metricset.record_stage(task.name, (state or FAILURE).lower(), time.perf_counter() - start)
 
-    if domain_shopper and host_shopper and domain_shopper_bl_record and host_shopper_bl_record:
-        return host_shopper_bl_record.get(ACTION_KEY) if host_shopper_bl_record else None
 
-    return None
+def get_blacklist_info(domain: str, domain_with_subdomain: str, domain_shopper: str, host_shopper: str) -> Union[list, None]:
+    blacklist_collection = get_bl_mongo_connection()
+    blacklist_helper = BlacklistHelper(blacklist_collection, app_settings.ENRICH_ON_SUBDOMAIN,
+                                       get_index(blacklist_collection, app_settings, metricset), metricset)
+    with timed(metricset, 'blacklist'):
+        return blacklist_helper.get_action(domain, domain_with_subdomain, domain_shopper, host_shopper)
 
 
 def replace_dict(dict_to_replace):
@@ -279,11 +341,13 @@ def validate_abuse_verified(ticket: dict, enrichment: dict, domain: str, ip: str
         enrichment.get(DATA_KEY, {}).get(DOMAIN_Q_KEY, {})[HOST_KEY] = hosted_enrichment
 
 
-def get_db():
-    global __db
-    if not __db:
-        __db = PhishstoryMongo(app_settings)
-    return __db
+def get_db() -> PhishstoryMongo:
+    return get_shared('phishstory', lambda: PhishstoryMongo(app_settings))
+
+
+def get_kelvin_db() -> KelvinMongo:
+    return get_shared('kelvin', lambda: KelvinMongo(app_settings.KELVIN_DBNAME, app_settings.KELVIN_DB_URL,
+                                                    'incidents'))
 
 
 # setup logging
@@ -296,7 +360,7 @@ if os.path.exists(path):
 else:
     logging.basicConfig(level=logging.INFO)
 
-api = APIHelper(app_settings)
+api = APIHelper(app_settings, metricset)
 
 """
 Sample data:
@@ -312,7 +376,9 @@ Sample data:
 
 
 # We want to ack late here - if we get exceptions for any reason, we want the task to keep trying.
-@app.task(name='run.sync_child_safety', acks_late=True, max_retries=None, autoretry_for=(Exception,))
+@app.task(name='run.sync_child_safety', acks_late=True, base=PolicyTask, backoff_policy=intake_retries,
+          max_retries=intake_retries.max_retries, autoretry_for=(Exception,), retry_backoff=intake_retries.backoff,
+          retry_backoff_max=intake_retries.backoff_max, retry_jitter=True)
 def sync_child_safety(data):
     # Migrate some fields to match legacy kelvin-service behavior.
     data['ticketID'] = data['ticketId']
@@ -325,39 +391,117 @@ def sync_child_safety(data):
     kelvin_helper.process(data)
 
 
-@app.task(name='run.sync_customer_security', acks_late=True, max_retries=None, autoretry_for=(Exception,))
+@app.task(name='run.sync_customer_security', acks_late=True, base=PolicyTask, backoff_policy=intake_retries,
+          max_retries=intake_retries.max_retries, autoretry_for=(Exception,), retry_backoff=intake_retries.backoff,
+          retry_backoff_max=intake_retries.backoff_max, retry_jitter=True)
 def sync_customer_security(data):
     # We only want to process each ticket once, we will get a large number of these events
     # during ticket backfills.
     ticketId = data.get('ticketId')
-    db = get_db()
-    result = db.get_incident(ticketId)
-    if not result:
+    incident = IncidentContext(get_db(), ticketId, metrics=metricset)
+    if not incident.get():
         if 'plid' in data:
             data['plid'] = str(int(data['plid']))
         dup = data.get('duplicate', False)
         status = 'DUPLICATE' if dup else 'PROCESSING'
-        db.add_new_incident(ticketId, data, status=status)
+        incident.add(data, status)
         # Only run the pipeline for non-duplicated tickets.
         if not dup:
-            chain(process.s(data))()
+            start_pipeline(data)
+
+
+@app.task(name='run.sync_customer_security_batch', acks_late=True, base=PolicyTask, backoff_policy=intake_retries,
+          max_retries=intake_retries.max_retries, autoretry_for=(Exception,), retry_backoff=intake_retries.backoff,
+          retry_backoff_max=intake_retries.backoff_max, retry_jitter=True)
+def sync_customer_security_batch(tickets):
+    """
+    Batched sync_customer_security for ticket backfills. Adds the tickets that are not already incidents with one
+    lookup and one insert, then starts the pipeline for each new ticket that is not a duplicate.
+    :param tickets: A list of ticket events
+    :return:
+    """
+    intake_helper = IntakeHelper(get_incidents_collection(), metricset)
+    for data in intake_helper.add_new_incidents(tickets):
+        if not data.get('duplicate', False):
+            start_pipeline(data)
 
 
-@app.task(name='run.process', acks_late=True, max_retries=None, autoretry_for=(Exception,))
+def start_pipeline(data: dict) -> None:
+    """
+    Starts processing a new ticket, as a chain of tasks or, with PIPELINE_MODE fused, as one task.
+    """
+    if app_settings.PIPELINE_MODE == FUSED_PIPELINE:
+        process_fused.delay(data)
+    else:
+        chain(process.s(data))()
+
+
+def load_incident(data: dict) -> dict:
+    return IncidentContext(get_db(), data.get('ticketId'), metrics=metricset).get()
+
+
+@app.task(name='run.process', acks_late=True, base=PolicyTask, backoff_policy=pipeline_retries,
+          max_retries=pipeline_retries.max_retries, autoretry_for=(Exception,), retry_backoff=pipeline_retries.backoff,
+          retry_backoff_max=pipeline_retries.backoff_max, retry_jitter=True)
 def process(data):
     """
     Main processing pipeline for incidents submitted from the API
     :param data:
     :return:
     """
-    db = get_db()
-    data = db.get_incident(data.get('ticketId'))
+    # The incident is read here rather than taken from the message, which may be a partial payload or one queued
+    # long ago, and is then carried through the rest of the chain rather than read again by each task.
+    data = load_incident(data)
     chain(_load_and_enrich_data.s(data),
           _check_for_blacklist_auto_actions.s(),
           _route_to_brand_services.s())()
 
 
-@app.task(name='run.sync_attribute', acks_late=True, max_retries=None, autoretry_for=(Exception,))
+@app.task(name='run.process_fused', acks_late=True, bind=True, max_retries=None)
+def process_fused(self, data, stage=0, stage_retries=0):
+    """
+    The pipeline of process, _load_and_enrich_data, _check_for_blacklist_auto_actions and _route_to_brand_services
+    run as one task, with one broker message per ticket instead of four. Each stage is still retried on its own, with
+    the delay and limit of the task it stands in for: a failed stage retries this task from a checkpoint holding the
+    stage and the incident it started with.
+    :param data: The ticket, or at a checkpoint, the incident the stage started with
+    :param stage: The index in fused_stages of the stage to start from
+    :param stage_retries: The number of times that stage has been retried
+    """
+    for index in range(stage, len(fused_stages)):
+        task, run_stage = fused_stages[index]
+        policy = getattr(task, 'backoff_policy', None)
+        if policy is not None and not stage_retries:
+            policy.record_attempt()
+        try:
+            with timed(metricset, task.name):
+                data = run_stage(data, stage_retries == task.max_retries)
+        except Exception as e:
+            countdown = stage_countdown(task, e, stage_retries)
+            if countdown is None:
+                raise
+            raise self.retry(args=(data,), kwargs={'stage': index, 'stage_retries': stage_retries + 1}, exc=e,
+                             countdown=countdown)
+        stage_retries = 0
+    return data
+
+
+def stage_countdown(task, exc: Exception, retries: int) -> Optional[float]:
+    """
+    The seconds process_fused waits before retrying a failed stage, as the stage's own task would be retried.
+    :return: The countdown, or None if the stage is not to be retried
+    """
+    policy = getattr(task, 'backoff_policy', None)
+    if policy is not None:
+        return policy.next_countdown(task.name, exc, retries, dont_retry_for=task.dont_autoretry_for)
+    if task.max_retries is not None and retries >= task.max_retries:
+        return None
+    return task.default_retry_delay
+
+
+@app.task(name='run.sync_attribute', acks_late=True, base=PolicyTask, backoff_policy=attribute_sync_retries,
+          max_retries=attribute_sync_retries.max_retries, autoretry_for=(Exception,), retry_backoff=attribute_sync_retries.backoff,
+          retry_backoff_max=attribute_sync_retries.backoff_max, retry_jitter=True)
 def sync_attribute(ticket_id, field, value):
     """
     Updates P3 mongo ticketId field name with new value.
@@ -367,11 +511,9 @@ def sync_attribute(ticket_id, field, value):
     :return:
     """
     if ticket_id.startswith('DCUK'):
-        kdb = KelvinMongo(app_settings.KELVIN_DBNAME, app_settings.KELVIN_DB_URL, 'incidents')
-        return kdb.update_incident(ticket_id, {field: value})
+        return get_kelvin_db().update_incident(ticket_id, {field: value})
     else:
-        db = get_db()
-        result = db.update_incident(ticket_id, {field: value})
+        result = IncidentContext(get_db(), ticket_id, metrics=metricset).update({field: value})
         if result:
             irmReportId = result.get('irm_report_id')
             if irmReportId:
@@ -383,7 +525,8 @@ def sync_attribute(ticket_id, field, value):
                 elif field == 'closed':
                     update.closedAt = value
                 update.lastModified = result.get('last_modified')
-                irm.update_report(irmReportId, update)
+                with timed(metricset, 'irm'):
+                    get_breaker(IRM_DEPENDENCY, app_settings, metricset).call(irm.update_report, irmReportId, update)
         return result
 
 
@@ -407,48 +550,108 @@ def _load_and_enrich_data(self, data):
     :param data:
     :return:
     """
+    return enrich_incident(data, self.request.retries == self.max_retries)
+
+
+def enrich_incident(data: dict, last_attempt: bool):
+    """
+    The enrichment stage of the pipeline, run by _load_and_enrich_data or, in the fused pipeline, process_fused.
+    :param data: The incident
+    :param last_attempt: True when the stage will not be retried again, so a failed enrichment is saved instead
+    :return: The enriched incident
+    :raises Exception: when the stage should be retried
+    """
     ticket_id = data.get('ticketId')
     domain_name = data.get('sourceDomainOrIp')
     sub_domain_name = data.get('sourceSubDomain')
     source = data.get('source')
     reporter: str = data.get(KEY_REPORTER)
 
+    # Tickets are often closed while they wait in the queue during a backlog, so no lookup is made for them.
+    if closed_before_enrichment(data):
+        logging.info(f'Ticket {ticket_id} is closed. Skipping enrichment.')
+        metricset.counter('enrichment_skipped_closed', reset_on_collect=True).inc(1)
+        data[KEY_PHISHSTORY_STATUS] = STATUS_CLOSED
+        return data
+
     # Ensure we correctly encode all special characters.
     url_path = quote(urlparse(source).path)
-    timeout_in_seconds = 2
     domain_name_ip = sub_domain_ip = ip = None
     cmap_data = {}
-    cmap_helper = CmapServiceHelper(app_settings)
-    shopper_api_helper = ShopperApiHelper(app_settings.SHOPPER_API_URL, app_settings.SHOPPER_API_CERT_PATH,
-                                          app_settings.SHOPPER_API_KEY_PATH)
-    cmapv2_helper = CmapV2Helper(app_settings.CMAP_V2_SERVICE, app_settings.SSO_URL, app_settings.CMAP_CLIENT_CERT, app_settings.CMAP_CLIENT_KEY)
-    db = get_db()
+    if use_async_engine:
+        # Same lookups, issued as coroutines on the process-wide event loop.
+        enrichment = AsyncEnrichmentExecutor(app_settings.ENRICHMENT_DEADLINE, app_settings)
+        cmap_helper = AsyncCmapServiceHelper(app_settings, metricset)
+        shopper_api_helper = AsyncShopperApiHelper(app_settings.SHOPPER_API_URL, app_settings.SHOPPER_API_CERT_PATH,
+                                                   app_settings.SHOPPER_API_KEY_PATH, app_settings, metricset,
+                                                   cache_size=app_settings.SHOPPER_CACHE_SIZE,
+                                                   cache_ttl=app_settings.SHOPPER_CACHE_TTL,
+                                                   negative_ttl=app_settings.SHOPPER_CACHE_NEGATIVE_TTL)
+        cmapv2_helper = AsyncCmapV2Helper(app_settings.CMAP_V2_SERVICE, app_settings.SSO_URL, app_settings.CMAP_CLIENT_CERT, app_settings.CMAP_CLIENT_KEY,
+                                          app_settings, metricset)
+    else:
+        enrichment = EnrichmentExecutor(app_settings.ENRICHMENT_DEADLINE, app_settings)
+        cmap_helper = CmapServiceHelper(app_settings, metricset)
+        shopper_api_helper = ShopperApiHelper(app_settings.SHOPPER_API_URL, app_settings.SHOPPER_API_CERT_PATH,
+                                              app_settings.SHOPPER_API_KEY_PATH, app_settings, metricset,
+                                              cache_size=app_settings.SHOPPER_CACHE_SIZE,
+                                              cache_ttl=app_settings.SHOPPER_CACHE_TTL,
+                                              negative_ttl=app_settings.SHOPPER_CACHE_NEGATIVE_TTL)
+        cmapv2_helper = CmapV2Helper(app_settings.CMAP_V2_SERVICE, app_settings.SSO_URL, app_settings.CMAP_CLIENT_CERT, app_settings.CMAP_CLIENT_KEY,
+                                     app_settings, metricset)
+    dns_resolver = get_resolver(app_settings, metricset, use_async_engine)
+    incident = IncidentContext(get_db(), ticket_id, metrics=metricset)
     had_failed_enrichment = data.pop(FAILED_ENRICHMENT_KEY, False)
 
+    metadata = data.get(KEY_METADATA, {})
+
+    # Start every lookup that only depends on the submitted ticket, then wait on them as they are needed.
     # The transition to customer IDs instead of shopper IDs is starting, but we need to move a portion of the pipeline at a time.
+    # Each lookup is timed as a stage named after its dependency.
+    get_shopper_id = timed_call(metricset, 'shopper', shopper_api_helper.get_shopper_id)
+    resolve = timed_call(metricset, 'dns', dns_resolver.resolve)
+    reporter_lookup = None
     if _is_uuid(reporter):
-        data[KEY_REPORTER_CID] = reporter
-        data[KEY_REPORTER] = shopper_api_helper.get_shopper_id(reporter)
+        reporter_lookup = enrichment.submit(get_shopper_id, reporter)
     elif reporter and reporter.isnumeric():
-        data[KEY_REPORTER_CID] = shopper_api_helper.get_customer_id(reporter)
+        reporter_lookup = enrichment.submit(timed_call(metricset, 'shopper', shopper_api_helper.get_customer_id),
+                                            reporter)
+
+    metadata_shopper_lookup = None
+    if KEY_METADATA in data and (KEY_SHOPPER_ID not in metadata or metadata[KEY_SHOPPER_ID] == '') and KEY_CUSTOMER_ID in metadata:
+        metadata_shopper_lookup = enrichment.submit(get_shopper_id, metadata[KEY_CUSTOMER_ID])
+
+    entitlement_lookup = None
+    if KEY_METADATA in data and KEY_ENTITLEMENT_ID in metadata and KEY_CUSTOMER_ID in metadata:
+        entitlement_lookup = enrichment.submit(
+            timed_call(metricset, 'entitlement', cmap_helper.product_lookup_entitlement),
+            metadata[KEY_CUSTOMER_ID], metadata[KEY_ENTITLEMENT_ID]
+        )
+
+    domain_ip_lookup = enrichment.submit(resolve, domain_name)
+    sub_domain_ip_lookup = enrichment.submit(resolve, sub_domain_name)
+
+    if _is_uuid(reporter):
+        data[KEY_REPORTER_CID] = reporter
+        data[KEY_REPORTER] = enrichment.result(reporter_lookup)
+    elif reporter_lookup:
+        data[KEY_REPORTER_CID] = enrichment.result(reporter_lookup)
     else:
         data[KEY_REPORTER_CID] = None
 
-    if KEY_METADATA in data and (
-            KEY_SHOPPER_ID not in data[KEY_METADATA] or data[KEY_METADATA][KEY_SHOPPER_ID] == '') and KEY_CUSTOMER_ID in \
-            data[KEY_METADATA]:
-        data[KEY_METADATA][KEY_SHOPPER_ID] = shopper_api_helper.get_shopper_id(data[KEY_METADATA][KEY_CUSTOMER_ID])
+    if metadata_shopper_lookup:
+        data[KEY_METADATA][KEY_SHOPPER_ID] = enrichment.result(metadata_shopper_lookup)
         logger.info(
             f'Obtained shopper id {data[KEY_METADATA][KEY_SHOPPER_ID]} for customer id {data[KEY_METADATA][KEY_CUSTOMER_ID]}')
 
     try:
-        domain_name_ip = func_timeout(timeout_in_seconds, socket.gethostbyname, args=(domain_name,))
-    except (FunctionTimedOut, socket.gaierror) as e:
+        domain_name_ip = enrichment.result(domain_ip_lookup, app_settings.DNS_TIMEOUT)
+    except (TimeoutError, socket.gaierror) as e:
         logger.error(f'Error while determining domain IP for {ticket_id} : {e}')
 
     try:
-        sub_domain_ip = func_timeout(timeout_in_seconds, socket.gethostbyname, args=(sub_domain_name,))
-    except (FunctionTimedOut, socket.gaierror) as e:
+        sub_domain_ip = enrichment.result(sub_domain_ip_lookup, app_settings.DNS_TIMEOUT)
+    except (TimeoutError, socket.gaierror) as e:
         logger.error(f'Error while determining sub-domain IP for {ticket_id} : {e}')
 
     # If the domain and sub-domain ips match, then send a CMAP query for the domain, as the domain
@@ -463,17 +666,22 @@ def _load_and_enrich_data(self, data):
 
     cmapv2_data, map_cmapv2 = {}, {}
     try:
-        # Retrieve CMAP data from CMapServiceHelper
-        cmap_data = cmap_helper.domain_query(domain, url_path)
+        # Retrieve CMAP data from CMapServiceHelper and CMAP V2 at the same time
+        use_cache = not (data.get(KEY_ABUSE_VERIFIED) and app_settings.CMAP_CACHE_BYPASS_ABUSE_VERIFIED)
+        domain_query = cmap_helper.domain_query
+        if app_settings.CMAP_BATCH_WINDOW:
+            domain_query = get_coalescer(app_settings, metricset, use_async_engine).domain_query
+        cmap_lookup = enrichment.submit(timed_call(metricset, 'cmap', domain_query), domain, url_path, use_cache)
+        cmapv2_lookup = enrichment.submit(timed_call(metricset, 'cmapv2', cmapv2_helper.lookup_host_by_authority),
+                                          domain)
+        cmap_data = enrichment.result(cmap_lookup)
         try:
-            cmapv2_data = cmapv2_helper.lookup_host_by_authority(domain)
+            cmapv2_data = enrichment.result(cmapv2_lookup)
             map_cmapv2 = cmapv2_helper.convert_cmapv2data(cmapv2_data)
         except Exception:
             pass
-        if KEY_METADATA in data and KEY_ENTITLEMENT_ID in data[KEY_METADATA] and KEY_CUSTOMER_ID in data[KEY_METADATA]:
-            entitlement_id = data[KEY_METADATA][KEY_ENTITLEMENT_ID]
-            customer_id = data[KEY_METADATA][KEY_CUSTOMER_ID]
-            host_data = cmap_helper.product_lookup_entitlement(customer_id, entitlement_id)
+        if entitlement_lookup:
+            host_data = enrichment.result(entitlement_lookup)
             cmap_data.get(DATA_KEY, {}).get(DOMAIN_Q_KEY, {})[HOST_KEY] = host_data
         elif data.get(KEY_ABUSE_VERIFIED):
             validate_abuse_verified(data, cmap_data, domain, ip)
@@ -482,31 +690,41 @@ def _load_and_enrich_data(self, data):
             data[FAILED_ENRICHMENT_KEY] = True
             metricset.counter('failed_enrichment', reset_on_collect=True).inc(1)
         elif had_failed_enrichment:
-            db.remove_field(ticket_id, FAILED_ENRICHMENT_KEY)
+            incident.remove_field(FAILED_ENRICHMENT_KEY)
+    except CircuitOpenError as e:
+        # The dependency is known to be down, so rather than wait on it through every retry, the ticket is saved as a
+        # failed enrichment straight away.
+        logger.warning(f'Skipping enrichment of {ticket_id}: {e}')
+        data[FAILED_ENRICHMENT_KEY] = True
+        metricset.counter('failed_enrichment', reset_on_collect=True).inc(1)
+        metricset.counter('degraded_enrichment', reset_on_collect=True).inc(1)
     except Exception as e:
         # If we have reached the max retries allowed, abort the process and nullify the task chain
-        if self.request.retries == self.max_retries:
+        if last_attempt:
             logger.error(f'Max retries exceeded for {ticket_id} : {e}')
             # Flag DB for the enrichment failure
             data[FAILED_ENRICHMENT_KEY] = True
             metricset.counter('failed_enrichment', reset_on_collect=True).inc(1)
         else:
             logger.error(f'Error while processing: {ticket_id}. Retrying... {e}')
-            self.retry(exc=e)
+            raise
 
     metricset.counter('successful_enrichment', reset_on_collect=True).inc(1)
 
-    # If the ticket is closed, we don't need to update or enrich it.
-    if is_closed(ticket_id):
+    # The ticket may have been closed while it was being enriched, in which case the enrichment is not saved.
+    if is_closed(ticket_id, incident):
         logging.info(f'Ticket {ticket_id} is closed. Skipping enrichment.')
-        data['phishstory_status'] == 'CLOSED'
-        return db.get_incident(ticket_id)
+        metricset.counter('enrichment_discarded_closed', reset_on_collect=True).inc(1)
+        # The status check has just read the closed incident.
+        return incident.get()
     # TODO CMAPT-5069: remove 'shopperID' from cmap_data before sending it to the DB
     # return the result of merging the CMap data with data gathered from the API
-    return db.update_incident(ticket_id, cmap_helper.api_cmap_merge(data, cmap_data, cmapv2_data, map_cmapv2))
+    return incident.update(cmap_helper.api_cmap_merge(data, cmap_data, cmapv2_data, map_cmapv2))
 
 
-@app.task(name='run._check_for_blacklist_auto_actions', acks_late=True, max_retries=None, autoretry_for=(Exception,))
+@app.task(name='run._check_for_blacklist_auto_actions', acks_late=True, base=PolicyTask, backoff_policy=pipeline_retries,
+          max_retries=pipeline_retries.max_retries, autoretry_for=(Exception,), retry_backoff=pipeline_retries.backoff,
+          retry_backoff_max=pipeline_retries.backoff_max, retry_jitter=True)
 def _check_for_blacklist_auto_actions(data):
     """
     Checks if ticket is on blocklist and performs automated actions if applicable
@@ -531,13 +749,14 @@ def _check_for_blacklist_auto_actions(data):
                 result_action = result_action[0]
             if result_action in [FALSE_POSITIVE, RESOLVED_NO_ACTION]:
                 api.close_incident(ticket, result_action)
-                db = get_db()
-                db.update_actions_sub_document(ticket, f'closed as {result_action}')
+                IncidentContext(get_db(), ticket, metrics=metricset).add_action(f'closed as {result_action}')
                 return
     return data
 
 
-@app.task(name='run._route_to_brand_services', acks_late=True, max_retries=None, autoretry_for=(Exception,))
+@app.task(name='run._route_to_brand_services', acks_late=True, base=PolicyTask, backoff_policy=pipeline_retries,
+          max_retries=pipeline_retries.max_retries, autoretry_for=(Exception,), retry_backoff=pipeline_retries.backoff,
+          retry_backoff_max=pipeline_retries.backoff_max, retry_jitter=True)
 def _route_to_brand_services(data):
     """
     Routes data to the appropriate Brand Service to be processed further
@@ -554,4 +773,15 @@ def _route_to_brand_services(data):
 
     db = get_db()
     routing_helper = RoutingHelper(app, api, db)
-    return routing_helper.route(data)
+    with timed(metricset, 'routing'):
+        return routing_helper.route(data)
+
+
+# The stages process_fused runs, each with the chain task whose retry settings it keeps and a function taking the
+# incident and whether this is the stage's last attempt.
+fused_stages = (
+    (process, lambda data, last_attempt: load_incident(data)),
+    (_load_and_enrich_data, lambda data, last_attempt: enrich_incident(data, last_attempt)),
+    (_check_for_blacklist_auto_actions, lambda data, last_attempt: _check_for_blacklist_auto_actions(data)),
+    (_route_to_brand_services, lambda data, last_attempt: _route_to_brand_services(data)),
+)
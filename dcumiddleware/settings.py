@@ -9,6 +9,7 @@ class AppConfig(object):
     DB_HOST = 'localhost'
     BLACKLIST_COLLECTION = 'blacklist'
     COLLECTION = 'incidents'
+    DEAD_LETTER_COLLECTION = 'deadLetters'
 
     # The sub-domains for these domains have the same ip as the domain ip, but we get better
     #  enrichment querying on the sub-domain
@@ -48,6 +49,109 @@ class AppConfig(object):
     IRM_URL = 'https://irm-api.cset.int.dev-gdcorp.tools'
     CMAP_V2_SERVICE = 'https://cmapv2.cset.int.dev-gdcorp.tools'
 
+    # Pooled keep-alive HTTP sessions, one set per worker process, and the connect and read timeouts their requests
+    # default to
+    HTTP_POOL_CONNECTIONS = 4
+    HTTP_POOL_MAXSIZE = 10
+    HTTP_MAX_RETRIES = 2
+    HTTP_RETRY_BACKOFF = 0.2
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 30
+
+    # Connections each pooled MongoClient keeps per server, shared by every task in a worker process
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+
+    # Circuit breakers around CMAP, CMAP V2, the Shopper API, the Abuse API and IRM: the share of the last
+    # CIRCUIT_WINDOW calls that must fail, or take longer than CIRCUIT_SLOW_CALL_SECONDS, to open one, and how long it
+    # stays open before CIRCUIT_HALF_OPEN_PROBES calls are let through to test the dependency
+    CIRCUIT_WINDOW = 20
+    CIRCUIT_MIN_CALLS = 10
+    CIRCUIT_FAILURE_RATE = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS = 10
+    CIRCUIT_OPEN_SECONDS = 30
+    CIRCUIT_HALF_OPEN_PROBES = 1
+
+    # Retries of the intake, pipeline and attribute sync tasks: Celery's retry_backoff, a random delay of up to
+    # backoff * 2 ** retries seconds capped at backoff_max, for at most max_retries retries. Errors that retrying cannot
+    # fix, e.g. a KeyError, are not retried, and intake tasks given up on are saved to DEAD_LETTER_COLLECTION. Once a
+    # task class's retries in the last RETRY_BUDGET_WINDOW seconds exceed RETRY_BUDGET_RATIO of its first attempts,
+    # plus RETRY_BUDGET_MIN_PER_SECOND a second, further retries wait backoff_max.
+    RETRY_POLICIES = {
+        'intake': {'backoff': 2, 'backoff_max': 600, 'max_retries': 20},
+        'pipeline': {'backoff': 2, 'backoff_max': 600, 'max_retries': 20},
+        'attribute_sync': {'backoff': 1, 'backoff_max': 300, 'max_retries': 10},
+    }
+    RETRY_BUDGET_RATIO = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND = 1
+    RETRY_BUDGET_WINDOW = 60
+
+    # Concurrent lookups while enriching a ticket, and the time they may take in total. No HTTP read or DNS query
+    # is allowed to take longer than the deadline.
+    ENRICHMENT_MAX_WORKERS = 8
+    ENRICHMENT_DEADLINE = 60
+    # The Celery pool and concurrency the worker is started with, see the Dockerfile. The green pools, 'gevent' and
+    # 'eventlet', and the 'threads' pool run WORKER_CONCURRENCY tickets at once in one process.
+    WORKER_POOL = os.getenv('WORKER_POOL', 'prefork')
+    WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY') or os.cpu_count())
+    # 'threaded' runs the blocking helpers on a thread pool, 'async' runs their coroutine variants on one event loop
+    # shared by the process's tickets. 'async' needs the 'threads' pool and falls back to 'threaded' under the others.
+    ENRICHMENT_ENGINE = os.getenv('ENRICHMENT_ENGINE', 'threaded')
+    ASYNC_HTTP_LIMIT = 100
+    ASYNC_HTTP_KEEPALIVE = 30
+
+    # Cache of CMAP domainQuery results. A size of 0 disables it; the 'redis' backend shares it between workers.
+    CMAP_CACHE_BACKEND = os.getenv('CMAP_CACHE_BACKEND', 'memory')
+    CMAP_CACHE_URL = os.getenv('CMAP_CACHE_URL')
+    CMAP_CACHE_SIZE = 1024
+    CMAP_CACHE_TTL = 300
+    # Abuse verified tickets always get a fresh domainQuery
+    CMAP_CACHE_BYPASS_ABUSE_VERIFIED = True
+    # Send CMAP GraphQL queries as automatic persisted query hashes. Only enable against a server that supports them.
+    CMAP_PERSISTED_QUERIES = os.getenv('CMAP_PERSISTED_QUERIES', 'false').lower() == 'true'
+    # Concurrent domain queries in a worker wait up to CMAP_BATCH_WINDOW seconds to share one request of at most
+    # CMAP_BATCH_MAX_SIZE domains. A window of 0 sends each query on its own.
+    CMAP_BATCH_WINDOW = float(os.getenv('CMAP_BATCH_WINDOW', '0'))
+    CMAP_BATCH_MAX_SIZE = 25
+
+    # Shopper ID <-> customer ID translations. Failed lookups are cached for the shorter negative TTL.
+    SHOPPER_CACHE_SIZE = 10000
+    SHOPPER_CACHE_TTL = 24 * 60 * 60
+    SHOPPER_CACHE_NEGATIVE_TTL = 60
+
+    # In-memory blacklist index kept current by a change stream ('changestream'), by polling ('poll') or not at all ('off')
+    BLACKLIST_INDEX_MODE = os.getenv('BLACKLIST_INDEX_MODE', 'changestream')
+    BLACKLIST_INDEX_POLL_INTERVAL = 30
+    # Blacklist lookups go straight to MongoDB once the index has not refreshed for this long
+    BLACKLIST_INDEX_MAX_STALENESS = 300
+    # Polling compares this field of every record, so each record must have it
+    BLACKLIST_INDEX_MODIFIED_FIELD = 'modified'
+    BLACKLIST_INDEX_RELOAD_INTERVAL = 60 * 60
+
+    # Serializer for the tasks this service sends: 'pickle', or 'dcu-msgpack' once every consumer accepts it.
+    # dcu-msgpack payloads of at least SERIALIZER_COMPRESS_THRESHOLD bytes are compressed.
+    TASK_SERIALIZER = os.getenv('TASK_SERIALIZER', 'pickle')
+    SERIALIZER_COMPRESS_THRESHOLD = 4096
+
+    # 'payload' sends brand services the enriched incident, 'claim_check' only its ticket ID and routing envelope
+    ROUTING_MODE = os.getenv('ROUTING_MODE', 'payload')
+    # 'chain' runs each ticket as a chain of tasks, 'fused' runs the whole pipeline in one task
+    PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'chain')
+
+    # DNS resolution of ticket domains. Without DNS_NAMESERVERS the system resolver configuration is used.
+    DNS_NAMESERVERS = [nameserver for nameserver in os.getenv('DNS_NAMESERVERS', '').split(',') if nameserver]
+    DNS_PORT = 53
+    DNS_TIMEOUT = 2
+    DNS_CACHE_SIZE = 10000
+    DNS_MAX_TTL = 300
+    DNS_NEGATIVE_TTL = 60
+
+    # SSO tokens are shared per process and refreshed this many seconds before they expire. A rejected token is only
+    # replaced if it is older than JWT_MIN_REFRESH_INTERVAL, and failed refreshes are retried every JWT_RETRY_INTERVAL.
+    JWT_REFRESH_MARGIN = 300
+    JWT_MIN_REFRESH_INTERVAL = 5
+    JWT_RETRY_INTERVAL = 10
+
     def __init__(self):
         self.DB_PASS = quote(os.getenv('DB_PASS', 'password'))
         self.CLIENT_CERT = os.getenv("MONGO_CLIENT_CERT", 'mongo.crt')
@@ -176,6 +280,7 @@ class UnitTestAppConfig():
     DB_HOST = 'localhost'
     BLACKLIST_COLLECTION = 'blacklist'
     COLLECTION = 'incidents'
+    DEAD_LETTER_COLLECTION = 'deadLetters'
 
     SSO_URL = 'https://sso.gdcorp.tools'
     ABUSE_API_URL = 'https://abuse.api.int.dev-godaddy.com/v1/abuse/tickets'
@@ -217,6 +322,77 @@ class UnitTestAppConfig():
     IRM_URL = 'https://irm-api.cset.int.dev-gdcorp.tools'
     CMAP_V2_SERVICE = 'https://cmapv2.cset.int.test-gdcorp.tools'
 
+    HTTP_POOL_CONNECTIONS = 4
+    HTTP_POOL_MAXSIZE = 10
+    HTTP_MAX_RETRIES = 2
+    HTTP_RETRY_BACKOFF = 0.2
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 30
+
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+
+    CIRCUIT_WINDOW = 20
+    CIRCUIT_MIN_CALLS = 10
+    CIRCUIT_FAILURE_RATE = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS = 10
+    CIRCUIT_OPEN_SECONDS = 30
+    CIRCUIT_HALF_OPEN_PROBES = 1
+
+    RETRY_POLICIES = {
+        'intake': {'backoff': 2, 'backoff_max': 600, 'max_retries': 20},
+        'pipeline': {'backoff': 2, 'backoff_max': 600, 'max_retries': 20},
+        'attribute_sync': {'backoff': 1, 'backoff_max': 300, 'max_retries': 10},
+    }
+    RETRY_BUDGET_RATIO = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND = 1
+    RETRY_BUDGET_WINDOW = 60
+
+    ENRICHMENT_MAX_WORKERS = 8
+    ENRICHMENT_DEADLINE = 60
+    WORKER_POOL = os.getenv('WORKER_POOL', 'prefork')
+    WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY') or os.cpu_count())
+    ENRICHMENT_ENGINE = os.getenv('ENRICHMENT_ENGINE', 'threaded')
+    ASYNC_HTTP_LIMIT = 100
+    ASYNC_HTTP_KEEPALIVE = 30
+
+    CMAP_CACHE_BACKEND = 'memory'
+    CMAP_CACHE_URL = None
+    CMAP_CACHE_SIZE = 0
+    CMAP_CACHE_TTL = 300
+    CMAP_CACHE_BYPASS_ABUSE_VERIFIED = True
+    CMAP_PERSISTED_QUERIES = False
+    CMAP_BATCH_WINDOW = 0
+    CMAP_BATCH_MAX_SIZE = 25
+
+    SHOPPER_CACHE_SIZE = 0
+    SHOPPER_CACHE_TTL = 24 * 60 * 60
+    SHOPPER_CACHE_NEGATIVE_TTL = 60
+
+    BLACKLIST_INDEX_MODE = 'off'
+    BLACKLIST_INDEX_POLL_INTERVAL = 30
+    BLACKLIST_INDEX_MAX_STALENESS = 300
+    # Polling compares this field of every record, so each record must have it
+    BLACKLIST_INDEX_MODIFIED_FIELD = 'modified'
+    BLACKLIST_INDEX_RELOAD_INTERVAL = 60 * 60
+
+    TASK_SERIALIZER = os.getenv('TASK_SERIALIZER', 'pickle')
+    SERIALIZER_COMPRESS_THRESHOLD = 4096
+
+    ROUTING_MODE = os.getenv('ROUTING_MODE', 'payload')
+    PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'chain')
+
+    DNS_NAMESERVERS = []
+    DNS_PORT = 53
+    DNS_TIMEOUT = 2
+    DNS_CACHE_SIZE = 0
+    DNS_MAX_TTL = 300
+    DNS_NEGATIVE_TTL = 60
+
+    JWT_REFRESH_MARGIN = 300
+    JWT_MIN_REFRESH_INTERVAL = 5
+    JWT_RETRY_INTERVAL = 10
+
 
 config_by_name = {'dev': DevelopmentAppConfig, 'prod': ProductionAppConfig, 'ote': OTEAppConfig,
                   'unit-test': UnitTestAppConfig, 'test': TestAppConfig}
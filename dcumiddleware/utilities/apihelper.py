@@ -1,25 +1,30 @@
 import logging
 from functools import partial
-from json import loads
 from typing import Optional
 
-import requests
-
 from dcumiddleware.settings import AppConfig
+from dcumiddleware.utilities.circuitbreaker import get_breaker, server_error
+from dcumiddleware.utilities.httpsession import get_session
+from dcumiddleware.utilities.jwtmanager import get_password_token_manager
 
 
 class APIHelper(object):
     """
     This class handles access to the DCU API
     """
+    SESSION_NAME = 'abuse-api'
 
-    def __init__(self, settings: AppConfig):
+    def __init__(self, settings: AppConfig, metrics=None):
+        """
+        :param settings: The application settings
+        :param metrics: An optional APM metric set that the Abuse API circuit breaker reports in
+        """
         self._logger = logging.getLogger(__name__)
+        self._settings = settings
+        self._metrics = metrics
         self._url = settings.ABUSE_API_URL
-        self._sso_endpoint = f'{settings.SSO_URL}/v1/api/token'
-        self._user = settings.SSO_USER
-        self._password = settings.SSO_PASSWORD
-        self._cached_jwt = None
+        self._tokens = get_password_token_manager(f'{settings.SSO_URL}/v1/api/token', settings.SSO_USER,
+                                                  settings.SSO_PASSWORD, settings)
 
     def close_incident(self, ticket_id, close_reason):
         """
@@ -34,11 +39,12 @@ class APIHelper(object):
             'close_reason': close_reason
         }
         try:
-            api_call = partial(requests.patch, f'{self._url}/{ticket_id}', json=payload, headers=headers)
-            r = api_call()
+            api_call = partial(get_session(self.SESSION_NAME, self._settings).patch, f'{self._url}/{ticket_id}', json=payload, headers=headers)
+            breaker = get_breaker(self.SESSION_NAME, self._settings, self._metrics)
+            r = breaker.call(api_call, failed=server_error)
             if r.status_code in [401, 403]:
                 headers['Authorization'] = self.get_jwt(True)
-                r = api_call()
+                r = breaker.call(api_call, failed=server_error)
             if r.status_code != 204:
                 self._logger.warning('Unable to update ticket {} {}'.format(ticket_id, r.content))
         except Exception as e:
@@ -46,17 +52,6 @@ class APIHelper(object):
 
     def get_jwt(self, force_refresh: bool = False) -> Optional[str]:
         """
-        Pull down JWT via username/password.
+        Pull down JWT via username/password, shared by every helper in the process.
         """
-        if self._cached_jwt is None or force_refresh:
-            try:
-                response = requests.post(self._sso_endpoint, json={'username': self._user, 'password': self._password}, params={'realm': 'idp'})
-                response.raise_for_status()
-
-                body = loads(response.text)
-                # Expected return body.get {'type': 'signed-jwt', 'id': 'XXX', 'code': 1, 'message': 'Success', 'data': JWT}
-                self._cached_jwt = body.get('data')
-            except Exception as e:
-                self._logger.error(e)
-
-        return self._cached_jwt
+        return self._tokens.get(force_refresh)
@@ -0,0 +1,131 @@
+import asyncio
+import os
+import ssl
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional, Tuple
+
+import aiohttp
+
+from dcumiddleware.settings import AppConfig
+from dcumiddleware.utilities.enrichment import EnrichmentExecutor
+
+
+class AsyncResponse:
+    """
+    The parts of an HTTP response the helpers read, captured before the connection is released to the pool.
+    """
+
+    def __init__(self, status: int, text: str):
+        self.status = status
+        self.text = text
+
+
+class AsyncHttpClient:
+    """
+    A single non-blocking HTTP client per worker process. It owns an event loop running on a background
+    thread and one aiohttp session, so every ticket processed by the process shares the same connection pool
+    and can keep its lookups in flight while other tickets wait on theirs.
+    """
+
+    def __init__(self, settings: AppConfig):
+        """
+        :param settings: The application settings the connection pool and request timeouts are read from
+        """
+        self._settings = settings
+        self._loop = asyncio.new_event_loop()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._ssl_contexts: Dict[Tuple[str, str], ssl.SSLContext] = {}
+        self._thread = threading.Thread(target=self._loop.run_forever, name='async-http', daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine) -> Future:
+        """
+        Schedules a coroutine on the client's event loop from any thread.
+        :return: A concurrent.futures.Future for the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._settings.ASYNC_HTTP_LIMIT,
+                                             keepalive_timeout=self._settings.ASYNC_HTTP_KEEPALIVE)
+            # No read may outlast the enrichment deadline of the ticket waiting on it.
+            timeout = aiohttp.ClientTimeout(sock_connect=self._settings.HTTP_CONNECT_TIMEOUT,
+                                            sock_read=min(self._settings.HTTP_READ_TIMEOUT,
+                                                          self._settings.ENRICHMENT_DEADLINE))
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    def _ssl_context(self, cert: Optional[Tuple[str, str]]):
+        if not cert or not all(cert):
+            return None
+        context = self._ssl_contexts.get(cert)
+        if context is None:
+            context = self._ssl_contexts[cert] = ssl.create_default_context()
+            context.load_cert_chain(*cert)
+        return context
+
+    async def request(self, method: str, url: str, cert: Optional[Tuple[str, str]] = None, **kwargs) -> AsyncResponse:
+        """
+        Issues a request on the shared session.
+        :param method: The HTTP method
+        :param url: The full URL
+        :param cert: An optional (cert, key) pair to present for mTLS
+        :param kwargs: Passed through to aiohttp, e.g. headers, params, data or json
+        :return: The status and body of the response
+        """
+        ssl_context = self._ssl_context(cert)
+        if ssl_context is not None:
+            kwargs['ssl'] = ssl_context
+        async with self._get_session().request(method, url, **kwargs) as response:
+            return AsyncResponse(response.status, await response.text())
+
+    def close(self) -> None:
+        if self._session is not None:
+            self.run(self._session.close()).result()
+            self._session = None
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+_client: Optional[AsyncHttpClient] = None
+_client_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def get_client(settings: AppConfig) -> AsyncHttpClient:
+    """
+    Returns the process-wide client. The event loop thread does not survive a fork, so the client is
+    tracked per process id and created on first use in each Celery child.
+    :param settings: The application settings the client is built with on first use
+    """
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = AsyncHttpClient(settings)
+            _client_pid = os.getpid()
+        return _client
+
+
+def _after_fork_in_child() -> None:
+    global _lock, _client
+    _lock = threading.Lock()
+    _client = None
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class AsyncEnrichmentExecutor(EnrichmentExecutor):
+    """
+    Runs a ticket's lookups on the process-wide event loop. Coroutine functions, such as the async helper
+    methods, are scheduled on the loop; blocking callables still go to the enrichment thread pool. The task waiting
+    on a ticket's lookups still blocks its thread, so the loop only has several tickets in flight when the worker
+    runs them on Celery's threads pool.
+    """
+
+    def _start(self, fn: Callable, *args) -> Future:
+        if asyncio.iscoroutinefunction(fn):
+            # Cancelling the returned future cancels the coroutine, which releases its connection back to the pool.
+            return get_client(self._settings).run(fn(*args))
+        return super()._start(fn, *args)
@@ -0,0 +1,93 @@
+from typing import Dict, Iterable, Optional, Union
+
+from pymongo import collection
+
+from dcumiddleware.utilities.blacklistindex import BlacklistIndex
+
+
+class BlacklistHelper:
+    """
+    Decides the automated action for a ticket from the blacklist records of its domain, sub-domain and shoppers.
+    """
+    KEY_ACTION = 'action'
+    KEY_CATEGORY = 'category'
+    KEY_ENTITY = 'entity'
+    USER_GEN = 'user_gen'
+
+    def __init__(self, blacklist_collection: collection.Collection, enrich_on_subdomain: set,
+                 index: Optional[BlacklistIndex] = None, metrics=None):
+        """
+        :param blacklist_collection: The blacklist collection
+        :param enrich_on_subdomain: Domains whose sub-domains are blacklisted individually
+        :param index: An optional in-memory index that is used instead of the collection while it is fresh
+        :param metrics: An optional APM metric set that index hits and fallbacks are counted in
+        """
+        self._collection = blacklist_collection
+        self._enrich_on_subdomain = enrich_on_subdomain
+        self._index = index
+        self._metrics = metrics
+
+    def _count(self, name: str) -> None:
+        if self._metrics is not None:
+            self._metrics.counter(name, reset_on_collect=True).inc(1)
+
+    def find_records(self, entities: Iterable[Optional[str]]) -> Dict[Optional[str], dict]:
+        """
+        Retrieves the records for every entity from the index, or from the collection in a single round trip
+        while the index is missing or stale.
+        :param entities: The entities to look up. Duplicates are only queried once.
+        :return: A dict of entity to its blacklist record, for the entities that have one
+        """
+        entities = list(dict.fromkeys(entities))
+        if self._index is not None:
+            if self._index.is_fresh():
+                self._count('blacklist_index_hit')
+                return self._index.find_records(entities)
+            self._count('blacklist_index_fallback')
+        records = {}
+        for record in self._collection.find({self.KEY_ENTITY: {'$in': entities}}):
+            # Keep the first match, as find_one would.
+            records.setdefault(record.get(self.KEY_ENTITY), record)
+        return records
+
+    def get_action(self, domain: str, domain_with_subdomain: str, domain_shopper: str,
+                   host_shopper: str) -> Union[list, str, None]:
+        """
+        :return: The action of the highest precedence matching record, or None
+        """
+        records = self.find_records([domain, domain_with_subdomain, host_shopper, domain_shopper])
+        return self.resolve_action(records, domain, domain_with_subdomain, domain_shopper, host_shopper)
+
+    def resolve_action(self, records: Dict[Optional[str], dict], domain: str, domain_with_subdomain: str,
+                       domain_shopper: str, host_shopper: str) -> Union[list, str, None]:
+        """
+        Applies the blacklist precedence rules to the records found for a ticket.
+        :param records: A dict of entity to blacklist record, as returned by find_records
+        :return: The action of the highest precedence matching record, or None
+        """
+        domain_bl_record = records.get(domain)
+        subdomain_bl_record = records.get(domain_with_subdomain)
+        host_shopper_bl_record = records.get(host_shopper)
+        domain_shopper_bl_record = records.get(domain_shopper)
+
+        # if there are any user_gen matches drop and let GDBS process them.
+        for record in (domain_bl_record, subdomain_bl_record, host_shopper_bl_record, domain_shopper_bl_record):
+            if record and record.get(self.KEY_CATEGORY) == self.USER_GEN:
+                return None
+
+        if domain_bl_record and domain not in self._enrich_on_subdomain:
+            return domain_bl_record.get(self.KEY_ACTION)
+
+        if subdomain_bl_record:
+            return subdomain_bl_record.get(self.KEY_ACTION)
+
+        if host_shopper and not domain_shopper:
+            return host_shopper_bl_record.get(self.KEY_ACTION) if host_shopper_bl_record else None
+
+        if domain_shopper and not host_shopper:
+            return domain_shopper_bl_record.get(self.KEY_ACTION) if domain_shopper_bl_record else None
+
+        if domain_shopper and host_shopper and domain_shopper_bl_record and host_shopper_bl_record:
+            return host_shopper_bl_record.get(self.KEY_ACTION)
+
+        return None
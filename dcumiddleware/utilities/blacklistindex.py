@@ -0,0 +1,268 @@
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from pymongo import collection
+from pymongo.errors import OperationFailure
+
+CHANGE_STREAM_MODE = 'changestream'
+POLL_MODE = 'poll'
+OFF_MODE = 'off'
+
+
+class BlacklistIndex:
+    """
+    An in-memory copy of the blacklist collection, keyed on entity, that is loaded once and then kept current
+    by a background thread. The collection is small and rarely written, so a worker can answer every blacklist
+    lookup from memory.
+
+    In change stream mode the thread applies inserts, updates and deletes as MongoDB reports them. Change streams
+    need a replica set, so the index falls back to poll mode when the server refuses one. In poll mode the thread
+    reads the id and modified field of every record each poll, fetches the records that are new or whose modified
+    field changed, and drops those that were deleted. Every record must carry the modified field, otherwise its
+    changes cannot be seen and the refresh fails. The whole collection is still reloaded every reload interval.
+
+    A refresh failure is logged and retried. Callers should check is_fresh() and query the collection directly
+    while the index is stale.
+    """
+    KEY_ENTITY = 'entity'
+    KEY_ID = '_id'
+
+    def __init__(self, blacklist_collection: collection.Collection, mode: str, poll_interval: float,
+                 max_staleness: float, modified_field: str, reload_interval: float, metrics=None):
+        """
+        :param blacklist_collection: The blacklist collection
+        :param mode: CHANGE_STREAM_MODE or POLL_MODE
+        :param poll_interval: Seconds between polls, and the longest a change stream waits before reporting in
+        :param max_staleness: Seconds without a successful refresh after which the index is no longer used
+        :param modified_field: The record timestamp that poll mode compares
+        :param reload_interval: Seconds between full reloads in poll mode
+        :param metrics: An optional APM metric set that the index size and staleness are reported to
+        """
+        self._logger = logging.getLogger(__name__)
+        self._collection = blacklist_collection
+        self._mode = mode
+        self._poll_interval = poll_interval
+        self._max_staleness = max_staleness
+        self._modified_field = modified_field
+        self._reload_interval = reload_interval
+        self._metrics = metrics
+        self._records: Dict[object, dict] = {}
+        self._by_entity: Dict[Optional[str], dict] = {}
+        self._loaded_at: Optional[float] = None
+        self._refreshed_at: Optional[float] = None
+        self._last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='blacklist-index', daemon=True)
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def start(self) -> 'BlacklistIndex':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def staleness(self) -> float:
+        """
+        :return: Seconds since the index was last known to be current, or infinity if it has never loaded
+        """
+        refreshed_at = self._refreshed_at
+        return math.inf if refreshed_at is None else time.monotonic() - refreshed_at
+
+    def is_fresh(self) -> bool:
+        return self.staleness() <= self._max_staleness
+
+    def find_records(self, entities: Iterable[Optional[str]]) -> Dict[Optional[str], dict]:
+        """
+        The in-memory counterpart of BlacklistHelper.find_records.
+        :return: A dict of entity to its blacklist record, for the entities that have one
+        """
+        by_entity = self._by_entity
+        return {entity: by_entity[entity] for entity in entities if entity in by_entity}
+
+    def stats(self) -> dict:
+        """
+        :return: The size and health of the index, for logging and metrics
+        """
+        staleness = self.staleness()
+        self._gauge('blacklist_index_size', len(self._by_entity))
+        self._gauge('blacklist_index_staleness', -1 if staleness == math.inf else staleness)
+        return {
+            'mode': self._mode,
+            'size': len(self._by_entity),
+            'staleness': staleness,
+            'fresh': staleness <= self._max_staleness,
+            'last_error': self._last_error
+        }
+
+    def _gauge(self, name: str, value: float) -> None:
+        if self._metrics is not None:
+            self._metrics.gauge(name).val = value
+
+    def _publish(self) -> None:
+        """
+        Rebuilds the entity lookup from the records. Readers keep using the previous dict until it is swapped in.
+        Where several records share an entity the first one wins, as it would for find_one.
+        """
+        by_entity = {}
+        for record in self._records.values():
+            by_entity.setdefault(record.get(self.KEY_ENTITY), record)
+        self._by_entity = by_entity
+
+    def _mark_fresh(self) -> None:
+        self._refreshed_at = time.monotonic()
+        self._last_error = None
+        self.stats()
+
+    def _modified(self, record: dict):
+        """
+        :raises RuntimeError: when the record has no modified field, so that poll mode cannot see its changes
+        """
+        modified = record.get(self._modified_field)
+        if modified is None:
+            raise RuntimeError(f'Blacklist record {record[self.KEY_ID]} has no {self._modified_field} field, '
+                               f'so its changes cannot be polled')
+        return modified
+
+    def _load(self) -> None:
+        records = {}
+        for record in self._collection.find({}):
+            if self._mode == POLL_MODE:
+                self._modified(record)
+            records[record[self.KEY_ID]] = record
+        with self._lock:
+            self._records = records
+            self._publish()
+        self._loaded_at = time.monotonic()
+        self._mark_fresh()
+        self._logger.info(f'Loaded {len(records)} blacklist records')
+
+    def _upsert(self, records: Iterable[dict]) -> None:
+        with self._lock:
+            for record in records:
+                self._records[record[self.KEY_ID]] = record
+            self._publish()
+
+    def _delete(self, record_ids: Iterable) -> None:
+        with self._lock:
+            deleted = [self._records.pop(record_id, None) for record_id in record_ids]
+            if any(record is not None for record in deleted):
+                self._publish()
+
+    def _apply(self, change: dict) -> None:
+        operation = change.get('operationType')
+        if operation in ('insert', 'update', 'replace'):
+            record = change.get('fullDocument')
+            if record is None:
+                # The record was deleted before its update could be looked up; a delete event follows.
+                return
+            self._upsert([record])
+        elif operation == 'delete':
+            self._delete([change['documentKey'][self.KEY_ID]])
+        elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+            raise RuntimeError(f'Blacklist change stream ended with {operation}')
+
+    def _watch(self) -> None:
+        with self._collection.watch(full_document='updateLookup',
+                                    max_await_time_ms=int(self._poll_interval * 1000)) as stream:
+            # Load once the stream is open, so that no change is missed. Replaying one is harmless.
+            self._load()
+            while not self._stopped.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    self._mark_fresh()
+                else:
+                    self._apply(change)
+
+    def _poll(self) -> None:
+        self._load()
+        while not self._stopped.wait(self._poll_interval):
+            if time.monotonic() - self._loaded_at >= self._reload_interval:
+                self._load()
+                continue
+            self._sync()
+
+    def _sync(self) -> None:
+        """
+        Brings the index up to date from the ids and modified fields of every record in the collection.
+        """
+        current = {record[self.KEY_ID]: self._modified(record)
+                   for record in self._collection.find({}, {self._modified_field: 1})}
+        records = self._records
+        changed = [record_id for record_id, modified in current.items()
+                   if record_id not in records or records[record_id].get(self._modified_field) != modified]
+        if changed:
+            self._upsert(list(self._collection.find({self.KEY_ID: {'$in': changed}})))
+        self._delete([record_id for record_id in records if record_id not in current])
+        self._mark_fresh()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                if self._mode == CHANGE_STREAM_MODE:
+                    self._watch()
+                else:
+                    self._poll()
+            except OperationFailure as e:
+                if self._mode == CHANGE_STREAM_MODE:
+                    self._logger.warning(f'Blacklist change stream unavailable, polling instead: {e}')
+                    self._mode = POLL_MODE
+                    continue
+                self._failed(e)
+            except Exception as e:
+                self._failed(e)
+
+    def _failed(self, e: Exception) -> None:
+        self._last_error = str(e)
+        self._logger.error(f'Unable to refresh the blacklist index: {e}')
+        self.stats()
+        self._stopped.wait(self._poll_interval)
+
+
+_index: Optional[BlacklistIndex] = None
+_index_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def get_index(blacklist_collection: collection.Collection, settings, metrics=None) -> Optional[BlacklistIndex]:
+    """
+    Returns this process's blacklist index, starting it on first use. The refresh thread does not survive a fork,
+    so each Celery child builds its own index.
+    :param blacklist_collection: The blacklist collection, owned by the calling process
+    :param settings: The app settings holding the BLACKLIST_INDEX_* configuration
+    :param metrics: An optional APM metric set
+    :return: The index, or None when the index is turned off
+    """
+    global _index, _index_pid
+    if settings.BLACKLIST_INDEX_MODE == OFF_MODE:
+        return None
+    with _lock:
+        if _index is None or _index_pid != os.getpid():
+            _index = BlacklistIndex(
+                blacklist_collection,
+                settings.BLACKLIST_INDEX_MODE,
+                settings.BLACKLIST_INDEX_POLL_INTERVAL,
+                settings.BLACKLIST_INDEX_MAX_STALENESS,
+                settings.BLACKLIST_INDEX_MODIFIED_FIELD,
+                settings.BLACKLIST_INDEX_RELOAD_INTERVAL,
+                metrics
+            ).start()
+            _index_pid = os.getpid()
+        return _index
+
+
+def _after_fork_in_child() -> None:
+    global _lock, _index
+    _lock = threading.Lock()
+    _index = None
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
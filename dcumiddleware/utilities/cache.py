@@ -0,0 +1,154 @@
+import copy
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+MEMORY_BACKEND = 'memory'
+REDIS_BACKEND = 'redis'
+
+
+class TTLCache:
+    """
+    A bounded, thread-safe in-process cache. Entries expire after their TTL and the least recently used entry is
+    evicted once the cache is full. Values are copied in and out, since callers mutate the enrichment they get back.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: The maximum number of entries kept
+        :param ttl: The default number of seconds an entry is valid for
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        :return: A copy of the cached value, or None when the key is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        return copy.deepcopy(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        :param ttl: Overrides the default TTL for this entry
+        """
+        expires_at = time.monotonic() + (self._ttl if ttl is None else ttl)
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """
+    A cache shared by every worker through a Redis compatible server. Size is bounded by the server's own
+    maxmemory eviction policy. Any error talking to the server is logged and treated as a miss, so an outage
+    only costs the upstream lookups the cache would have saved.
+    """
+
+    def __init__(self, url: str, ttl: float, namespace: str):
+        """
+        :param url: The server URL, e.g. redis://cache:6379/0
+        :param ttl: The default number of seconds an entry is valid for
+        :param namespace: Prefixed to every key
+        """
+        import redis  # Only needed when this backend is configured.
+        self._logger = logging.getLogger(__name__)
+        self._client = redis.Redis.from_url(url)
+        self._ttl = ttl
+        self._namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return f'{self._namespace}:{key}'
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self._client.get(self._key(key))
+            return pickle.loads(value) if value is not None else None
+        except Exception as e:
+            self._logger.error(f'Unable to read {key} from the cache: {e}')
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            ttl_ms = int((self._ttl if ttl is None else ttl) * 1000)
+            self._client.set(self._key(key), pickle.dumps(value), px=ttl_ms)
+        except Exception as e:
+            self._logger.error(f'Unable to write {key} to the cache: {e}')
+
+    def delete(self, key: str) -> None:
+        try:
+            self._client.delete(self._key(key))
+        except Exception as e:
+            self._logger.error(f'Unable to delete {key} from the cache: {e}')
+
+    def clear(self) -> None:
+        try:
+            keys = list(self._client.scan_iter(match=self._key('*')))
+            if keys:
+                self._client.delete(*keys)
+        except Exception as e:
+            self._logger.error(f'Unable to clear the {self._namespace} cache: {e}')
+
+
+_caches: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_cache(name: str, backend: str, maxsize: int, ttl: float, url: Optional[str] = None):
+    """
+    Returns the process-wide cache registered under name, creating it on first use.
+    :param name: Identifies the cache, and namespaces its keys in a shared backend
+    :param backend: MEMORY_BACKEND or REDIS_BACKEND
+    :param maxsize: Entries kept by the in-process backend. A size of 0 disables caching.
+    :param ttl: Seconds an entry is valid for
+    :param url: The server URL for the Redis backend
+    :return: The cache, or None when caching is disabled
+    """
+    if maxsize <= 0 or ttl <= 0:
+        return None
+    with _lock:
+        cache = _caches.get(name)
+        if cache is None:
+            if backend == REDIS_BACKEND:
+                cache = RedisCache(url, ttl, name)
+            else:
+                cache = TTLCache(maxsize, ttl)
+            _caches[name] = cache
+        return cache
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    # In-process caches are rebuilt per Celery child rather than sharing the parent's locks.
+    _lock = threading.Lock()
+    _caches.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
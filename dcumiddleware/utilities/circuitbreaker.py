@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from dcumiddleware.settings import AppConfig
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+# The circuit_breaker_state gauge value of each state
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+_breakers: Dict[str, 'CircuitBreaker'] = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised in place of a call to a dependency whose circuit breaker is open.
+    """
+
+
+def server_error(response) -> bool:
+    """
+    A failed predicate for calls returning a requests or async client response.
+    """
+    status = getattr(response, 'status_code', None) or getattr(response, 'status', 0)
+    return status >= 500
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that is failing, so that tickets fail fast instead of each waiting out its timeouts.
+    The breaker opens when at least CIRCUIT_FAILURE_RATE of the last CIRCUIT_WINDOW calls failed, counting calls
+    slower than CIRCUIT_SLOW_CALL_SECONDS as failures, once CIRCUIT_MIN_CALLS calls have been made. While open, calls
+    raise CircuitOpenError. After CIRCUIT_OPEN_SECONDS it lets CIRCUIT_HALF_OPEN_PROBES calls through, and closes
+    again when they succeed or reopens when one fails.
+    """
+
+    def __init__(self, name: str, settings: AppConfig, metrics=None):
+        """
+        :param name: The dependency, which labels the breaker's metrics
+        :param settings: The application settings holding the CIRCUIT_* thresholds
+        :param metrics: An optional APM metric set that states, transitions and rejected calls are recorded in
+        """
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        self.metrics = metrics
+        self._settings = settings
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=settings.CIRCUIT_WINDOW)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        self._logger.warning(f'Circuit breaker for {self.name} is now {state}')
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._probes = 0
+        if self.metrics is not None:
+            self.metrics.gauge('circuit_breaker_state', dependency=self.name).val = STATE_VALUES[state]
+            self.metrics.counter('circuit_breaker_transitions', reset_on_collect=True, dependency=self.name,
+                                 state=state).inc(1)
+
+    def _before_call(self) -> None:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self._settings.CIRCUIT_OPEN_SECONDS:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self._probes < self._settings.CIRCUIT_HALF_OPEN_PROBES:
+                self._probes += 1
+                return
+        if self.metrics is not None:
+            self.metrics.counter('circuit_breaker_rejected', reset_on_collect=True, dependency=self.name).inc(1)
+        raise CircuitOpenError(f'Circuit breaker for {self.name} is open')
+
+    def _after_call(self, failed: bool, seconds: float) -> None:
+        failed = failed or seconds > self._settings.CIRCUIT_SLOW_CALL_SECONDS
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._transition(OPEN)
+                elif len(self._outcomes) + 1 >= self._settings.CIRCUIT_HALF_OPEN_PROBES:
+                    self._transition(CLOSED)
+                else:
+                    self._outcomes.append(False)
+            elif self.state == CLOSED:
+                self._outcomes.append(failed)
+                if len(self._outcomes) >= self._settings.CIRCUIT_MIN_CALLS and \
+                        sum(self._outcomes) >= self._settings.CIRCUIT_FAILURE_RATE * len(self._outcomes):
+                    self._transition(OPEN)
+
+    def call(self, fn: Callable, *args, failed: Optional[Callable[[Any], bool]] = None, **kwargs) -> Any:
+        """
+        Calls fn unless the breaker is open.
+        :param failed: Tells whether a returned result is a failure, e.g. server_error; exceptions always are
+        :raises CircuitOpenError: when the breaker is open
+        """
+        self._before_call()
+        start = time.monotonic()
+        call_failed = True
+        try:
+            result = fn(*args, **kwargs)
+            call_failed = failed is not None and failed(result)
+            return result
+        finally:
+            # Also on a BaseException, e.g. SoftTimeLimitExceeded, so that a half-open probe is never left in use.
+            self._after_call(call_failed, time.monotonic() - start)
+
+    async def call_async(self, fn: Callable, *args, failed: Optional[Callable[[Any], bool]] = None, **kwargs) -> Any:
+        """
+        call for coroutine functions.
+        """
+        self._before_call()
+        start = time.monotonic()
+        call_failed = True
+        try:
+            result = await fn(*args, **kwargs)
+            call_failed = failed is not None and failed(result)
+            return result
+        finally:
+            # Also on a BaseException, e.g. SoftTimeLimitExceeded, so that a half-open probe is never left in use.
+            self._after_call(call_failed, time.monotonic() - start)
+
+
+def get_breaker(name: str, settings: AppConfig, metrics=None) -> CircuitBreaker:
+    """
+    Returns the process-wide circuit breaker for a dependency, creating it on first use.
+    :param settings: The application settings the breaker is created with
+    :param metrics: An APM metric set for the breaker, if it has none yet
+    """
+    with _lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, settings, metrics)
+        elif breaker.metrics is None:
+            breaker.metrics = metrics
+        return breaker
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    _lock = threading.Lock()
+    # Each process judges its dependencies from its own calls.
+    _breakers.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
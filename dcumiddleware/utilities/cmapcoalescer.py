@@ -0,0 +1,154 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional
+
+from dcumiddleware.utilities.cmapservicehelper import (AsyncCmapServiceHelper,
+                                                       CmapServiceHelper)
+
+_lock = threading.Lock()
+_coalescers: Dict[bool, 'DomainQueryCoalescer'] = {}
+_coalescers_pid: Optional[int] = None
+
+
+class DomainQueryCoalescer:
+    """
+    Batches the domain queries of concurrent callers, DataLoader style. The first caller to arrive waits up to
+    CMAP_BATCH_WINDOW seconds, or until CMAP_BATCH_MAX_SIZE callers have arrived, and then sends everyone's
+    queries through domain_query_many while the others wait on their share of the result.
+    """
+
+    def __init__(self, cmap_helper: CmapServiceHelper, window: float, max_size: int, metrics=None):
+        """
+        :param cmap_helper: The helper the batched queries are sent through
+        :param window: Seconds the first query of a batch waits for others to join it
+        :param max_size: The number of queries that sends a batch without waiting out the window
+        :param metrics: An optional APM metric set that batches and the queries coalesced into them are counted in
+        """
+        self._cmap_helper = cmap_helper
+        self._window = window
+        self._max_size = max_size
+        self._metrics = metrics
+        self._lock = threading.Lock()
+        self._pending = []
+        self._full = threading.Event()
+
+    def _count(self, batch: List[tuple]) -> None:
+        if self._metrics is not None:
+            self._metrics.counter('cmap_batches', reset_on_collect=True).inc(1)
+            self._metrics.counter('cmap_batched_queries', reset_on_collect=True).inc(len(batch))
+
+    @staticmethod
+    def _groups(batch: List[tuple]):
+        """
+        Splits a batch by use_cache, yielding each group's entries and (domain, path) pairs.
+        """
+        for use_cache in {entry[2] for entry in batch}:
+            entries = [entry for entry in batch if entry[2] == use_cache]
+            yield use_cache, entries, [(domain, path) for domain, path, _, _ in entries]
+
+    @staticmethod
+    def _settle(entries: List[tuple], results: list) -> None:
+        for (_, _, _, future), result in zip(entries, results):
+            if future.done():
+                # The caller was cancelled while it waited.
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _send(self, batch: List[tuple]) -> None:
+        self._count(batch)
+        for use_cache, entries, queries in self._groups(batch):
+            try:
+                results = self._cmap_helper.domain_query_many(queries, use_cache)
+            except Exception as e:
+                results = [e] * len(entries)
+            self._settle(entries, results)
+
+    def domain_query(self, domain: str, path: str, use_cache: bool = True) -> dict:
+        """
+        A drop-in for CmapServiceHelper.domain_query that shares a request with concurrent callers.
+        """
+        future = Future()
+        with self._lock:
+            self._pending.append((domain, path, use_cache, future))
+            leader = len(self._pending) == 1
+            full = self._full
+            if len(self._pending) >= self._max_size:
+                full.set()
+        if leader:
+            full.wait(self._window)
+            with self._lock:
+                batch, self._pending, self._full = self._pending, [], threading.Event()
+            self._send(batch)
+        return future.result()
+
+
+class AsyncDomainQueryCoalescer(DomainQueryCoalescer):
+    """
+    DomainQueryCoalescer whose domain_query is a coroutine. Batches are collected on the running event loop and
+    sent as a task of their own, so a cancelled caller does not cancel the batch it joined.
+    """
+
+    def __init__(self, cmap_helper: AsyncCmapServiceHelper, window: float, max_size: int, metrics=None):
+        super().__init__(cmap_helper, window, max_size, metrics)
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _flush(self) -> None:
+        self._timer.cancel()
+        batch, self._pending = self._pending, []
+        asyncio.ensure_future(self._send_async(batch))
+
+    async def _send_async(self, batch: List[tuple]) -> None:
+        self._count(batch)
+        for use_cache, entries, queries in self._groups(batch):
+            try:
+                results = await self._cmap_helper.domain_query_many(queries, use_cache)
+            except Exception as e:
+                results = [e] * len(entries)
+            self._settle(entries, results)
+
+    async def domain_query(self, domain: str, path: str, use_cache: bool = True) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((domain, path, use_cache, future))
+        if len(self._pending) == 1:
+            self._timer = loop.call_later(self._window, self._flush)
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        return await future
+
+
+def get_coalescer(settings, metrics=None, asynchronous: bool = False) -> DomainQueryCoalescer:
+    """
+    Returns this process's coalescer, so that every task running in the process shares its batches.
+    :param settings: The app settings holding the CMAP_* configuration
+    :param metrics: An optional APM metric set
+    :param asynchronous: True for the coalescer used by the async enrichment engine
+    """
+    global _coalescers_pid
+    with _lock:
+        if _coalescers_pid != os.getpid():
+            _coalescers.clear()
+            _coalescers_pid = os.getpid()
+        if asynchronous not in _coalescers:
+            if asynchronous:
+                coalescer = AsyncDomainQueryCoalescer(AsyncCmapServiceHelper(settings, metrics),
+                                                      settings.CMAP_BATCH_WINDOW, settings.CMAP_BATCH_MAX_SIZE, metrics)
+            else:
+                coalescer = DomainQueryCoalescer(CmapServiceHelper(settings, metrics),
+                                                 settings.CMAP_BATCH_WINDOW, settings.CMAP_BATCH_MAX_SIZE, metrics)
+            _coalescers[asynchronous] = coalescer
+        return _coalescers[asynchronous]
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    _lock = threading.Lock()
+    _coalescers.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,222 @@
+import hashlib
+import json
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+JSON_CONTENT_TYPE = 'application/json'
+# Alias of the i-th domain in a batched domain query
+BATCH_ALIAS = 'd{}'
+
+
+class GraphQLQuery:
+    """
+    A GraphQL document whose request bodies are prebuilt as bytes, so that sending it only serializes the variables.
+    The document is minified once, and its SHA-256 hash identifies it as an automatic persisted query: once the
+    server has seen the document, later requests can send just the hash and the variables.
+    """
+    PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+
+    def __init__(self, document: str):
+        # Whitespace and commas are insignificant in GraphQL, and the document holds no string literals.
+        self.document = ' '.join(document.split())
+        self.sha256_hash = hashlib.sha256(self.document.encode('utf-8')).hexdigest()
+        # Cleared for this process when the server turns out not to support persisted queries.
+        self.persisted_supported = True
+
+        query = b'"query":' + json.dumps(self.document).encode('utf-8')
+        extensions = b'"extensions":' + json.dumps(
+            {'persistedQuery': {'version': 1, 'sha256Hash': self.sha256_hash}}, separators=(',', ':')).encode('utf-8')
+        self._query_prefix = b'{' + query + b',"variables":'
+        self._registering_prefix = b'{' + query + b',' + extensions + b',"variables":'
+        self._persisted_prefix = b'{' + extensions + b',"variables":'
+
+    @staticmethod
+    def _variables(variables: dict) -> bytes:
+        return json.dumps(variables, separators=(',', ':')).encode('utf-8') + b'}'
+
+    def body(self, variables: dict) -> bytes:
+        """
+        :return: A request body carrying the full document
+        """
+        return self._query_prefix + self._variables(variables)
+
+    def registering_body(self, variables: dict) -> bytes:
+        """
+        :return: A request body carrying the full document along with its hash, so the server stores it
+        """
+        return self._registering_prefix + self._variables(variables)
+
+    def persisted_body(self, variables: dict) -> bytes:
+        """
+        :return: A request body carrying only the document hash
+        """
+        return self._persisted_prefix + self._variables(variables)
+
+    def retry_body(self, variables: dict, result) -> Optional[bytes]:
+        """
+        Checks the response to a persisted_body request.
+        :return: The body to send again when the server did not know the hash, else None
+        """
+        if not isinstance(result, dict) or not result.get('errors') or result.get('data'):
+            return None
+        messages = {error.get('message') for error in result['errors'] if isinstance(error, dict)}
+        if self.PERSISTED_QUERY_NOT_FOUND in messages:
+            return self.registering_body(variables)
+        # Any other failure to run a hash-only request means the server does not do persisted queries.
+        self.persisted_supported = False
+        return self.body(variables)
+
+
+# The fields fetched for each domain, shared by the single and batched domain queries
+DOMAIN_QUERY_FIELDS = '''
+  alexaRank
+  similarWebRank {
+    globalRank
+    countryRankUs
+    countryRankIn
+  }
+  apiReseller {
+    child
+    parent
+    parentCustomerId
+    childCustomerId
+  }
+  blacklist
+  domain
+  isDomainHighValue
+  securitySubscription {
+    sucuriProduct
+    products {
+      createdDate
+      sucuriProduct
+      entitlementId
+    }
+  }
+  sslSubscriptions {
+    certCommonName
+    certType
+    createdAt
+    expiresAt
+    entitlementId
+  }
+  host {
+    dataCenter
+    guid
+    containerId
+    brand
+    hostingCompanyName
+    hostingAbuseEmail
+    hostname
+    ip
+    os
+    product
+    shopperId
+    shopperCountry
+    shopperPlid
+    customerId
+    entitlementId
+    shopperCreateDate
+    mwpId
+    createdDate
+    friendlyName
+    privateLabelId
+    username
+    managedLevel
+    firstPassEnrichment
+    secondPassEnrichment
+    abuseReportEmail
+    hostingPlan
+    subscriptionStatus
+    startedAsFreeTrial
+    vip {
+      blacklist
+      portfolioType
+      shopperId
+    }
+  }
+  registrar {
+    brand
+    domainCreateDate
+    domainId
+    registrarAbuseEmail
+    registrarName
+    firstPassEnrichment
+    abuseReportEmail
+  }
+  shopperInfo {
+    domainCount
+    shopperCreateDate
+    shopperId
+    shopperCountry
+    customerId
+    shopperPlid
+    vip {
+      blacklist
+      portfolioType
+      shopperId
+    }
+  }
+'''
+
+DOMAIN_QUERY = GraphQLQuery(
+    f'query DomainQuery($domain: String!, $path: String!) {{ domainQuery(domain: $domain, path: $path) {{{DOMAIN_QUERY_FIELDS}}} }}'
+)
+
+KELVINDB_QUERY = GraphQLQuery('''
+    query KelvinDomainQuery($domain: String!) {
+      domainQuery(domain: $domain) {
+        domain
+        host {
+          brand
+          guid
+          hostingAbuseEmail
+          hostingCompanyName
+          ip
+          product
+          shopperId
+          customerId
+          shopperPlid
+          entitlementId
+        }
+        registrar {
+          brand
+          domainCreateDate
+          domainId
+          registrarAbuseEmail
+          registrarName
+        }
+        shopperInfo {
+          shopperCreateDate
+          shopperId
+          customerId
+          shopperPlid
+        }
+      }
+    }
+''')
+
+
+@lru_cache(maxsize=64)
+def domain_query_batch(size: int) -> GraphQLQuery:
+    """
+    Builds, once per batch size, a query fetching several domains in one request. The i-th domain is aliased as
+    BATCH_ALIAS.format(i) and takes the variables domain<i> and path<i>, see batch_variables.
+    """
+    variables = ', '.join(f'$domain{i}: String!, $path{i}: String!' for i in range(size))
+    fields = ' '.join(
+        f'{BATCH_ALIAS.format(i)}: domainQuery(domain: $domain{i}, path: $path{i}) {{{DOMAIN_QUERY_FIELDS}}}'
+        for i in range(size)
+    )
+    return GraphQLQuery(f'query DomainQueryBatch({variables}) {{ {fields} }}')
+
+
+def batch_variables(queries: List[Tuple[str, str]]) -> dict:
+    """
+    :param queries: The (domain, path) pairs, in alias order
+    :return: The variables for domain_query_batch(len(queries))
+    """
+    variables = {}
+    for i, (domain, path) in enumerate(queries):
+        variables[f'domain{i}'] = domain
+        variables[f'path{i}'] = path
+    return variables
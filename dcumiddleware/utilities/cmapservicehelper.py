@@ -1,40 +1,128 @@
+import asyncio
 import json
 import logging
-from typing import Optional
+from copy import deepcopy
+from types import MappingProxyType
+from typing import List, Optional, Tuple, Union
 
-import requests
 from dateutil import parser
-from requests import sessions
+
+from dcumiddleware.utilities.asyncclient import get_client
+from dcumiddleware.utilities.cache import get_cache
+from dcumiddleware.utilities.circuitbreaker import get_breaker, server_error
+from dcumiddleware.utilities.cmapqueries import (BATCH_ALIAS, DOMAIN_QUERY,
+                                                 JSON_CONTENT_TYPE,
+                                                 KELVINDB_QUERY, GraphQLQuery,
+                                                 batch_variables,
+                                                 domain_query_batch)
+from dcumiddleware.utilities.httpsession import (READ_ONLY_POST_METHODS,
+                                                 get_session)
+from dcumiddleware.utilities.jwtmanager import get_cert_token_manager
+from dcumiddleware.utilities.singleflight import get_single_flight
 
 
 class CmapServiceHelper(object):
+    SESSION_NAME = 'cmap'
+    CACHE_NAME = 'cmap-domain'
     DATA_KEY = 'data'
     DOMAIN_Q_KEY = 'domainQuery'
     HOST_KEY = 'host'
     SHOPPER_CREATE_KEY = 'shopperCreateDate'
 
-    _post_headers = {'Content-Type': 'application/graphql'}
-    _domain_query_dicts = ['apiReseller', 'host', 'registrar', 'securitySubscription', 'shopperInfo']
+    GRAPHQL_URL = '/graphql'
+
+    # Helpers are shared by concurrent tasks, so class-level defaults are read-only and headers are built per request.
+    _post_headers = MappingProxyType({'Content-Type': 'application/graphql'})
+    _domain_query_dicts = ('apiReseller', 'host', 'registrar', 'securitySubscription', 'shopperInfo')
 
     # Map of reseller private label ids that need to be enriched:
-    _reseller_id_map = {'525844': '123REG'}
+    _reseller_id_map = MappingProxyType({'525844': '123REG'})
 
-    def __init__(self, settings):
+    def __init__(self, settings, metrics=None):
+        """
+        :param settings: The application settings
+        :param metrics: An optional APM metric set that domain cache hits and misses, and lookups joined onto one
+            already in flight, are counted in
+        """
         self._logger = logging.getLogger(__name__)
+        self._settings = settings
         self._base_url = settings.CMAP_SERVICE
 
         self._sso_endpoint = settings.SSO_URL + '/v1/secure/api/token'
         self._cert = (settings.CMAP_CLIENT_CERT, settings.CMAP_CLIENT_KEY)
-        self._cached_jwt = None
+        self._tokens = get_cert_token_manager(self._sso_endpoint, self._cert, settings, metrics)
+        self._metrics = metrics
+        self._cache = get_cache(self.CACHE_NAME, settings.CMAP_CACHE_BACKEND, settings.CMAP_CACHE_SIZE,
+                                settings.CMAP_CACHE_TTL, settings.CMAP_CACHE_URL)
+        self._persisted_queries = settings.CMAP_PERSISTED_QUERIES
+        self._batch_size = settings.CMAP_BATCH_MAX_SIZE
+        self._flight = get_single_flight(self.SESSION_NAME)
+
+    def cmap_query(self, query: Union[str, bytes], url: str = GRAPHQL_URL, content_type: str = None) -> dict:
+        """
+        :param query: The request body
+        :param url: The CMAP Service path to post to
+        :param content_type: Overrides the default application/graphql Content-Type
+        """
+        data = query if isinstance(query, bytes) else query.encode('utf-8')
+        # CMAP's GraphQL POSTs are queries, so they are retried like GETs.
+        post = get_session(self.SESSION_NAME, self._settings, READ_ONLY_POST_METHODS).post
+        breaker = get_breaker(self.SESSION_NAME, self._settings, self._metrics)
+        re = breaker.call(post, url=self._base_url + url, headers=self._headers(self.get_jwt(), content_type),
+                          data=data, failed=server_error)
+        if re.status_code == 401 or re.status_code == 403:
+            re = breaker.call(post, url=self._base_url + url, headers=self._headers(self.get_jwt(True), content_type),
+                              data=data, failed=server_error)
+        return json.loads(re.text)
+
+    def _headers(self, jwt: Optional[str], content_type: Optional[str]) -> dict:
+        """
+        :return: A new set of headers for one request
+        """
+        headers = dict(self._post_headers)
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+        headers['Authorization'] = f'sso-jwt {jwt}'
+        return headers
+
+    def _use_persisted(self, query: GraphQLQuery) -> bool:
+        return self._persisted_queries and query.persisted_supported
+
+    def graphql_query(self, query: GraphQLQuery, variables: dict) -> dict:
+        """
+        Runs a precompiled query. With persisted queries on, only the document hash is sent, and the request is
+        sent again with the full document if CMAP Service does not have it yet.
+        """
+        if not self._use_persisted(query):
+            return self.cmap_query(query.body(variables), self.GRAPHQL_URL, JSON_CONTENT_TYPE)
+        result = self.cmap_query(query.persisted_body(variables), self.GRAPHQL_URL, JSON_CONTENT_TYPE)
+        retry = query.retry_body(variables, result)
+        if retry is not None:
+            self._count('cmap_persisted_query_miss')
+            result = self.cmap_query(retry, self.GRAPHQL_URL, JSON_CONTENT_TYPE)
+        return result
+
+    def _count(self, name: str) -> None:
+        if self._metrics is not None:
+            self._metrics.counter(name, reset_on_collect=True).inc(1)
+
+    def _from_cache(self, key: str, use_cache: bool) -> Optional[dict]:
+        """
+        Looks up a domain query result. When use_cache is False the lookup is skipped, but the fresh
+        result is still written back by _to_cache.
+        """
+        if self._cache is None:
+            return None
+        if not use_cache:
+            self._count('cmap_cache_bypass')
+            return None
+        result = self._cache.get(key)
+        self._count('cmap_cache_hit' if result is not None else 'cmap_cache_miss')
+        return result
 
-    def cmap_query(self, query: str, url: str = '/graphql') -> dict:
-        self._post_headers.update({'Authorization': f'sso-jwt {self.get_jwt()}'})
-        with sessions.Session() as session:
-            re = session.post(url=self._base_url + url, headers=self._post_headers, data=query.encode('utf-8'))
-            if re.status_code == 401 or re.status_code == 403:
-                self._post_headers.update({'Authorization': f'sso-jwt {self.get_jwt(True)}'})
-                re = session.post(url=self._base_url + url, headers=self._post_headers, data=query.encode('utf-8'))
-            return json.loads(re.text)
+    def _to_cache(self, key: str, result: dict) -> None:
+        if self._cache is not None:
+            self._cache.set(key, result)
 
     def _validate_dq_structure(self, data: dict) -> None:
         """
@@ -73,12 +161,12 @@ class CmapServiceHelper(object):
         return entitlements_array[0]
 
     def shopper_lookup(self, shopper: str) -> dict:
-        return self.cmap_query(
+        return self._flight.do(f'shopper:{shopper}', lambda: self.cmap_query(
             json.dumps({
                 'shopper_id': shopper
             }),
             '/v1/shopper/lookup'
-        )
+        ), self._metrics)
 
     def _format_cmap_response_dates(self, data: dict):
         ddq = data.get('data', {}).get('domainQuery', {})
@@ -101,144 +189,24 @@ class CmapServiceHelper(object):
             data['data']['domainQuery']['host']['createdDate'] = self._date_time_format(hosting_create_date)
         return data
 
-    def domain_query_for_kelvindb(self, domain: str) -> dict:
-        query = ('''
-        {
-            domainQuery(domain: "''' + domain + '''") {
-                domain
-                host {
-                    brand
-                    guid
-                    hostingAbuseEmail
-                    hostingCompanyName
-                    ip
-                    product
-                    shopperId
-                    customerId
-                    shopperPlid
-                    entitlementId
-                }
-                registrar {
-                    brand
-                    domainCreateDate
-                    domainId
-                    registrarAbuseEmail
-                    registrarName
-                }
-                shopperInfo {
-                    shopperCreateDate
-                    shopperId
-                    customerId
-                    shopperPlid
-                }
-            }
-        }''')
-        query_result = self.cmap_query(query)
+    def _parse_kelvindb_query_result(self, query_result: dict) -> dict:
         if not isinstance(query_result, dict) or 'errors' in query_result:
             raise Exception('Unexpected query result')
         query_result = self._format_cmap_response_dates(query_result)
         return query_result
 
-    def domain_query(self, domain: str, path: str) -> dict:
+    def domain_query_for_kelvindb(self, domain: str, use_cache: bool = True) -> dict:
+        key = f'kelvin:{domain}'
+        result = self._from_cache(key, use_cache)
+        if result is None:
+            result = self._parse_kelvindb_query_result(self.graphql_query(KELVINDB_QUERY, {'domain': domain}))
+            self._to_cache(key, result)
+        return result
+
+    def _parse_domain_query_result(self, query_result: dict) -> dict:
         """
-        Query CMAP service for information related to a domain.
+        Validates a domainQuery response and normalizes its dates and reseller.
         """
-        query = ('''
-             {
-              domainQuery(domain: "''' + domain + '''", path: "''' + path + '''") {
-
-                alexaRank
-                similarWebRank{
-                    globalRank
-                    countryRankUs
-                    countryRankIn
-                }
-                apiReseller {
-                  child
-                  parent
-                  parentCustomerId
-                  childCustomerId
-                }
-                blacklist
-                domain
-                isDomainHighValue
-                securitySubscription {
-                  sucuriProduct
-                  products {
-                    createdDate
-                    sucuriProduct
-                    entitlementId
-                  }
-                }
-                sslSubscriptions {
-                  certCommonName
-                  certType
-                  createdAt
-                  expiresAt
-                  entitlementId
-                }
-                host {
-                  dataCenter
-                  guid
-                  containerId
-                  brand
-                  hostingCompanyName
-                  hostingAbuseEmail
-                  hostname
-                  ip
-                  os
-                  product
-                  shopperId
-                  shopperCountry
-                  shopperPlid
-                  customerId
-                  entitlementId
-                  shopperCreateDate
-                  mwpId
-                  createdDate
-                  friendlyName
-                  privateLabelId
-                  username
-                  managedLevel
-                  firstPassEnrichment
-                  secondPassEnrichment,
-                  abuseReportEmail
-                  hostingPlan
-                  subscriptionStatus
-                  startedAsFreeTrial
-                  vip {
-                    blacklist
-                    portfolioType
-                    shopperId
-                  }
-                }
-                registrar {
-                  brand
-                  domainCreateDate
-                  domainId
-                  registrarAbuseEmail
-                  registrarName
-                  firstPassEnrichment,
-                  abuseReportEmail
-                }
-                shopperInfo {
-                  domainCount
-                  shopperCreateDate
-                  shopperId
-                  shopperCountry
-                  customerId
-                  shopperPlid
-                  vip {
-                    blacklist
-                    portfolioType
-                    shopperId
-                  }
-                }
-              }
-            }
-          ''')
-        query_result = self.cmap_query(query)
-
         if not isinstance(query_result, dict) or 'errors' in query_result:
             raise Exception('Unexpected query result')
 
@@ -252,6 +220,103 @@ class CmapServiceHelper(object):
 
         return query_result
 
+    @staticmethod
+    def _domain_query_key(domain: str, path: str) -> str:
+        return f'domainQuery:{domain}:{path}'
+
+    def _batch_misses(self, queries: List[Tuple[str, str]], use_cache: bool) -> Tuple[dict, list]:
+        """
+        :return: The cached results by key, with None for misses, and the distinct misses split into batches
+        """
+        results, misses = {}, []
+        for domain, path in queries:
+            key = self._domain_query_key(domain, path)
+            if key not in results:
+                results[key] = self._from_cache(key, use_cache)
+                if results[key] is None:
+                    misses.append((domain, path))
+        return results, [misses[i:i + self._batch_size] for i in range(0, len(misses), self._batch_size)]
+
+    def _split_batch_result(self, batch: List[Tuple[str, str]], query_result, results: dict) -> None:
+        """
+        Stores each aliased domainQuery of a batch response in results, parsed as domain_query would parse it, or the
+        exception domain_query would have raised. An error naming an alias only fails that domain; any other error,
+        or a failed request, fails the whole batch.
+        """
+        failure, alias_errors = None, {}
+        if isinstance(query_result, Exception):
+            failure = query_result
+        elif not isinstance(query_result, dict):
+            failure = Exception('Unexpected query result')
+        else:
+            for error in query_result.get('errors') or []:
+                path = error.get('path') if isinstance(error, dict) else None
+                if not path:
+                    failure = Exception(f'Unexpected query result: {error}')
+                    break
+                alias_errors.setdefault(path[0], error.get('message'))
+
+        for i, (domain, path) in enumerate(batch):
+            key, alias = self._domain_query_key(domain, path), BATCH_ALIAS.format(i)
+            if failure is not None:
+                results[key] = failure
+                continue
+            domain_result = (query_result.get('data') or {}).get(alias)
+            if alias in alias_errors or not isinstance(domain_result, dict):
+                results[key] = Exception(f'Unexpected query result for {domain}: {alias_errors.get(alias)}')
+                continue
+            try:
+                results[key] = self._parse_domain_query_result({'data': {'domainQuery': domain_result}})
+                self._to_cache(key, results[key])
+            except Exception as e:
+                results[key] = e
+
+    def _batch_results(self, queries: List[Tuple[str, str]], results: dict) -> List[Union[dict, Exception]]:
+        ordered, seen = [], set()
+        for domain, path in queries:
+            key = self._domain_query_key(domain, path)
+            result = results[key]
+            # Callers may modify their result, so repeated pairs each get their own copy.
+            ordered.append(deepcopy(result) if key in seen and isinstance(result, dict) else result)
+            seen.add(key)
+        return ordered
+
+    def domain_query_many(self, queries: List[Tuple[str, str]], use_cache: bool = True) -> List[Union[dict, Exception]]:
+        """
+        Query CMAP service for several domains at once, fetching up to CMAP_BATCH_MAX_SIZE uncached domains
+        per request as aliases of a single query.
+        :param queries: (domain, path) pairs
+        :param use_cache: False to always query CMAP, e.g. for abuse verified tickets
+        :return: For each pair, in order, what domain_query returns, or the exception it would raise
+        """
+        results, batches = self._batch_misses(queries, use_cache)
+        for batch in batches:
+            try:
+                query_result = self.graphql_query(domain_query_batch(len(batch)), batch_variables(batch))
+            except Exception as e:
+                query_result = e
+            self._split_batch_result(batch, query_result, results)
+        return self._batch_results(queries, results)
+
+    def domain_query(self, domain: str, path: str, use_cache: bool = True) -> dict:
+        """
+        Query CMAP service for information related to a domain.
+        :param domain:
+        :param path:
+        :param use_cache: False to always query CMAP, e.g. for abuse verified tickets
+        """
+        key = self._domain_query_key(domain, path)
+        result = self._from_cache(key, use_cache)
+        if result is None:
+            # A query for the same domain already in flight is just as fresh, so join it rather than repeat it.
+            result = self._flight.do(key, lambda: self._fetch_domain_query(key, domain, path), self._metrics)
+        return result
+
+    def _fetch_domain_query(self, key: str, domain: str, path: str) -> dict:
+        result = self._parse_domain_query_result(self.graphql_query(DOMAIN_QUERY, {'domain': domain, 'path': path}))
+        self._to_cache(key, result)
+        return result
+
     def _date_time_format(self, date):
         """
         Returns date/time formatted object
@@ -281,16 +346,95 @@ class CmapServiceHelper(object):
 
     def get_jwt(self, force_refresh: bool = False) -> Optional[str]:
         """
-        Attempt to retrieve the JWT associated with the cert/key pair from SSO
+        Retrieve the JWT associated with the cert/key pair from SSO, shared by every helper in the process
         """
-        if self._cached_jwt is None or force_refresh:
-            try:
-                response = requests.post(self._sso_endpoint, data={'realm': 'cert'}, cert=self._cert)
-                response.raise_for_status()
+        return self._tokens.get(force_refresh)
 
-                body = json.loads(response.text)
-                self._cached_jwt = body.get('data')  # {'type': 'signed-jwt', 'id': 'XXX', 'code': 1, 'message': 'Success', 'data': JWT}
-            except Exception as e:
-                self._logger.error(e)
 
-        return self._cached_jwt
+class AsyncCmapServiceHelper(CmapServiceHelper):
+    """
+    CmapServiceHelper whose lookups are coroutines on the process-wide async HTTP client. Response handling
+    and merging are inherited, so both paths produce the same enrichment.
+    """
+
+    def __init__(self, settings, metrics=None):
+        super().__init__(settings, metrics)
+        self._flight = get_single_flight(self.SESSION_NAME, asynchronous=True)
+
+    async def get_jwt_async(self, force_refresh: bool = False) -> Optional[str]:
+        return await self._tokens.get_async(force_refresh)
+
+    async def cmap_query(self, query: Union[str, bytes], url: str = CmapServiceHelper.GRAPHQL_URL,
+                         content_type: str = None) -> dict:
+        body = query if isinstance(query, bytes) else query.encode('utf-8')
+        breaker = get_breaker(self.SESSION_NAME, self._settings, self._metrics)
+        headers = self._headers(await self.get_jwt_async(), content_type)
+        response = await breaker.call_async(get_client(self._settings).request, 'POST', self._base_url + url,
+                                            headers=headers, data=body, failed=server_error)
+        if response.status == 401 or response.status == 403:
+            headers = self._headers(await self.get_jwt_async(True), content_type)
+            response = await breaker.call_async(get_client(self._settings).request, 'POST', self._base_url + url,
+                                                headers=headers, data=body, failed=server_error)
+        return json.loads(response.text)
+
+    async def product_lookup(self, domain: str, guid: str, ip: str, product: str) -> dict:
+        return await self.cmap_query(
+            json.dumps({
+                'domain': domain,
+                'guid': guid,
+                'ip': ip,
+                'product': product
+            }),
+            '/v1/hosted/lookup'
+        )
+
+    async def product_lookup_entitlement(self, customerId: str, entitlementId: str) -> dict:
+        entitlements_array = await self.cmap_query('', f'/v1/nes/{customerId}/{entitlementId}')
+        return entitlements_array[0]
+
+    async def shopper_lookup(self, shopper: str) -> dict:
+        return await self._flight.do(
+            f'shopper:{shopper}', lambda: self.cmap_query(json.dumps({'shopper_id': shopper}), '/v1/shopper/lookup'),
+            self._metrics
+        )
+
+    async def graphql_query(self, query: GraphQLQuery, variables: dict) -> dict:
+        if not self._use_persisted(query):
+            return await self.cmap_query(query.body(variables), self.GRAPHQL_URL, JSON_CONTENT_TYPE)
+        result = await self.cmap_query(query.persisted_body(variables), self.GRAPHQL_URL, JSON_CONTENT_TYPE)
+        retry = query.retry_body(variables, result)
+        if retry is not None:
+            self._count('cmap_persisted_query_miss')
+            result = await self.cmap_query(retry, self.GRAPHQL_URL, JSON_CONTENT_TYPE)
+        return result
+
+    async def domain_query_for_kelvindb(self, domain: str, use_cache: bool = True) -> dict:
+        key = f'kelvin:{domain}'
+        result = self._from_cache(key, use_cache)
+        if result is None:
+            result = self._parse_kelvindb_query_result(await self.graphql_query(KELVINDB_QUERY, {'domain': domain}))
+            self._to_cache(key, result)
+        return result
+
+    async def domain_query(self, domain: str, path: str, use_cache: bool = True) -> dict:
+        key = self._domain_query_key(domain, path)
+        result = self._from_cache(key, use_cache)
+        if result is None:
+            result = await self._flight.do(key, lambda: self._fetch_domain_query(key, domain, path), self._metrics)
+        return result
+
+    async def _fetch_domain_query(self, key: str, domain: str, path: str) -> dict:
+        result = self._parse_domain_query_result(await self.graphql_query(DOMAIN_QUERY, {'domain': domain, 'path': path}))
+        self._to_cache(key, result)
+        return result
+
+    async def domain_query_many(self, queries: List[Tuple[str, str]],
+                                use_cache: bool = True) -> List[Union[dict, Exception]]:
+        results, batches = self._batch_misses(queries, use_cache)
+        query_results = await asyncio.gather(
+            *(self.graphql_query(domain_query_batch(len(batch)), batch_variables(batch)) for batch in batches),
+            return_exceptions=True
+        )
+        for batch, query_result in zip(batches, query_results):
+            self._split_batch_result(batch, query_result, results)
+        return self._batch_results(queries, results)
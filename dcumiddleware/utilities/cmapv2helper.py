@@ -1,17 +1,39 @@
+import json
 import logging
 from typing import Dict, Optional
 
-import requests
 from csetutils.services.jwt_base import CertJwtHttpClient
 
+from dcumiddleware.settings import AppConfig
+from dcumiddleware.utilities.asyncclient import get_client
+from dcumiddleware.utilities.circuitbreaker import get_breaker, server_error
+from dcumiddleware.utilities.httpsession import get_session
+from dcumiddleware.utilities.jwtmanager import get_cert_token_manager
+
 
 class CmapV2Helper(CertJwtHttpClient):
-    def __init__(self, service_url: str, sso_host: str, client_cert_path: str, client_key_path: str):
+    SESSION_NAME = 'cmapv2'
+
+    def __init__(self, service_url: str, sso_host: str, client_cert_path: str, client_key_path: str,
+                 settings: AppConfig, metrics=None):
         '''
         Initializes the CMAP V2 class.
+
+        :param settings: The application settings the shared HTTP session and SSO token are configured from.
+        :param metrics: An optional APM metric set that the CMAP V2 circuit breaker reports in.
         '''
         super().__init__(f'{sso_host}', client_cert_path, client_key_path)
         self.service_url = f'{service_url}'
+        self._settings = settings
+        self._metrics = metrics
+        self._tokens = get_cert_token_manager(f'{sso_host}/v1/secure/api/token', (client_cert_path, client_key_path),
+                                              settings)
+
+    def _get_jwt(self, force_update: bool = False) -> Optional[str]:
+        '''
+        Retrieves the JWT for the client certificate, shared with every other helper in the process.
+        '''
+        return self._tokens.get(force_update)
 
     def lookup_host_by_authority(self, domain: str) -> Optional[Dict[str, str]]:
         '''
@@ -26,10 +48,12 @@ class CmapV2Helper(CertJwtHttpClient):
             headers = {'Authorization': f'sso-jwt {self._get_jwt()}',
                        'Content-Type': 'application/json'}
             url = f'{self.service_url}/v1/cmap/lookupByHostAuthority?host={domain}'
-            response = requests.get(url, headers=headers)
+            session = get_session(self.SESSION_NAME, self._settings)
+            breaker = get_breaker(self.SESSION_NAME, self._settings, self._metrics)
+            response = breaker.call(session.get, url, headers=headers, failed=server_error)
             if response.status_code in [401, 403]:
                 headers['Authorization'] = f'sso-jwt {self._get_jwt(force_update=True)}'
-                response = requests.get(url, headers=headers)
+                response = breaker.call(session.get, url, headers=headers, failed=server_error)
                 return response.json()
             cmapV2_data = response.json()
             return {'productData': cmapV2_data}
@@ -113,3 +137,34 @@ class CmapV2Helper(CertJwtHttpClient):
 
         logging.info(f'\n\nMapped cmapv2\n {mappedData}')
         return mappedData
+
+
+class AsyncCmapV2Helper(CmapV2Helper):
+    """
+    CmapV2Helper whose host authority lookup is a coroutine on the process-wide async HTTP client.
+    """
+
+    async def get_jwt_async(self, force_refresh: bool = False) -> Optional[str]:
+        return await self._tokens.get_async(force_refresh)
+
+    async def lookup_host_by_authority(self, domain: str) -> Optional[Dict[str, str]]:
+        if not domain:
+            return None
+        try:
+            headers = {'Authorization': f'sso-jwt {await self.get_jwt_async()}',
+                       'Content-Type': 'application/json'}
+            url = f'{self.service_url}/v1/cmap/lookupByHostAuthority'
+            params = {'host': domain}
+            breaker = get_breaker(self.SESSION_NAME, self._settings, self._metrics)
+            response = await breaker.call_async(get_client(self._settings).request, 'GET', url, headers=headers,
+                                                params=params, failed=server_error)
+            if response.status in [401, 403]:
+                headers['Authorization'] = f'sso-jwt {await self.get_jwt_async(True)}'
+                response = await breaker.call_async(get_client(self._settings).request, 'GET', url, headers=headers,
+                                                    params=params, failed=server_error)
+                return json.loads(response.text)
+            return {'productData': json.loads(response.text)}
+
+        except Exception as e:
+            logging.exception(f'Error querying CMAP V2 service for domain {domain}. Error message: {e} ')
+            raise
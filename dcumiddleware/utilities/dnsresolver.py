@@ -0,0 +1,179 @@
+import asyncio
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import dns.asyncresolver
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+from dcumiddleware.utilities.cache import MEMORY_BACKEND, get_cache
+
+
+class DnsResolver:
+    """
+    Resolves a ticket's domains the way socket.gethostbyname does, preferring an IPv4 address. The A query is sent
+    first, and the AAAA query only for a name without an IPv4 address. Queries block the calling thread on
+    dnspython's stub resolver, which needs no event loop and yields to other green threads under gevent. Answers
+    are cached for their TTL, capped by DNS_MAX_TTL, and names that do not resolve are cached for DNS_NEGATIVE_TTL.
+    Timeouts are never cached. Use get_resolver for the instance shared by the process.
+    """
+    CACHE_NAME = 'dns'
+    # Cached in place of an address for names that do not resolve
+    NOT_FOUND = ''
+    RESOLVER_CLASS = dns.resolver.Resolver
+
+    def __init__(self, settings, metrics=None):
+        """
+        :param settings: The app settings holding the DNS_* configuration
+        :param metrics: An optional APM metric set that cache hits and misses are counted in
+        """
+        self._resolver = self.RESOLVER_CLASS(configure=not settings.DNS_NAMESERVERS)
+        if settings.DNS_NAMESERVERS:
+            self._resolver.nameservers = list(settings.DNS_NAMESERVERS)
+            self._resolver.port = settings.DNS_PORT
+        self._resolver.lifetime = min(settings.DNS_TIMEOUT, settings.ENRICHMENT_DEADLINE)
+        self._negative_ttl = settings.DNS_NEGATIVE_TTL
+        self._max_ttl = settings.DNS_MAX_TTL
+        self._metrics = metrics
+        self._cache = get_cache(self.CACHE_NAME, MEMORY_BACKEND, settings.DNS_CACHE_SIZE, settings.DNS_MAX_TTL)
+
+    def _count(self, name: str) -> None:
+        if self._metrics is not None:
+            self._metrics.counter(name, reset_on_collect=True).inc(1)
+
+    def _query(self, name: str, rdtype: dns.rdatatype.RdataType) -> Tuple[List[str], Optional[int]]:
+        """
+        :return: The addresses of the given type and their TTL. An empty list if the name has none of that type.
+        """
+        try:
+            answer = self._resolver.resolve(name, rdtype)
+        except dns.resolver.NoAnswer:
+            return [], None
+        return [rdata.address for rdata in answer], answer.rrset.ttl
+
+    def _cached(self, name: str) -> Optional[str]:
+        """
+        :return: The cached address, or None on a miss
+        :raises socket.gaierror: when the name is empty or cached as not resolving
+        """
+        if not name:
+            raise socket.gaierror(f'Cannot resolve {name!r}')
+        if self._cache is None:
+            return None
+        address = self._cache.get(name)
+        self._count('dns_cache_miss' if address is None else 'dns_cache_hit')
+        if address == self.NOT_FOUND:
+            raise socket.gaierror(f'{name} does not resolve')
+        return address
+
+    @contextmanager
+    def _errors(self, name: str):
+        """
+        Raises dnspython's failures as the errors socket.gethostbyname would.
+        """
+        try:
+            yield
+        except dns.exception.Timeout as e:
+            raise TimeoutError(f'Timed out resolving {name}') from e
+        except dns.exception.DNSException as e:
+            raise socket.gaierror(f'Unable to resolve {name}: {e}') from e
+
+    def _answer(self, name: str, addresses: List[str], ttl: Optional[int]) -> str:
+        """
+        Caches the outcome of a lookup and returns the address it found.
+        :raises socket.gaierror: when the lookup found no address
+        """
+        if not addresses:
+            if self._cache is not None:
+                self._cache.set(name, self.NOT_FOUND, self._negative_ttl)
+            raise socket.gaierror(f'{name} does not resolve')
+        if self._cache is not None:
+            self._cache.set(name, addresses[0], min(ttl, self._max_ttl))
+        return addresses[0]
+
+    def resolve(self, name: str) -> str:
+        """
+        A drop-in for socket.gethostbyname that returns an IPv6 address when the name has no IPv4 address.
+        :raises socket.gaierror: when the name does not resolve
+        :raises TimeoutError: when no nameserver answers within DNS_TIMEOUT
+        """
+        address = self._cached(name)
+        if address is not None:
+            return address
+        with self._errors(name):
+            try:
+                addresses, ttl = self._query(name, dns.rdatatype.A)
+                if not addresses:
+                    addresses, ttl = self._query(name, dns.rdatatype.AAAA)
+            except dns.resolver.NXDOMAIN:
+                addresses, ttl = [], None
+        return self._answer(name, addresses, ttl)
+
+
+class AsyncDnsResolver(DnsResolver):
+    """
+    DnsResolver whose resolve is a coroutine, for the async enrichment engine. A and AAAA are sent together, so
+    that a name with only an IPv6 address costs no extra round trip.
+    """
+    RESOLVER_CLASS = dns.asyncresolver.Resolver
+
+    async def _query(self, name: str, rdtype: dns.rdatatype.RdataType) -> Tuple[List[str], Optional[int]]:
+        try:
+            answer = await self._resolver.resolve(name, rdtype)
+        except dns.resolver.NoAnswer:
+            return [], None
+        return [rdata.address for rdata in answer], answer.rrset.ttl
+
+    async def resolve(self, name: str) -> str:
+        address = self._cached(name)
+        if address is not None:
+            return address
+        ipv6_lookup = asyncio.ensure_future(self._query(name, dns.rdatatype.AAAA))
+        # The IPv6 answer is often not needed; retrieve its outcome so that an unused failure is not reported.
+        ipv6_lookup.add_done_callback(lambda lookup: lookup.cancelled() or lookup.exception())
+        with self._errors(name):
+            try:
+                addresses, ttl = await self._query(name, dns.rdatatype.A)
+                if not addresses:
+                    addresses, ttl = await ipv6_lookup
+            except dns.resolver.NXDOMAIN:
+                addresses, ttl = [], None
+            finally:
+                ipv6_lookup.cancel()
+        return self._answer(name, addresses, ttl)
+
+
+_resolvers: Dict[bool, DnsResolver] = {}
+_resolvers_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def get_resolver(settings, metrics=None, asynchronous: bool = False) -> DnsResolver:
+    """
+    Returns this process's resolver, so that the DNS configuration is read once rather than for every ticket.
+    :param settings: The app settings holding the DNS_* configuration
+    :param metrics: An optional APM metric set
+    :param asynchronous: True for the AsyncDnsResolver used by the async enrichment engine
+    """
+    global _resolvers_pid
+    with _lock:
+        if _resolvers_pid != os.getpid():
+            _resolvers.clear()
+            _resolvers_pid = os.getpid()
+        if asynchronous not in _resolvers:
+            resolver_class = AsyncDnsResolver if asynchronous else DnsResolver
+            _resolvers[asynchronous] = resolver_class(settings, metrics)
+        return _resolvers[asynchronous]
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    _lock = threading.Lock()
+    _resolvers.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from dcumiddleware.settings import AppConfig
+
+GREEN_POOLS = ('gevent', 'eventlet')
+THREAD_POOL = 'threads'
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def is_green_pool(settings: AppConfig) -> bool:
+    """
+    True when the worker runs tickets as green threads. The standard library is then monkey patched, so threads
+    and blocking I/O cooperate, but asyncio does not.
+    """
+    return settings.WORKER_POOL in GREEN_POOLS
+
+
+def tickets_per_process(settings: AppConfig) -> int:
+    """
+    The number of tickets a worker process runs at once. Prefork and solo children run one at a time, while the
+    green pools and the threads pool run WORKER_CONCURRENCY tickets in the same process.
+    """
+    if is_green_pool(settings) or settings.WORKER_POOL == THREAD_POOL:
+        return settings.WORKER_CONCURRENCY
+    return 1
+
+
+def get_pool(settings: AppConfig) -> ThreadPoolExecutor:
+    """
+    Returns the thread pool shared by every ticket enriched in this process. Threads do not survive a fork,
+    so the pool is tracked per process id and rebuilt on first use in each Celery child. Under a green or thread
+    pool the process enriches WORKER_CONCURRENCY tickets at once, so the pool is sized for all of them.
+    """
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(max_workers=settings.ENRICHMENT_MAX_WORKERS * tickets_per_process(settings),
+                                       thread_name_prefix='enrichment')
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _after_fork_in_child() -> None:
+    global _lock, _pool
+    _lock = threading.Lock()
+    _pool = None
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+class EnrichmentExecutor:
+    """
+    Runs the independent lookups for a single ticket at the same time, bounded by one shared deadline,
+    so the wall time of an enrichment is that of its slowest lookup rather than the sum of all of them.
+    """
+
+    def __init__(self, deadline: float, settings: AppConfig):
+        """
+        :param deadline: Seconds the ticket's lookups are allowed to take in total.
+        :param settings: The application settings the shared thread pool is sized from
+        """
+        self._expires_at = time.monotonic() + deadline
+        self._settings = settings
+        self._lookups: List[Future] = []
+
+    def remaining(self) -> float:
+        return max(self._expires_at - time.monotonic(), 0)
+
+    def _start(self, fn: Callable, *args) -> Future:
+        return get_pool(self._settings).submit(fn, *args)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        lookup = self._start(fn, *args)
+        self._lookups.append(lookup)
+        return lookup
+
+    def cancel_pending(self) -> None:
+        """
+        Cancels every lookup of the ticket that has not finished. Lookups still waiting for a pool thread never
+        start; those already running are bounded by their own request timeouts.
+        """
+        for lookup in self._lookups:
+            lookup.cancel()
+
+    def result(self, future: Future, timeout: Optional[float] = None) -> Any:
+        """
+        Waits for a lookup to finish, re-raising any exception it produced.
+        :param future: A future returned from submit
+        :param timeout: An optional per-lookup timeout, capped by the ticket deadline.
+        :raises TimeoutError: when the lookup does not finish in time. The lookup is cancelled, and once the
+            deadline has passed so is every other pending lookup of the ticket.
+        """
+        wait = self.remaining() if timeout is None else min(timeout, self.remaining())
+        try:
+            return future.result(timeout=wait)
+        except TimeoutError:
+            future.cancel()
+            if not self.remaining():
+                self.cancel_pending()
+            raise
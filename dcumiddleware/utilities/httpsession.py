@@ -0,0 +1,100 @@
+import os
+import threading
+from typing import Dict, FrozenSet, Optional
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dcumiddleware.settings import AppConfig
+
+# Upstream responses that are worth retrying on a fresh connection.
+RETRY_STATUSES = (502, 503, 504)
+# The methods urllib3 retries by default, all idempotent. Sessions whose POSTs are reads, e.g. CMAP's GraphQL
+# queries, opt in to retrying them as well.
+IDEMPOTENT_METHODS: FrozenSet[str] = Retry.DEFAULT_ALLOWED_METHODS
+READ_ONLY_POST_METHODS: FrozenSet[str] = IDEMPOTENT_METHODS | {'POST'}
+
+_sessions: Dict[str, Session] = {}
+_sessions_pid = os.getpid()
+_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter that applies a default timeout to every request sent without one.
+    """
+
+    def __init__(self, timeout, *args, **kwargs):
+        """
+        :param timeout: A requests timeout, i.e. seconds or a (connect, read) tuple
+        """
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+def _build_session(settings: AppConfig, retry_methods: FrozenSet[str]) -> Session:
+    """
+    Creates a keep-alive session with a bounded connection pool, a default timeout and retries for transient
+    failures. Only retry_methods are retried once a request has been sent, so writes are never sent twice.
+    """
+    retries = Retry(
+        total=settings.HTTP_MAX_RETRIES,
+        backoff_factor=settings.HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=retry_methods,
+        raise_on_status=False
+    )
+    # No read may outlast the enrichment deadline of the ticket waiting on it.
+    adapter = TimeoutHTTPAdapter(
+        (settings.HTTP_CONNECT_TIMEOUT, min(settings.HTTP_READ_TIMEOUT, settings.ENRICHMENT_DEADLINE)),
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=retries
+    )
+    session = Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def reset_sessions() -> None:
+    """
+    Drops every pooled session owned by this process. The sockets are not closed since, after a fork,
+    they are still in use by the parent process.
+    """
+    global _sessions_pid
+    _sessions.clear()
+    _sessions_pid = os.getpid()
+
+
+def get_session(name: str, settings: AppConfig, retry_methods: Optional[FrozenSet[str]] = None) -> Session:
+    """
+    Returns the long-lived session for the named upstream service. Celery forks the run module into the
+    configured number of processes at start time, and a pooled TLS connection must never be shared between
+    processes, so sessions are tracked per process id and rebuilt on first use in each child.
+    :param name: A key identifying the upstream, e.g. cmap or shopper.
+    :param settings: The application settings the session's pool, timeout and retries are read from
+    :param retry_methods: The HTTP methods retried after a failed response, IDEMPOTENT_METHODS by default
+    :return: A pooled requests Session
+    """
+    with _lock:
+        if _sessions_pid != os.getpid():
+            reset_sessions()
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = _build_session(settings, retry_methods or IDEMPOTENT_METHODS)
+        return session
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    # The parent may have been holding the lock when it forked.
+    _lock = threading.Lock()
+    reset_sessions()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
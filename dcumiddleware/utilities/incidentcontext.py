@@ -0,0 +1,89 @@
+from typing import Optional
+
+from dcdatabase.phishstorymongo import PhishstoryMongo
+
+from dcumiddleware.metrics import timed
+
+KEY_PHISHSTORY_STATUS = 'phishstory_status'
+STATUS_CLOSED = 'CLOSED'
+MONGO_READ = 'mongo_read'
+MONGO_WRITE = 'mongo_write'
+
+
+class IncidentContext:
+    """
+    A read-through view of one ticket's phishstory incident. The document is read at most once unless a fresh copy
+    is asked for, writes replace it with the document Mongo returns, and every round trip is counted so that the
+    cost of a ticket shows up in metrics as phishstory_round_trips, and its latency as the mongo_read and mongo_write
+    stages.
+    """
+
+    def __init__(self, db: PhishstoryMongo, ticket_id: str, document: Optional[dict] = None, metrics=None):
+        """
+        :param db: The phishstory database
+        :param ticket_id: The ticket this context reads and writes
+        :param document: The incident, if the caller already holds a current copy of it
+        :param metrics: An optional APM metric set that round trips are counted and timed in
+        """
+        self._db = db
+        self._ticket_id = ticket_id
+        self._document = document
+        self._metrics = metrics
+        self.round_trips = 0
+
+    def _round_trip(self, stage: str):
+        """
+        Counts a round trip and returns a context manager timing it as stage.
+        """
+        self.round_trips += 1
+        if self._metrics is not None:
+            self._metrics.counter('phishstory_round_trips', reset_on_collect=True).inc(1)
+        return timed(self._metrics, stage)
+
+    def get(self, refresh: bool = False) -> Optional[dict]:
+        """
+        :param refresh: Read the incident again even if a copy is already held
+        :return: The incident, or None if the ticket does not exist
+        """
+        if self._ticket_id is None:
+            return None
+        if self._document is None or refresh:
+            with self._round_trip(MONGO_READ):
+                self._document = self._db.get_incident(self._ticket_id)
+        return self._document
+
+    def is_closed(self, refresh: bool = False) -> Optional[bool]:
+        """
+        :return: True if the incident is closed, False if open, and None if the ticket is not found
+        """
+        document = self.get(refresh)
+        if document is None:
+            return None
+        return document.get(KEY_PHISHSTORY_STATUS) == STATUS_CLOSED
+
+    def add(self, data: dict, status: str) -> None:
+        with self._round_trip(MONGO_WRITE):
+            self._db.add_new_incident(self._ticket_id, data, status=status)
+        # The stored incident carries fields added by the database, so the next get reads it back.
+        self._document = None
+
+    def update(self, fields: dict) -> Optional[dict]:
+        """
+        :return: The updated incident, as returned by the database
+        """
+        with self._round_trip(MONGO_WRITE):
+            self._document = self._db.update_incident(self._ticket_id, fields)
+        return self._document
+
+    def add_action(self, action: str) -> None:
+        """
+        Records an action taken on the ticket in its actions sub-document.
+        """
+        with self._round_trip(MONGO_WRITE):
+            self._db.update_actions_sub_document(self._ticket_id, action)
+
+    def remove_field(self, field: str) -> None:
+        with self._round_trip(MONGO_WRITE):
+            self._db.remove_field(self._ticket_id, field)
+        if self._document is not None:
+            self._document.pop(field, None)
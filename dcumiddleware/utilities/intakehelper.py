@@ -0,0 +1,88 @@
+import logging
+from datetime import datetime
+from typing import List
+
+from pymongo import collection
+from pymongo.errors import BulkWriteError
+
+from dcumiddleware.metrics import timed
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class IntakeHelper:
+    """
+    Adds new incidents in bulk, for backfills that deliver tickets faster than one get_incident and
+    add_new_incident round trip per ticket can keep up with.
+    """
+    KEY_DUPLICATE = 'duplicate'
+    KEY_ID = '_id'
+    KEY_PLID = 'plid'
+    KEY_STATUS = 'phishstory_status'
+    KEY_TICKET_ID = 'ticketId'
+    STATUS_DUPLICATE = 'DUPLICATE'
+    STATUS_PROCESSING = 'PROCESSING'
+
+    def __init__(self, incidents: collection.Collection, metrics=None):
+        """
+        :param incidents: The phishstory incidents collection
+        :param metrics: An optional APM metric set that skipped and added tickets are counted, and the Mongo round
+        trips timed, in
+        """
+        self._logger = logging.getLogger(__name__)
+        self._incidents = incidents
+        self._metrics = metrics
+
+    def _count(self, name: str, value: int) -> None:
+        if self._metrics is not None and value:
+            self._metrics.counter(name, reset_on_collect=True).inc(value)
+
+    def _new_incident(self, data: dict) -> dict:
+        """
+        Stamps a ticket the way PhishstoryMongo.add_new_incident does, for the bulk insert dcdatabase does not offer.
+        Single tickets are added through PhishstoryMongo itself.
+        """
+        if self.KEY_PLID in data:
+            data[self.KEY_PLID] = str(int(data[self.KEY_PLID]))
+        now = datetime.utcnow()
+        incident = dict(data)
+        incident[self.KEY_ID] = data[self.KEY_TICKET_ID]
+        incident[self.KEY_STATUS] = self.STATUS_DUPLICATE if data.get(self.KEY_DUPLICATE, False) else self.STATUS_PROCESSING
+        incident['created'] = now
+        incident['last_modified'] = now
+        return incident
+
+    def add_new_incidents(self, tickets: List[dict]) -> List[dict]:
+        """
+        Adds every ticket that is not already an incident, with one query to find the existing tickets and one
+        unordered insert. A ticket inserted by another worker in the meantime is skipped, as are repeats within
+        the batch.
+        :param tickets: The ticket events, as sync_customer_security receives them
+        :return: The tickets that were added, in the order they were given
+        """
+        by_id = {}
+        for data in tickets:
+            ticket_id = data.get(self.KEY_TICKET_ID)
+            if ticket_id is not None:
+                by_id.setdefault(ticket_id, data)
+        with timed(self._metrics, 'mongo_read'):
+            existing = {doc[self.KEY_ID] for doc in self._incidents.find({self.KEY_ID: {'$in': list(by_id)}}, {self.KEY_ID: 1})}
+        new = [data for ticket_id, data in by_id.items() if ticket_id not in existing]
+        self._count('intake_existing', len(tickets) - len(new))
+        if not new:
+            return []
+
+        incidents = [self._new_incident(data) for data in new]
+        try:
+            with timed(self._metrics, 'mongo_write'):
+                self._incidents.insert_many(incidents, ordered=False)
+        except BulkWriteError as e:
+            failed = set()
+            for error in e.details.get('writeErrors', []):
+                if error.get('code') != DUPLICATE_KEY_ERROR:
+                    raise
+                failed.add(error['index'])
+            new = [data for index, data in enumerate(new) if index not in failed]
+            self._count('intake_existing', len(failed))
+        self._count('intake_added', len(new))
+        return new
@@ -0,0 +1,192 @@
+import asyncio
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from dcumiddleware.settings import AppConfig
+from dcumiddleware.utilities.httpsession import get_session
+from dcumiddleware.utilities.singleflight import SingleFlight
+
+# requests pools connections by host alone, whatever client certificate a request carries, so each credential has a
+# session of its own and a connection opened for one is never reused for another.
+SESSION_NAME = 'sso'
+
+_managers: Dict[tuple, 'TokenManager'] = {}
+_lock = threading.Lock()
+
+
+def jwt_expiry(token: str) -> Optional[float]:
+    """
+    Reads the exp claim of a JWT. The signature is not checked; the expiry is only used to schedule a refresh.
+    :return: The expiry as a Unix timestamp, or None if the token has none
+    """
+    try:
+        payload = token.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp'])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    """
+    Holds the SSO JWT for one endpoint and credential, shared by every helper in the process. A background thread
+    fetches a new token JWT_REFRESH_MARGIN seconds before the current one expires, so requests rarely wait on SSO.
+    Concurrent refreshes share one SSO call, and a forced refresh, e.g. after a 401, is skipped when the token was
+    fetched in the last JWT_MIN_REFRESH_INTERVAL seconds, so that a burst of rejected requests costs one call.
+    Tokens without an exp claim are kept until a forced refresh.
+    """
+
+    def __init__(self, fetch: Callable[[], Optional[str]], settings: AppConfig, metrics=None):
+        """
+        :param fetch: Fetches a new token from SSO, returning None on failure
+        :param settings: The application settings holding the JWT_* configuration
+        :param metrics: An optional APM metric set that refreshes and their latency are recorded in
+        """
+        self._logger = logging.getLogger(__name__)
+        self._fetch = fetch
+        self._settings = settings
+        self.metrics = metrics
+        self._token: Optional[str] = None
+        self._expires_at: Optional[float] = None
+        self._refresh_at: Optional[float] = None
+        self._fetched_at = 0.0
+        self._flight = SingleFlight('jwt')
+        self._wake = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+
+    def _valid(self) -> bool:
+        return self._token is not None and (self._expires_at is None or time.time() < self._expires_at)
+
+    def _count(self, name: str) -> None:
+        if self.metrics is not None:
+            self.metrics.counter(name, reset_on_collect=True).inc(1)
+
+    def _refresh(self) -> Optional[str]:
+        """
+        Fetches a new token. On failure the current token is kept for as long as it is valid.
+        """
+        start = time.monotonic()
+        try:
+            token = self._fetch()
+        except Exception as e:
+            self._logger.error(f'Unable to fetch a JWT: {e}')
+            token = None
+        if self.metrics is not None:
+            self.metrics.gauge('jwt_refresh_latency_ms').val = (time.monotonic() - start) * 1000
+        if not token:
+            self._count('jwt_refresh_failed')
+            return self._token if self._valid() else None
+
+        self._count('jwt_refresh')
+        now = time.time()
+        self._token, self._fetched_at = token, time.monotonic()
+        self._expires_at = jwt_expiry(token)
+        if self._expires_at is None:
+            # Nothing to refresh ahead of; a running refresher waits until a token with an expiry arrives.
+            self._refresh_at = None
+            self._wake.set()
+        else:
+            # Short-lived tokens are refreshed halfway through their life instead.
+            self._refresh_at = self._expires_at - min(self._settings.JWT_REFRESH_MARGIN, (self._expires_at - now) / 2)
+            self._start_refresher()
+        return token
+
+    def _start_refresher(self) -> None:
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._run, name='jwt-refresher', daemon=True)
+            self._refresher.start()
+        else:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            refresh_at = self._refresh_at
+            if refresh_at is None:
+                self._wake.wait()
+                continue
+            delay = refresh_at - time.time()
+            if delay > 0:
+                # Woken early when a new token arrives, so the delay is worked out again.
+                self._wake.wait(delay)
+                continue
+            self._count('jwt_proactive_refresh')
+            before = self._token
+            self._flight.do('refresh', self._refresh, self.metrics)
+            if self._token == before:
+                self._wake.wait(self._settings.JWT_RETRY_INTERVAL)
+
+    def get(self, force_refresh: bool = False) -> Optional[str]:
+        """
+        :param force_refresh: True when the current token was rejected
+        :return: The current token, or None when SSO could not provide one
+        """
+        if self._valid():
+            if not force_refresh or time.monotonic() - self._fetched_at < self._settings.JWT_MIN_REFRESH_INTERVAL:
+                return self._token
+        return self._flight.do('refresh', self._refresh, self.metrics)
+
+    async def get_async(self, force_refresh: bool = False) -> Optional[str]:
+        """
+        get for coroutines. A token that is still valid is returned without leaving the event loop; a refresh
+        runs on the loop's thread pool.
+        """
+        if self._valid() and not force_refresh:
+            return self._token
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, force_refresh)
+
+
+def _get_manager(key: tuple, fetch: Callable[[], Optional[str]], settings: AppConfig, metrics) -> TokenManager:
+    with _lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = _managers[key] = TokenManager(fetch, settings, metrics)
+        elif manager.metrics is None:
+            manager.metrics = metrics
+        return manager
+
+
+def get_cert_token_manager(sso_endpoint: str, cert: Tuple[str, str], settings: AppConfig,
+                           metrics=None) -> TokenManager:
+    """
+    Returns the process-wide manager of the JWT SSO issues for a client certificate.
+    """
+    def fetch() -> Optional[str]:
+        session = get_session(f'{SESSION_NAME}-cert-{cert}', settings)
+        session.cert = cert
+        response = session.post(sso_endpoint, data={'realm': 'cert'})
+        response.raise_for_status()
+        # {'type': 'signed-jwt', 'id': 'XXX', 'code': 1, 'message': 'Success', 'data': JWT}
+        return json.loads(response.text).get('data')
+
+    return _get_manager(('cert', sso_endpoint, cert), fetch, settings, metrics)
+
+
+def get_password_token_manager(sso_endpoint: str, user: str, password: str, settings: AppConfig,
+                               metrics=None) -> TokenManager:
+    """
+    Returns the process-wide manager of the JWT SSO issues for a username and password.
+    """
+    def fetch() -> Optional[str]:
+        response = get_session(f'{SESSION_NAME}-idp', settings).post(
+            sso_endpoint, json={'username': user, 'password': password}, params={'realm': 'idp'}
+        )
+        response.raise_for_status()
+        return json.loads(response.text).get('data')
+
+    return _get_manager(('idp', sso_endpoint, user, password), fetch, settings, metrics)
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    # The refresher threads do not survive a fork, so each child fetches its own tokens.
+    _lock = threading.Lock()
+    _managers.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -4,10 +4,9 @@ import smtplib
 from email.message import EmailMessage
 from typing import Optional
 
-from pymongo import MongoClient
-
 from dcumiddleware.settings import AppConfig
 from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
+from dcumiddleware.utilities.mongoclients import get_mongo_client
 
 
 class KelvinHelper:
@@ -15,7 +14,7 @@ class KelvinHelper:
 
     def __init__(self, config: AppConfig):
         self._logger = logging.getLogger(__name__)
-        self._kelvindb = MongoClient(config.KELVIN_DB_URL)[config.KELVIN_DBNAME]
+        self._kelvindb = get_mongo_client(config.KELVIN_DB_URL, config)[config.KELVIN_DBNAME]
         self._cmapHelper = CmapServiceHelper(config)
         self._genpact_sender = config.GENPACT_SENDER
         self._genpact_receiver = config.GENPACT_RECEIVER
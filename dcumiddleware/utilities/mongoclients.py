@@ -0,0 +1,76 @@
+import os
+import threading
+from typing import Any, Callable, Dict
+
+from pymongo import MongoClient
+from pymongo.collection import Collection
+
+from dcumiddleware.settings import AppConfig
+
+_clients: Dict[str, MongoClient] = {}
+# Database wrappers that hold a client of their own, such as dcdatabase's PhishstoryMongo
+_shared: Dict[str, Any] = {}
+_clients_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def reset_clients() -> None:
+    """
+    Drops every client owned by this process. The clients are not closed since, after a fork, their sockets are
+    still in use by the parent process.
+    """
+    global _clients_pid
+    _clients.clear()
+    _shared.clear()
+    _clients_pid = os.getpid()
+
+
+def get_mongo_client(url: str, settings: AppConfig) -> MongoClient:
+    """
+    Returns the long-lived client for a MongoDB deployment, so that every task in the process shares its
+    connection pool instead of paying for new connections and TLS handshakes. A MongoClient must never be used
+    across a fork, so clients are tracked per process id and created on first use in each Celery child.
+    :param url: The connection string of the deployment
+    :param settings: The application settings the client's pool size is read from
+    :return: A pooled MongoClient
+    """
+    with _lock:
+        if _clients_pid != os.getpid():
+            reset_clients()
+        client = _clients.get(url)
+        if client is None:
+            client = _clients[url] = MongoClient(url, maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                                                 minPoolSize=settings.MONGO_MIN_POOL_SIZE)
+        return client
+
+
+def get_collection(url: str, db: str, collection: str, settings: AppConfig) -> Collection:
+    """
+    Returns a collection of the pooled client for url.
+    """
+    return get_mongo_client(url, settings)[db][collection]
+
+
+def get_shared(name: str, factory: Callable[[], Any]) -> Any:
+    """
+    Returns the process-wide instance of a database wrapper that builds its own client, creating it with factory
+    on first use in each process.
+    :param name: A key identifying the wrapper, e.g. phishstory or kelvin.
+    """
+    with _lock:
+        if _clients_pid != os.getpid():
+            reset_clients()
+        wrapper = _shared.get(name)
+        if wrapper is None:
+            wrapper = _shared[name] = factory()
+        return wrapper
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    # The parent may have been holding the lock when it forked.
+    _lock = threading.Lock()
+    reset_clients()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
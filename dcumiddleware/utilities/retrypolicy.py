@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+import aiohttp
+from bson.errors import InvalidDocument
+from celery import Task
+from celery.exceptions import SoftTimeLimitExceeded
+from celery.utils.time import get_exponential_backoff_interval
+from pymongo import collection
+from pymongo.errors import ConnectionFailure, DuplicateKeyError
+from requests import RequestException
+
+from dcumiddleware.settings import AppConfig
+from dcumiddleware.utilities.circuitbreaker import CircuitOpenError
+
+BACKOFF = 'backoff'
+BUDGET = 'budget'
+MAX_RETRIES = 'max_retries'
+NON_RETRYABLE = 'non_retryable'
+
+# Failures of a dependency, which a later attempt may not meet. Checked first, since some, e.g. the
+# JSONDecodeError of a truncated response, are also ValueErrors.
+RETRYABLE_ERRORS = (OSError, RequestException, aiohttp.ClientError, ConnectionFailure, CircuitOpenError,
+                    SoftTimeLimitExceeded, json.JSONDecodeError)
+# Errors in the ticket or the code, which every attempt would meet again. Anything else is retried.
+NON_RETRYABLE_ERRORS = (TypeError, ValueError, LookupError, AttributeError, NotImplementedError, DuplicateKeyError,
+                        InvalidDocument)
+
+_budgets: Dict[str, 'RetryBudget'] = {}
+_lock = threading.Lock()
+
+
+def is_retryable(exc: BaseException, dont_retry_for: tuple = NON_RETRYABLE_ERRORS) -> bool:
+    return isinstance(exc, RETRYABLE_ERRORS) or not isinstance(exc, dont_retry_for)
+
+
+class RetryBudget:
+    """
+    Limits the retries of a task class to RETRY_BUDGET_RATIO of its first attempts in the last RETRY_BUDGET_WINDOW
+    seconds, plus RETRY_BUDGET_MIN_PER_SECOND a second, so that an outage cannot multiply the load on the broker and
+    the failing dependency.
+    """
+
+    def __init__(self, settings: AppConfig):
+        """
+        :param settings: The application settings holding the RETRY_BUDGET_* limits
+        """
+        self._settings = settings
+        # [second, first attempts, retries] for each second of the window that saw either
+        self._seconds = deque()
+        self._lock = threading.Lock()
+
+    def _current(self) -> list:
+        second = int(time.monotonic())
+        while self._seconds and self._seconds[0][0] <= second - self._settings.RETRY_BUDGET_WINDOW:
+            self._seconds.popleft()
+        if not self._seconds or self._seconds[-1][0] != second:
+            self._seconds.append([second, 0, 0])
+        return self._seconds[-1]
+
+    def record_attempt(self) -> None:
+        with self._lock:
+            self._current()[1] += 1
+
+    def withdraw(self) -> bool:
+        """
+        :return: True if a retry fits in the budget, which it is then counted against
+        """
+        with self._lock:
+            current = self._current()
+            attempts = sum(second[1] for second in self._seconds)
+            retries = sum(second[2] for second in self._seconds)
+            allowed = self._settings.RETRY_BUDGET_RATIO * attempts + \
+                self._settings.RETRY_BUDGET_MIN_PER_SECOND * self._settings.RETRY_BUDGET_WINDOW
+            if retries >= allowed:
+                return False
+            current[2] += 1
+            return True
+
+
+def get_budget(name: str, settings: AppConfig) -> RetryBudget:
+    """
+    Returns the process-wide retry budget of a task class, creating it on first use.
+    :param settings: The application settings the budget is created with
+    """
+    with _lock:
+        budget = _budgets.get(name)
+        if budget is None:
+            budget = _budgets[name] = RetryBudget(settings)
+        return budget
+
+
+class RetryPolicy:
+    """
+    How the tasks of a class, e.g. the intake tasks, are retried: Celery's exponential backoff with full jitter, at
+    most max_retries times, only for retryable errors and within the class's retry budget. Retries and the errors
+    that are not retried are counted in the APM metric set as task_retries, task_retry_delay_seconds and
+    task_retries_abandoned, labelled by task. A task given up on is saved to the dead letters collection, if the
+    policy has one, so that it can be replayed.
+    """
+
+    def __init__(self, name: str, settings: AppConfig, metrics=None,
+                 dead_letters: Optional[Callable[[], collection.Collection]] = None):
+        """
+        :param name: The task class, whose backoff and max retries are read from RETRY_POLICIES
+        :param settings: The application settings holding RETRY_POLICIES and the retry budget limits
+        :param metrics: An optional APM metric set
+        :param dead_letters: Returns the collection the tasks given up on are saved to
+        """
+        self._logger = logging.getLogger(__name__)
+        self.name = name
+        self._settings = settings
+        self.metrics = metrics
+        self._dead_letters = dead_letters
+        policy = settings.RETRY_POLICIES[name]
+        self.backoff = policy['backoff']
+        self.backoff_max = policy['backoff_max']
+        self.max_retries = policy['max_retries']
+
+    def countdown(self, retries: int) -> int:
+        """
+        The delay Celery's retry_backoff gives a task, for retries the autoretry wrapper does not make.
+        """
+        return get_exponential_backoff_interval(self.backoff, retries, self.backoff_max, full_jitter=True)
+
+    def record_attempt(self) -> None:
+        get_budget(self.name, self._settings).record_attempt()
+
+    def _count(self, name: str, task: str, value: float = 1, **labels) -> None:
+        if self.metrics is not None:
+            self.metrics.counter(name, reset_on_collect=True, task=task, **labels).inc(value)
+
+    def next_countdown(self, task: str, exc: BaseException, retries: int, countdown: Optional[float] = None,
+                       dont_retry_for: tuple = NON_RETRYABLE_ERRORS) -> Optional[float]:
+        """
+        :param task: The name of the failed task
+        :param exc: The error it failed with
+        :param retries: The number of times it has been retried
+        :param countdown: The backoff Celery worked out for the retry, if it did
+        :param dont_retry_for: The errors that are not retried, unless they are also RETRYABLE_ERRORS
+        :return: The seconds to wait before retrying the task, or None if it is not to be retried
+        """
+        if not is_retryable(exc, dont_retry_for):
+            self._count('task_retries_abandoned', task, reason=NON_RETRYABLE)
+            return None
+        if retries >= self.max_retries:
+            self._count('task_retries_abandoned', task, reason=MAX_RETRIES)
+            return None
+        reason, countdown = BACKOFF, self.countdown(retries) if countdown is None else countdown
+        if not get_budget(self.name, self._settings).withdraw():
+            self._logger.warning(f'Retry budget of {self.name} tasks exhausted, retrying {task} in {self.backoff_max}s')
+            reason, countdown = BUDGET, self.backoff_max
+        self._count('task_retries', task, reason=reason)
+        self._count('task_retry_delay_seconds', task, countdown)
+        return countdown
+
+    def dead_letter(self, task: str, args: tuple, kwargs: dict, exc: BaseException) -> None:
+        """
+        Saves a task that is given up on, with the error it last failed with. A failure to save it is logged rather
+        than raised, so that the task's own error is the one reported.
+        """
+        if self._dead_letters is None:
+            return
+        try:
+            self._dead_letters().insert_one({'task': task, 'args': list(args or ()), 'kwargs': dict(kwargs or {}),
+                                             'error': repr(exc), 'failed': datetime.utcnow()})
+            self._count('task_dead_letters', task)
+        except Exception as e:
+            self._logger.exception(f'Unable to save {task} to the dead letters: {e}')
+
+
+class PolicyTask(Task):
+    """
+    A task retried by its backoff_policy. Use it with autoretry_for=(Exception,), max_retries set to the policy's,
+    and Celery's retry_backoff, retry_backoff_max and retry_jitter set to its backoff, backoff_max and True. The
+    policy only adds the retry budget. Errors in dont_autoretry_for are not retried, as with the option of that name
+    in later Celery releases, unless they are also RETRYABLE_ERRORS. A task that is not retried is dead lettered.
+    """
+    backoff_policy: Optional[RetryPolicy] = None
+    dont_autoretry_for = NON_RETRYABLE_ERRORS
+
+    def before_start(self, task_id, args, kwargs):
+        if self.backoff_policy is not None and not self.request.retries:
+            self.backoff_policy.record_attempt()
+
+    def retry(self, args=None, kwargs=None, exc=None, throw=True, eta=None, countdown=None, max_retries=None,
+              **options):
+        if self.backoff_policy is not None and exc is not None and not self.request.called_directly:
+            countdown = self.backoff_policy.next_countdown(self.name, exc, self.request.retries, countdown,
+                                                           self.dont_autoretry_for)
+            if countdown is None:
+                self.backoff_policy.dead_letter(self.name, self.request.args if args is None else args,
+                                                self.request.kwargs if kwargs is None else kwargs, exc)
+                raise exc
+        return super().retry(args, kwargs, exc, throw, eta, countdown, max_retries, **options)
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    _lock = threading.Lock()
+    _budgets.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
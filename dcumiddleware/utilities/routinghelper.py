@@ -1,13 +1,14 @@
 import logging
 import os
 
-from dcdatabase.phishstorymongo import PhishstoryMongo
-
 from dcumiddleware.settings import AppConfig, config_by_name
 
 env = os.getenv('sysenv', 'unit-test')
 app_settings: AppConfig = config_by_name[env]()
 
+PAYLOAD_MODE = 'payload'
+CLAIM_CHECK_MODE = 'claim_check'
+
 
 class RoutingHelper:
     EMEA = 'EMEA'
@@ -17,6 +18,10 @@ class RoutingHelper:
     KEY_TICKET_ID = 'ticketId'
     KEY_ABUSE_META = 'abuseMeta'
     KEY_PHISHSTORY_STATUS = 'phishstory_status'
+    KEY_CLAIM_CHECK = 'claimCheck'
+    KEY_LAST_MODIFIED = 'last_modified'
+    # Bumped whenever the claim check envelope changes shape.
+    CLAIM_CHECK_VERSION = 1
     """
     Responsible for all routing responsibilities to the brand services.
     """
@@ -27,16 +32,19 @@ class RoutingHelper:
 
     _brands_routed_to_gd = {'GODADDY', '123REG', 'FOREIGN'}
 
-    def __init__(self, capp, api, db):
+    def __init__(self, capp, api, db, routing_mode=None):
         """
         :param capp: handle to Celery
         :param api: handle to abuse api
         :param db: handle to db
+        :param routing_mode: PAYLOAD_MODE to send brand services the whole incident, or CLAIM_CHECK_MODE to send
+        only what they need to load it. Defaults to the ROUTING_MODE setting.
         """
         self._logger = logging.getLogger(__name__)
         self._capp = capp
         self._api = api
         self._db = db
+        self._routing_mode = routing_mode or app_settings.ROUTING_MODE
 
     def route(self, data):
         """
@@ -52,8 +60,7 @@ class RoutingHelper:
         if abuse_meta == 'DSA':
             ticket_id = data.get(self.KEY_TICKET_ID)
             self._capp.send_task('routing.run.process_external_report', args=[ticket_id])
-            db = PhishstoryMongo(app_settings)
-            db.update_incident(ticket_id, {self.KEY_PHISHSTORY_STATUS: 'FORWARDED_TO_EXTERNAL_SERVICE'})
+            self._db.update_incident(ticket_id, {self.KEY_PHISHSTORY_STATUS: 'FORWARDED_TO_EXTERNAL_SERVICE'})
             data[self.KEY_PHISHSTORY_STATUS] = 'FORWARDED_TO_EXTERNAL_SERVICE'
             return data
 
@@ -96,6 +103,21 @@ class RoutingHelper:
 
         return brands
 
+    def _claim_check(self, service, data):
+        """
+        The envelope sent in claim check mode. The incident has already been saved, so the brand service loads it
+        by ticket ID, and can compare last_modified to tell whether it read the enriched version.
+        :param service:
+        :param data:
+        :return: dict envelope
+        """
+        return {
+            self.KEY_TICKET_ID: data[self.KEY_TICKET_ID],
+            self.KEY_BRAND: service,
+            self.KEY_CLAIM_CHECK: self.CLAIM_CHECK_VERSION,
+            self.KEY_LAST_MODIFIED: data.get(self.KEY_LAST_MODIFIED)
+        }
+
     def _route_to_brand(self, service, data):
         """
         Routes the provided data to the specified service, else logs error
@@ -105,6 +127,8 @@ class RoutingHelper:
         """
         try:
             self._logger.info('Routing {} to {} brand services'.format(data[self.KEY_TICKET_ID], service))
+            if self._routing_mode == CLAIM_CHECK_MODE:
+                data = self._claim_check(service, data)
             self._capp.send_task(self._brands.get(service), (data,))
         except Exception as e:
             self._logger.error('Error trying to route ticket to {} brand services: {}'.format(service, e))
@@ -0,0 +1,79 @@
+import struct
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+import msgpack
+from kombu.serialization import register
+
+SERIALIZER_NAME = 'dcu-msgpack'
+CONTENT_TYPE = 'application/x-dcu-msgpack'
+
+# Every payload starts with a two byte header: the schema version, then flags.
+SCHEMA_VERSION = 1
+FLAG_COMPRESSED = 0x01
+_HEADER = struct.Struct('>BB')
+
+# msgpack extension types. Naive datetimes, which is what CMAP and Mongo hand back, must stay naive.
+EXT_NAIVE_DATETIME = 1
+EXT_UTC_DATETIME = 2
+_MICROSECONDS = struct.Struct('>q')
+_EPOCH = datetime(1970, 1, 1)
+_UTC_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Compressing a small payload costs more time than its bytes on the wire.
+DEFAULT_COMPRESS_THRESHOLD = 4096
+_COMPRESSION_LEVEL = 1
+
+
+def _default(obj: Any):
+    if isinstance(obj, datetime):
+        if obj.tzinfo is None:
+            return msgpack.ExtType(EXT_NAIVE_DATETIME, _MICROSECONDS.pack((obj - _EPOCH) // timedelta(microseconds=1)))
+        return msgpack.ExtType(EXT_UTC_DATETIME, _MICROSECONDS.pack((obj - _UTC_EPOCH) // timedelta(microseconds=1)))
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f'Cannot serialize {type(obj).__name__}')
+
+
+def _ext_hook(code: int, data: bytes):
+    if code == EXT_NAIVE_DATETIME:
+        return _EPOCH + timedelta(microseconds=_MICROSECONDS.unpack(data)[0])
+    if code == EXT_UTC_DATETIME:
+        return _UTC_EPOCH + timedelta(microseconds=_MICROSECONDS.unpack(data)[0])
+    return msgpack.ExtType(code, data)
+
+
+def dumps(obj: Any, compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD) -> bytes:
+    """
+    Encodes a task payload as msgpack behind a versioned header. Datetimes round trip, tuples and sets come back
+    as lists, as they would from JSON.
+    :param compress_threshold: Payloads at least this many bytes long are zlib compressed. 0 turns compression off.
+    """
+    payload = msgpack.packb(obj, default=_default, use_bin_type=True)
+    flags = 0
+    if 0 < compress_threshold <= len(payload):
+        payload = zlib.compress(payload, _COMPRESSION_LEVEL)
+        flags |= FLAG_COMPRESSED
+    return _HEADER.pack(SCHEMA_VERSION, flags) + payload
+
+
+def loads(data: bytes) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    version, flags = _HEADER.unpack_from(data)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f'Unsupported payload schema version {version}')
+    payload = data[_HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+    return msgpack.unpackb(payload, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def register_serializer(compress_threshold: int = DEFAULT_COMPRESS_THRESHOLD) -> None:
+    """
+    Registers the serializer with kombu as SERIALIZER_NAME, so that it can be named in task_serializer and
+    accept_content.
+    """
+    register(SERIALIZER_NAME, lambda obj: dumps(obj, compress_threshold), loads, content_type=CONTENT_TYPE,
+             content_encoding='binary')
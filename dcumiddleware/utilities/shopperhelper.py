@@ -1,39 +1,147 @@
+import json
 import logging
+from typing import Optional
 
-import requests
+from dcumiddleware.settings import AppConfig
+from dcumiddleware.utilities.asyncclient import get_client
+from dcumiddleware.utilities.cache import MEMORY_BACKEND, get_cache
+from dcumiddleware.utilities.circuitbreaker import get_breaker, server_error
+from dcumiddleware.utilities.httpsession import get_session
+from dcumiddleware.utilities.singleflight import get_single_flight
 
 
 class ShopperApiHelper:
+    SESSION_NAME = 'shopper'
+    CACHE_NAME = 'shopper-ids'
     SHOPPER_PARAMS = {'auditClientIp': 'cmap.service.int.godaddy.com'}
     SHOPPER_KEY = 'shopperId'
     CUSTOMER_KEY = 'customerId'
+    # Cache key prefixes, named for the ID being translated
+    FROM_CUSTOMER = 'customer'
+    FROM_SHOPPER = 'shopper'
 
-    def __init__(self, shopper_url: str, cert_file_path: str, key_file_path: str):
+    def __init__(self, shopper_url: str, cert_file_path: str, key_file_path: str, settings: AppConfig, metrics=None,
+                 cache_size: int = 0, cache_ttl: float = 24 * 60 * 60, negative_ttl: float = 60):
+        """
+        :param settings: The application settings the shared HTTP session is configured from
+        :param metrics: An optional APM metric set that ID cache hits and misses, and lookups joined onto one already
+            in flight, are counted in
+        :param cache_size: Translations kept by the process-wide ID cache. A size of 0 disables it.
+        :param cache_ttl: Seconds a translation is cached for
+        :param negative_ttl: Seconds a failed lookup is cached for
+        """
         self._logger = logging.getLogger(__name__)
         self._shopper_url = shopper_url
         self._cert_file_path = cert_file_path
         self._key_file_path = key_file_path
+        self._settings = settings
+        self._metrics = metrics
+        self._cache = get_cache(self.CACHE_NAME, MEMORY_BACKEND, cache_size, cache_ttl)
+        self._negative_ttl = negative_ttl
+        self._flight = get_single_flight(self.SESSION_NAME)
 
-    def get_shopper_id(self, customer_id: str) -> str:
-        url = f'{self._shopper_url}/v1/customers/{customer_id}/shopper'
+    def _cached(self, direction: str, lookup_id: str) -> Optional[str]:
+        """
+        :return: The cached translation, '' for a cached failure, or None on a miss
+        """
+        if self._cache is None:
+            return None
+        translated_id = self._cache.get(f'{direction}:{lookup_id}')
+        if self._metrics is not None:
+            name = 'shopper_cache_miss' if translated_id is None else 'shopper_cache_hit'
+            self._metrics.counter(name, reset_on_collect=True).inc(1)
+        return translated_id
+
+    def _remember(self, direction: str, lookup_id: str, translated_id: str) -> None:
+        """
+        Caches a translation in both directions. A failed lookup is only cached for the negative TTL, so that an
+        outage does not turn into a retry storm but the ID is looked up again soon after.
+        """
+        if self._cache is None:
+            return
+        if not translated_id:
+            self._cache.set(f'{direction}:{lookup_id}', '', self._negative_ttl)
+            return
+        reverse = self.FROM_SHOPPER if direction == self.FROM_CUSTOMER else self.FROM_CUSTOMER
+        self._cache.set(f'{direction}:{lookup_id}', translated_id)
+        self._cache.set(f'{reverse}:{translated_id}', lookup_id)
+
+    def _get_field(self, url: str, field: str) -> str:
         cert = (self._cert_file_path, self._key_file_path)
         try:
-            resp = requests.get(url, params=self.SHOPPER_PARAMS, cert=cert)
+            resp = get_breaker(self.SESSION_NAME, self._settings, self._metrics).call(
+                get_session(self.SESSION_NAME, self._settings).get, url, params=self.SHOPPER_PARAMS, cert=cert, failed=server_error
+            )
             resp.raise_for_status()
             data = resp.json()
-            return data[self.SHOPPER_KEY]
+            return data[field]
         except Exception as e:
             self._logger.exception('Error in shopper request.', e)
             return ''
 
+    def _translate(self, direction: str, lookup_id: str, url: str, field: str) -> str:
+        translated_id = self._get_field(url, field)
+        self._remember(direction, lookup_id, translated_id)
+        return translated_id
+
+    def get_shopper_id(self, customer_id: str) -> str:
+        shopper_id = self._cached(self.FROM_CUSTOMER, customer_id)
+        if shopper_id is None:
+            shopper_id = self._flight.do(f'{self.FROM_CUSTOMER}:{customer_id}', lambda: self._translate(
+                self.FROM_CUSTOMER, customer_id, f'{self._shopper_url}/v1/customers/{customer_id}/shopper', self.SHOPPER_KEY
+            ), self._metrics)
+        return shopper_id
+
     def get_customer_id(self, shopper_id: str) -> str:
-        url = f'{self._shopper_url}/v1/shoppers/{shopper_id}'
+        customer_id = self._cached(self.FROM_SHOPPER, shopper_id)
+        if customer_id is None:
+            customer_id = self._flight.do(f'{self.FROM_SHOPPER}:{shopper_id}', lambda: self._translate(
+                self.FROM_SHOPPER, shopper_id, f'{self._shopper_url}/v1/shoppers/{shopper_id}', self.CUSTOMER_KEY
+            ), self._metrics)
+        return customer_id
+
+
+class AsyncShopperApiHelper(ShopperApiHelper):
+    """
+    ShopperApiHelper whose ID translations are coroutines on the process-wide async HTTP client.
+    """
+
+    def __init__(self, shopper_url: str, cert_file_path: str, key_file_path: str, settings: AppConfig, metrics=None,
+                 cache_size: int = 0, cache_ttl: float = 24 * 60 * 60, negative_ttl: float = 60):
+        super().__init__(shopper_url, cert_file_path, key_file_path, settings, metrics, cache_size, cache_ttl,
+                         negative_ttl)
+        self._flight = get_single_flight(self.SESSION_NAME, asynchronous=True)
+
+    async def _get_field(self, url: str, field: str) -> str:
         cert = (self._cert_file_path, self._key_file_path)
         try:
-            resp = requests.get(url, params=self.SHOPPER_PARAMS, cert=cert)
-            resp.raise_for_status()
-            data = resp.json()
-            return data[self.CUSTOMER_KEY]
+            response = await get_breaker(self.SESSION_NAME, self._settings, self._metrics).call_async(
+                get_client(self._settings).request, 'GET', url, cert=cert, params=self.SHOPPER_PARAMS, failed=server_error
+            )
+            if response.status >= 400:
+                raise Exception(f'Shopper API returned {response.status}')
+            return json.loads(response.text)[field]
         except Exception as e:
             self._logger.exception('Error in shopper request.', e)
             return ''
+
+    async def _translate(self, direction: str, lookup_id: str, url: str, field: str) -> str:
+        translated_id = await self._get_field(url, field)
+        self._remember(direction, lookup_id, translated_id)
+        return translated_id
+
+    async def get_shopper_id(self, customer_id: str) -> str:
+        shopper_id = self._cached(self.FROM_CUSTOMER, customer_id)
+        if shopper_id is None:
+            shopper_id = await self._flight.do(f'{self.FROM_CUSTOMER}:{customer_id}', lambda: self._translate(
+                self.FROM_CUSTOMER, customer_id, f'{self._shopper_url}/v1/customers/{customer_id}/shopper', self.SHOPPER_KEY
+            ), self._metrics)
+        return shopper_id
+
+    async def get_customer_id(self, shopper_id: str) -> str:
+        customer_id = self._cached(self.FROM_SHOPPER, shopper_id)
+        if customer_id is None:
+            customer_id = await self._flight.do(f'{self.FROM_SHOPPER}:{shopper_id}', lambda: self._translate(
+                self.FROM_SHOPPER, shopper_id, f'{self._shopper_url}/v1/shoppers/{shopper_id}', self.CUSTOMER_KEY
+            ), self._metrics)
+        return customer_id
@@ -0,0 +1,106 @@
+import asyncio
+import copy
+import os
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict
+
+_flights: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+class SingleFlight:
+    """
+    Joins identical lookups that are in flight at the same time onto one upstream call. The first caller for a key
+    makes the call; callers arriving before it finishes wait for it and get a copy of its result, or its exception.
+    Nothing is kept once the call finishes, so this only complements a cache.
+    """
+
+    def __init__(self, name: str):
+        """
+        :param name: Names the coalesced calls counter, <name>_coalesced_calls
+        """
+        self._counter = f'{name}_coalesced_calls'
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, metrics) -> None:
+        if metrics is not None:
+            metrics.counter(self._counter, reset_on_collect=True).inc(1)
+
+    def do(self, key: str, fn: Callable[[], Any], metrics=None) -> Any:
+        """
+        :param key: Identifies the lookup; calls with equal keys must be interchangeable
+        :param fn: Makes the upstream call
+        :param metrics: An optional APM metric set that joined calls are counted in
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [Future(), 0]
+            else:
+                call[1] += 1
+        future = call[0]
+        if not leader:
+            self._count(metrics)
+            # Callers modify the enrichment they get back, so each one gets its own copy.
+            return copy.deepcopy(future.result())
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call[1]
+        # The waiters copy from a snapshot, since the caller may modify the result while they do.
+        future.set_result(copy.deepcopy(result) if waiters else result)
+        return result
+
+
+class AsyncSingleFlight(SingleFlight):
+    """
+    SingleFlight for coroutines on the process-wide event loop. The upstream call runs as a task of its own, so it
+    is not cancelled while any caller still waits on it.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._tasks: Dict[str, list] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable], metrics=None) -> Any:
+        call = self._tasks.get(key)
+        if call is not None:
+            call[1] += 1
+            self._count(metrics)
+            return copy.deepcopy(await asyncio.shield(call[0]))
+        task = asyncio.ensure_future(fn())
+        call = self._tasks[key] = [task, 0]
+        task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        result = await asyncio.shield(task)
+        # Waiters resume alongside this caller, so none of them may share its result.
+        return copy.deepcopy(result) if call[1] else result
+
+
+def get_single_flight(name: str, asynchronous: bool = False) -> SingleFlight:
+    """
+    Returns the process-wide single-flight group registered under name, creating it on first use.
+    :param asynchronous: True for the group used by coroutines
+    """
+    key = f'{name}:async' if asynchronous else name
+    with _lock:
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _flights[key] = AsyncSingleFlight(name) if asynchronous else SingleFlight(name)
+        return flight
+
+
+def _after_fork_in_child() -> None:
+    global _lock
+    _lock = threading.Lock()
+    _flights.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.case import TestCase
+
+from dcumiddleware.utilities.asyncclient import AsyncEnrichmentExecutor
+from dcumiddleware.utilities.cmapservicehelper import AsyncCmapServiceHelper
+from dcumiddleware.utilities.shopperhelper import AsyncShopperApiHelper
+from tests.fakecmapserver import FakeCmapServer
+from tests.test_settings import TestingConfig
+
+
+class TestAsyncClient(TestCase):
+    def setUp(self):
+        self.server = FakeCmapServer().__enter__()
+        self.config = TestingConfig()
+        self.config.CMAP_SERVICE = self.server.url
+        self.config.SSO_URL = self.server.url
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def test_domain_query(self):
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        cmap_helper = AsyncCmapServiceHelper(self.config)
+        result = enrichment.result(enrichment.submit(cmap_helper.domain_query, 'example.com', '/path'))
+        host = result['data']['domainQuery']['host']
+        self.assertEqual(host['guid'], 'guid-example.com')
+        self.assertIsNone(host['reseller'])
+        self.assertEqual(host['createdDate'].year, 2020)
+        method, path, headers, _ = self.server.requests[-1]
+        self.assertEqual((method, path), ('POST', '/graphql'))
+        self.assertEqual(headers['Authorization'], 'sso-jwt token-1')
+
+    def test_shopper_lookups(self):
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        shopper_helper = AsyncShopperApiHelper(self.server.url, '', '', self.config)
+        self.assertEqual(enrichment.result(enrichment.submit(shopper_helper.get_shopper_id, 'c1')), 'shopper-c1')
+        self.assertEqual(enrichment.result(enrichment.submit(shopper_helper.get_customer_id, 's1')), 'customer-s1')
+
+    def test_many_tickets_in_flight(self):
+        self.server.latency = 0.2
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        cmap_helper = AsyncCmapServiceHelper(self.config)
+        enrichment.result(enrichment.submit(cmap_helper.get_jwt_async))
+        start = time.monotonic()
+        lookups = [enrichment.submit(cmap_helper.domain_query, f'example{i}.com', '/') for i in range(20)]
+        domains = [enrichment.result(lookup)['data']['domainQuery']['domain'] for lookup in lookups]
+        self.assertEqual(domains, [f'example{i}.com' for i in range(20)])
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_tickets_on_worker_threads_overlap(self):
+        cmap_helper = AsyncCmapServiceHelper(self.config)
+        AsyncEnrichmentExecutor(5, self.config).result(
+            AsyncEnrichmentExecutor(5, self.config).submit(cmap_helper.get_jwt_async))
+        # Each lookup is answered only once all ten are in flight, which serial tickets never are.
+        barrier = threading.Barrier(10)
+
+        def meet() -> float:
+            try:
+                barrier.wait(5)
+            except threading.BrokenBarrierError:
+                pass
+            return 0
+        self.server.latency = meet
+
+        def ticket(i: int) -> str:
+            # Like a task on Celery's threads pool, each ticket blocks its own thread on its own executor.
+            enrichment = AsyncEnrichmentExecutor(5, self.config)
+            lookup = enrichment.submit(AsyncCmapServiceHelper(self.config).domain_query, f'example{i}.com', '/')
+            return enrichment.result(lookup)['data']['domainQuery']['domain']
+
+        with ThreadPoolExecutor(10) as pool:
+            domains = list(pool.map(ticket, range(10)))
+        self.assertEqual(domains, [f'example{i}.com' for i in range(10)])
+        self.assertFalse(barrier.broken)
+
+    def test_timeout_cancels_lookup(self):
+        self.server.latency = 1
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        cmap_helper = AsyncCmapServiceHelper(self.config)
+        lookup = enrichment.submit(cmap_helper.domain_query, 'example.com', '/')
+        with self.assertRaises(TimeoutError):
+            enrichment.result(lookup, 0.1)
+        self.assertTrue(lookup.cancelled())
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
+from tests.fakecmapserver import domain_query_response
+from tests.test_settings import TestingConfig
+
+
+def cmapv2_response(domain: str) -> dict:
+    return {
+        'customers': {
+            f'customer-{domain}': {
+                'createdDate': '2018-05-01',
+                'plid': 1,
+                'vip': False,
+                'blacklist': False,
+                'parentCustomerId': '',
+                'attributes': {'domainCount': 13, 'vipPortfolio': ''}
+            }
+        },
+        'products': {
+            f'product-{domain}-{i}': {
+                'customerId': f'customer-{domain}',
+                'createdDate': '2018-05-01',
+                'plid': 1,
+                'vip': False,
+                'blacklist': False,
+                'product': 'GoCentral',
+                'attributes': {
+                    'vipPortfolio': '', 'dataCenter': 'P3', 'containerId': None, 'hostname': f'host{i}.{domain}',
+                    'ip': '10.0.0.1', 'os': 'Linux', 'mwpId': None, 'friendlyName': None, 'username': None,
+                    'managedLevel': None
+                },
+                'associatedProducts': [f'product-{domain}-{j}' for j in range(4) if j != i]
+            } for i in range(4)
+        },
+        'brand': 'GODADDY',
+        'hostingCompanyName': 'GoDaddy.com LLC',
+        'abuseEmail': 'abuse@godaddy.com'
+    }
+
+
+def enriched_incident(number: int = 1) -> dict:
+    """
+    An incident as _route_to_brand_services sends it: the submitted ticket merged with CMAP and CMAP V2 data,
+    including the datetimes that CMAP Service responses are parsed into.
+    """
+    domain = f'example{number}.com'
+    now = datetime(2024, 1, 1, 12, 30)
+    incident = {
+        '_id': f'DCU{number:09d}',
+        'ticketId': f'DCU{number:09d}',
+        'type': 'PHISHING',
+        'source': f'https://www.{domain}/login/account/verify.php?session=abcdef0123456789&next=%2Fhome',
+        'sourceDomainOrIp': domain,
+        'sourceSubDomain': f'www.{domain}',
+        'target': 'The spam Brothers',
+        'proxy': 'Must be viewed from an German IP',
+        'info': 'My spam Farm is better than yours... ' * 8,
+        'reporter': '10101010',
+        'reporterCid': 'c1e2a0f4-9c0e-4a1b-8f43-5b1e3a3d9e10',
+        'phishstory_status': 'PROCESSING',
+        'abuseVerified': False,
+        'hosted_status': 'HOSTED',
+        'created': now,
+        'last_modified': now + timedelta(seconds=2),
+        'metadata': {'customerId': f'customer-{domain}', 'entitlementId': f'entitlement-{domain}'},
+        'evidence': {'screenshot_id': '5f0c1c2a9d8e7b6a5c4d3e2f', 'sourcecode_id': '5f0c1c2a9d8e7b6a5c4d3e30'},
+        'actions': [{'status': 'open', 'timestamp': now}]
+    }
+    cmap_data = CmapServiceHelper(TestingConfig())._parse_domain_query_result(domain_query_response(domain))
+    return dict(list(incident.items()) + list(cmap_data.items()) + [('cmapv2Data', cmapv2_response(domain))])
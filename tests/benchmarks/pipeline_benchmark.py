@@ -0,0 +1,64 @@
+"""
+Compares the broker traffic of one ticket through the chained and the fused pipeline, i.e. PIPELINE_MODE chain and
+fused, as the Celery messages each mode publishes.
+
+    python -m tests.benchmarks.pipeline_benchmark
+"""
+import pickle
+import timeit
+
+from celery import Celery
+
+from tests.benchmarks.payloads import enriched_incident
+
+REPEAT = 5
+NUMBER = 2000
+
+app = Celery()
+
+
+def signature(name: str, *args):
+    return app.signature(name, args=args, options={'acks_late': True}).freeze()
+
+
+def messages(mode: str) -> list:
+    """
+    :return: The (args, kwargs, embed) bodies published for one ticket, in order
+    """
+    ticket = {'ticketId': 'DCU000000001'}
+    if mode == 'fused':
+        return [((ticket,), {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None})]
+    # process reads the incident and starts a chain, which carries the signatures of its remaining tasks
+    incident = enriched_incident()
+    for key in ('cmapv2Data', 'data', 'metadata'):
+        incident.pop(key, None)
+    enriched = enriched_incident()
+    route, blacklist = signature('run._route_to_brand_services'), signature('run._check_for_blacklist_auto_actions')
+    return [
+        ((ticket,), {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}),
+        ((incident,), {}, {'callbacks': None, 'errbacks': None, 'chain': [route, blacklist], 'chord': None}),
+        ((enriched,), {}, {'callbacks': None, 'errbacks': None, 'chain': [route], 'chord': None}),
+        ((enriched,), {}, {'callbacks': None, 'errbacks': None, 'chain': None, 'chord': None}),
+    ]
+
+
+def encode(bodies: list) -> list:
+    return [pickle.dumps(body, protocol=pickle.HIGHEST_PROTOCOL) for body in bodies]
+
+
+def decode(encoded: list) -> list:
+    return [pickle.loads(body) for body in encoded]
+
+
+def main() -> None:
+    print(f'{"mode":<8}{"messages":>10}{"bytes":>8}{"encode us":>12}{"decode us":>12}')
+    for mode in ('chain', 'fused'):
+        bodies = messages(mode)
+        encoded = encode(bodies)
+        encode_us = min(timeit.repeat(lambda: encode(bodies), repeat=REPEAT, number=NUMBER)) / NUMBER * 1e6
+        decode_us = min(timeit.repeat(lambda: decode(encoded), repeat=REPEAT, number=NUMBER)) / NUMBER * 1e6
+        print(f'{mode:<8}{len(bodies):>10}{sum(map(len, encoded)):>8}{encode_us:>12.1f}{decode_us:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Compares the tickets per second one worker enriches under the prefork and gevent pools, against local stand-ins
+for CMAP Service, the Shopper API and DNS that answer after a fixed latency.
+
+    python -m tests.benchmarks.pool_benchmark [tickets] [latency]
+
+Each pool runs in a worker process of its own, started the way the Dockerfile starts Celery, so that gevent's
+monkey patching does not leak into the other runs.
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+from tests.fakecmapserver import FakeCmapServer
+from tests.fakednsserver import FakeDnsServer
+
+TICKETS = 400
+LATENCY = 0.2
+DEADLINE = 60
+# (pool, concurrency) pairs, prefork at typical pod sizes and gevent at a fraction of its usual 100s
+RUNS = [('prefork', 4), ('prefork', 16), ('gevent', 16), ('gevent', 64), ('gevent', 200)]
+
+# The settings of the worker process, set before its tickets are enriched
+_config = None
+
+
+def domain(ticket: int) -> str:
+    return f'ticket-{ticket}.example.com'
+
+
+def enrich(ticket: int) -> dict:
+    """
+    Makes the lookups _load_and_enrich_data makes for a ticket, each through a new helper as in a task.
+    """
+    from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
+    from dcumiddleware.utilities.dnsresolver import DnsResolver
+    from dcumiddleware.utilities.enrichment import EnrichmentExecutor
+    from dcumiddleware.utilities.shopperhelper import ShopperApiHelper
+
+    enrichment = EnrichmentExecutor(DEADLINE, _config)
+    ip = DnsResolver(_config).resolve(domain(ticket))
+    cmap_lookup = enrichment.submit(CmapServiceHelper(_config).domain_query, domain(ticket), '/', False)
+    shopper_lookup = enrichment.submit(ShopperApiHelper(_config.CMAP_SERVICE, '', '', _config).get_shopper_id,
+                                       f'customer-{ticket}')
+    return {'ip': ip, 'cmap': enrichment.result(cmap_lookup), 'shopper': enrichment.result(shopper_lookup)}
+
+
+def worker(pool: str, concurrency: int, tickets: int, cmap_url: str, dns_port: int) -> None:
+    """
+    Enriches the tickets in this process and prints the tickets per second as JSON.
+    """
+    global _config
+    if pool == 'gevent':
+        # As Celery does for --pool gevent, before anything else is imported.
+        from gevent import monkey
+        monkey.patch_all()
+
+    from tests.test_settings import TestingConfig
+    _config = TestingConfig()
+    _config.CMAP_SERVICE = _config.SSO_URL = cmap_url
+    _config.DNS_NAMESERVERS, _config.DNS_PORT = ['127.0.0.1'], dns_port
+
+    start = time.monotonic()
+    if pool == 'gevent':
+        from gevent.pool import Pool
+        results = Pool(concurrency).map(enrich, range(tickets))
+    else:
+        from multiprocessing import get_context
+        with get_context('fork').Pool(concurrency) as processes:
+            results = processes.map(enrich, range(tickets), chunksize=1)
+    elapsed = time.monotonic() - start
+    assert all(result['ip'] and result['shopper'] for result in results)
+    print(json.dumps({'tickets_per_second': tickets / elapsed}))
+
+
+def run(pool: str, concurrency: int, tickets: int, cmap_url: str, dns_port: int) -> float:
+    env = dict(os.environ, WORKER_POOL=pool, WORKER_CONCURRENCY=str(concurrency))
+    output = subprocess.run(
+        [sys.executable, '-m', 'tests.benchmarks.pool_benchmark', '--worker', pool, str(concurrency), str(tickets),
+         cmap_url, str(dns_port)],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.splitlines()[-1])['tickets_per_second']
+
+
+def main(tickets: int = TICKETS, latency: float = LATENCY) -> None:
+    zone = {f'{domain(ticket)}.': {'A': ([f'192.0.2.{ticket % 250 + 1}'], 300)} for ticket in range(tickets)}
+    with FakeCmapServer(latency=latency) as cmap, FakeDnsServer(zone, latency=latency) as dns:
+        print(f'{tickets} tickets, {latency * 1000:.0f}ms per upstream call')
+        print(f'{"pool":<10}{"concurrency":>12}{"tickets/s":>12}')
+        for pool, concurrency in RUNS:
+            rate = run(pool, concurrency, tickets, cmap.url, dns.port)
+            print(f'{pool:<10}{concurrency:>12}{rate:>12.1f}')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--worker']:
+        pool, concurrency, tickets, cmap_url, dns_port = sys.argv[2:]
+        worker(pool, int(concurrency), int(tickets), cmap_url, int(dns_port))
+    else:
+        main(*(cast(arg) for cast, arg in zip((int, float), sys.argv[1:])))
@@ -0,0 +1,51 @@
+"""
+Compares the task payload serializers on enriched incidents.
+
+    python -m tests.benchmarks.serialization_benchmark
+"""
+import pickle
+import timeit
+
+from kombu.utils.json import dumps as json_dumps
+from kombu.utils.json import loads as json_loads
+
+from dcumiddleware.utilities import serialization
+from tests.benchmarks.payloads import enriched_incident
+
+REPEAT = 5
+NUMBER = 2000
+
+SERIALIZERS = {
+    'pickle': (lambda obj: pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+    'json': (json_dumps, json_loads),
+    'dcu-msgpack': (lambda obj: serialization.dumps(obj, 0), serialization.loads),
+    'dcu-msgpack+zlib': (lambda obj: serialization.dumps(obj, 1), serialization.loads),
+}
+
+
+def best_of(statement) -> float:
+    """
+    :return: The fastest time for one call, in microseconds
+    """
+    return min(timeit.repeat(statement, repeat=REPEAT, number=NUMBER)) / NUMBER * 1e6
+
+
+def run(payload: object, label: str) -> None:
+    print(f'\n{label}')
+    print(f'{"serializer":<18}{"bytes":>8}{"encode us":>12}{"decode us":>12}')
+    for name, (dumps, loads) in SERIALIZERS.items():
+        encoded = dumps(payload)
+        encode = best_of(lambda: dumps(payload))
+        decode = best_of(lambda: loads(encoded))
+        print(f'{name:<18}{len(encoded):>8}{encode:>12.1f}{decode:>12.1f}')
+
+
+def main() -> None:
+    incident = enriched_incident()
+    # Celery protocol 2 sends (args, kwargs, embed); the routed incident is the only argument.
+    run(((incident,), {}, {}), 'One enriched incident')
+    run(([enriched_incident(i) for i in range(20)], {}, {}), 'A batch of 20 enriched incidents')
+
+
+if __name__ == '__main__':
+    main()
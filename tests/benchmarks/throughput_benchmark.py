@@ -0,0 +1,288 @@
+"""
+Pushes synthetic tickets end to end through sync_customer_security, the pipeline and routing, in process. CMAP,
+CMAP V2, the Shopper API, SSO, the Abuse API and IRM are local fake HTTP servers, DNS is a local fake nameserver and
+MongoDB is mongomock unless --mongo-url names a real deployment. Celery runs the tasks eagerly and the brand service
+messages are published to an in-memory broker.
+
+    python -m tests.benchmarks.throughput_benchmark --tickets 500 --concurrency 16 --latency lognormal:0.05:0.5
+    python -m tests.benchmarks.throughput_benchmark --latency cmap=exponential:0.2 --mongo-url mongodb://localhost
+
+Reports tickets per second, the p50, p95 and p99 of every stage in the APM stage timings, the tasks, brand service
+messages, MongoDB operations and HTTP requests per ticket, and the peak RSS of the process. Since tasks run eagerly,
+the time of a task includes the tasks it starts.
+"""
+import argparse
+import functools
+import math
+import os
+import random
+import resource
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import mongomock
+from celery.signals import before_task_publish, task_prerun
+from pymongo import monitoring
+
+from dcumiddleware.settings import config_by_name
+from tests.benchmarks.payloads import cmapv2_response
+from tests.fakecmapserver import FakeCmapServer
+from tests.fakednsserver import FakeDnsServer
+
+DEPENDENCIES = ('cmap', 'cmapv2', 'shopper', 'sso', 'abuse-api', 'irm', 'dns')
+ABUSE_API_PATH = '/v1/abuse/tickets'
+# The mongomock collection operations counted when no MongoDB deployment is given
+COLLECTION_METHODS = ('find', 'find_one', 'find_one_and_update', 'find_one_and_replace', 'insert_one', 'insert_many',
+                      'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many', 'bulk_write',
+                      'aggregate', 'count_documents')
+PERCENTILES = (50, 95, 99)
+
+
+def latency(spec: str) -> Callable[[], float]:
+    """
+    Parses a latency distribution in seconds: fixed:SECONDS, uniform:LOW:HIGH, lognormal:MEDIAN:SIGMA or
+    exponential:MEAN.
+    """
+    kind, *params = spec.split(':')
+    try:
+        params = [float(param) for param in params]
+        if kind == 'fixed':
+            seconds, = params
+            return lambda: seconds
+        if kind == 'uniform':
+            low, high = params
+            return lambda: random.uniform(low, high)
+        if kind == 'lognormal':
+            median, sigma = params
+            return lambda: random.lognormvariate(math.log(median), sigma)
+        if kind == 'exponential':
+            mean, = params
+            return lambda: random.expovariate(1 / mean)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f'Invalid latency distribution {spec}')
+
+
+def dependency_latency(spec: str) -> Tuple[Tuple[str, ...], Callable[[], float]]:
+    """
+    Parses a latency distribution for every dependency, or for one as DEPENDENCY=DISTRIBUTION.
+    """
+    dependency, _, distribution = spec.rpartition('=')
+    if dependency and dependency not in DEPENDENCIES:
+        raise argparse.ArgumentTypeError(f'Unknown dependency {dependency}')
+    return (dependency,) if dependency else DEPENDENCIES, latency(distribution)
+
+
+def latencies(specs: List[Tuple[Tuple[str, ...], Callable[[], float]]]) -> Dict[str, Callable[[], float]]:
+    """
+    :return: The latency distribution of each dependency, where later --latency arguments override earlier ones
+    """
+    distributions = dict.fromkeys(DEPENDENCIES, 0)
+    for dependencies, distribution in specs:
+        distributions.update(dict.fromkeys(dependencies, distribution))
+    return distributions
+
+
+class FakeCmapV2Server(FakeCmapServer):
+    """
+    Answers host authority lookups with products that CmapV2Helper can map, rather than an empty product list.
+    """
+
+    def _route(self, method: str, path: str, query: dict, body: bytes):
+        if path == '/v1/cmap/lookupByHostAuthority':
+            return 200, cmapv2_response(query.get('host', [''])[0])
+        return super()._route(method, path, query, body)
+
+
+class MongoCalls(monitoring.CommandListener):
+    """
+    Counts MongoDB commands by name on a real deployment, or the equivalent collection operations on mongomock.
+    """
+
+    def __init__(self):
+        self.calls = Counter()
+        self._local = threading.local()
+
+    def started(self, event) -> None:
+        self.calls[event.command_name] += 1
+
+    def succeeded(self, event) -> None:
+        pass
+
+    def failed(self, event) -> None:
+        pass
+
+    def count_mongomock(self) -> None:
+        for name in COLLECTION_METHODS:
+            setattr(mongomock.collection.Collection, name,
+                    self._counted(name, getattr(mongomock.collection.Collection, name)))
+
+    def _counted(self, name: str, method: Callable) -> Callable:
+        @functools.wraps(method)
+        def counted(*args, **kwargs):
+            # mongomock implements some operations with others, e.g. find_one with find, so only the outermost counts.
+            depth = getattr(self._local, 'depth', 0)
+            if not depth:
+                self.calls[name] += 1
+            self._local.depth = depth + 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._local.depth = depth
+        return counted
+
+
+def ticket(number: int) -> dict:
+    domain = f'example{number}.com'
+    return {
+        'ticketId': f'DCU{number:09d}',
+        'type': 'PHISHING',
+        'source': f'https://www.{domain}/login/account/verify.php?session={number:016x}',
+        'sourceDomainOrIp': domain,
+        'sourceSubDomain': f'www.{domain}',
+        'target': 'The spam Brothers',
+        'proxy': 'Must be viewed from an German IP',
+        'info': 'My spam Farm is better than yours...',
+        'reporter': '10101010',
+        'irm_report_id': f'report-{number}'
+    }
+
+
+def percentile(values: List[float], q: int) -> float:
+    """
+    The nearest rank percentile of sorted values.
+    """
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def per_ticket(title: str, counts: Counter, tickets: int) -> None:
+    print(f'\n{title}')
+    for name, count in sorted(counts.items()):
+        print(f'  {name:<44}{count / tickets:>8.2f}')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--tickets', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8, help='tickets processed at once, each on a thread')
+    parser.add_argument('--latency', action='append', default=[], type=dependency_latency,
+                        help='fixed:S, uniform:LOW:HIGH, lognormal:MEDIAN:SIGMA or exponential:MEAN, for every '
+                             f'dependency or one of {", ".join(DEPENDENCIES)} as DEPENDENCY=DISTRIBUTION')
+    parser.add_argument('--blacklisted', type=float, default=0.05,
+                        help='share of tickets on the blacklist, which are closed through the Abuse API')
+    parser.add_argument('--sync-attributes', action='store_true',
+                        help='also sync an attribute of each ticket, which updates its IRM report')
+    parser.add_argument('--pipeline-mode', choices=('chain', 'fused'), default='chain')
+    parser.add_argument('--engine', choices=('threaded', 'async'), default='threaded')
+    parser.add_argument('--mongo-url', help='a MongoDB deployment to use instead of mongomock')
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    random.seed(args.seed)
+    distributions = latencies(args.latency)
+    tickets = [ticket(number) for number in range(args.tickets)]
+    blacklisted = {t['sourceDomainOrIp'] for t in tickets if random.random() < args.blacklisted}
+    zone = {}
+    for t in tickets:
+        for name in (t['sourceDomainOrIp'], t['sourceSubDomain']):
+            zone[f'{name}.'] = {'A': (['192.0.2.1'], 300)}
+
+    servers = {name: FakeCmapServer(distributions[name], name=name) for name in ('cmap', 'shopper', 'sso')}
+    servers['cmapv2'] = FakeCmapV2Server(distributions['cmapv2'], name='cmapv2')
+    servers['abuse-api'] = FakeCmapServer(distributions['abuse-api'], name='abuse-api', fallback=(204, None))
+    servers['irm'] = FakeCmapServer(distributions['irm'], name='irm', fallback=(200, {}))
+    servers['cmap'].blacklisted_domains = blacklisted
+    nameserver = FakeDnsServer(zone, distributions['dns'])
+
+    mongo_calls = MongoCalls()
+    if args.mongo_url:
+        monitoring.register(mongo_calls)
+        mongo = None
+    else:
+        mongo_calls.count_mongomock()
+        mongo = mongomock.patch(servers=(('localhost', 27017),), on_new='create')
+        mongo.start()
+
+    with servers['cmap'], servers['cmapv2'], servers['shopper'], servers['sso'], servers['abuse-api'], \
+            servers['irm'], nameserver:
+        # Every module instantiates the settings of its environment, so the class is pointed at the fakes before
+        # the service is imported.
+        settings = config_by_name[os.getenv('sysenv', 'unit-test')]
+        settings.CMAP_SERVICE = servers['cmap'].url
+        settings.CMAP_V2_SERVICE = servers['cmapv2'].url
+        settings.SHOPPER_API_URL = servers['shopper'].url
+        settings.SSO_URL = servers['sso'].url
+        settings.ABUSE_API_URL = servers['abuse-api'].url + ABUSE_API_PATH
+        settings.IRM_URL = servers['irm'].url
+        settings.DNS_NAMESERVERS, settings.DNS_PORT = ['127.0.0.1'], nameserver.port
+        settings.DBURL = args.mongo_url or 'localhost'
+        settings.PIPELINE_MODE = args.pipeline_mode
+        settings.ENRICHMENT_ENGINE = args.engine
+        # The tickets run on threads of this process, as they would under Celery's threads pool.
+        settings.WORKER_POOL, settings.WORKER_CONCURRENCY = 'threads', args.concurrency
+        os.environ.setdefault('DISABLESSL', 'true')
+        from dcumiddleware import run
+
+        run.app.conf.update(task_always_eager=True, task_eager_propagates=True, broker_url='memory://')
+        for domain in blacklisted:
+            run.get_bl_mongo_connection().insert_one({'entity': domain, 'action': 'false_positive'})
+
+        durations, durations_lock = defaultdict(list), threading.Lock()
+        record_stage = run.metricset.record_stage
+
+        def record(stage: str, outcome: str, seconds: float) -> None:
+            with durations_lock:
+                durations[stage].append(seconds)
+            record_stage(stage, outcome, seconds)
+
+        run.metricset.record_stage = record
+        tasks, published = Counter(), Counter()
+        task_prerun.connect(lambda sender=None, **kwargs: tasks.update([sender.name]), weak=False)
+        before_task_publish.connect(lambda sender=None, **kwargs: published.update([sender]), weak=False)
+
+        failures = Counter()
+
+        def process(data: dict) -> None:
+            try:
+                run.sync_customer_security.delay(data)
+                if args.sync_attributes:
+                    run.sync_attribute.delay(data['ticketId'], 'abuseVerified', True)
+            except Exception as e:
+                failures[type(e).__name__] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            list(executor.map(process, tickets))
+        elapsed = time.perf_counter() - start
+
+    if mongo is not None:
+        mongo.stop()
+
+    print(f'{args.tickets} tickets, {args.concurrency} at once, {args.pipeline_mode} pipeline, {args.engine} engine')
+    print(f'  tickets/s   {args.tickets / elapsed:>10.1f}')
+    print(f'  failed      {sum(failures.values()):>10} {dict(failures) or ""}')
+    print(f'  blacklisted {len(blacklisted):>10}')
+    print(f'  peak RSS    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:>10.1f} MiB')
+
+    print(f'\n  {"stage":<44}{"count":>8}' + ''.join(f'{f"p{q} ms":>10}' for q in PERCENTILES))
+    for stage, seconds in sorted(durations.items()):
+        seconds.sort()
+        print(f'  {stage:<44}{len(seconds):>8}' + ''.join(f'{percentile(seconds, q) * 1000:>10.1f}'
+                                                          for q in PERCENTILES))
+
+    per_ticket('Tasks per ticket', tasks, args.tickets)
+    per_ticket('Brand service messages per ticket', published, args.tickets)
+    per_ticket('MongoDB operations per ticket', mongo_calls.calls, args.tickets)
+    per_ticket('HTTP requests per ticket', Counter({name: len(server.requests) for name, server in servers.items()}),
+               args.tickets)
+    per_ticket('DNS queries per ticket', Counter(dns=len(nameserver.queries)), args.tickets)
+
+
+if __name__ == '__main__':
+    main()
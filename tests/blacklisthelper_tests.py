@@ -0,0 +1,81 @@
+from unittest.case import TestCase
+
+import mongomock
+from mock import patch
+
+from dcumiddleware.utilities.blacklisthelper import BlacklistHelper
+
+
+class TestBlacklistHelper(TestCase):
+    DOMAIN = 'test.com'
+    SUBDOMAIN = 'www.test.com'
+    DOMAIN_SHOPPER = 'domain-shopper'
+    HOST_SHOPPER = 'host-shopper'
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.blacklist
+        self.helper = BlacklistHelper(self.collection, {'godaddysites.com'})
+
+    def _blacklist(self, entity: str, action: str, category: str = 'godaddy_asset'):
+        self.collection.insert_one({'entity': entity, 'action': action, 'category': category})
+
+    def _get_action(self, domain: str = DOMAIN, domain_shopper: str = DOMAIN_SHOPPER,
+                    host_shopper: str = HOST_SHOPPER):
+        subdomain = self.SUBDOMAIN if domain == self.DOMAIN else f'www.{domain}'
+        return self.helper.get_action(domain, subdomain, domain_shopper, host_shopper)
+
+    def test_single_round_trip(self):
+        with patch.object(self.collection, 'find', wraps=self.collection.find) as mock_find:
+            self._get_action()
+        entities = [self.DOMAIN, self.SUBDOMAIN, self.HOST_SHOPPER, self.DOMAIN_SHOPPER]
+        mock_find.assert_called_once_with({'entity': {'$in': entities}})
+
+    def test_duplicate_entities_queried_once(self):
+        with patch.object(self.collection, 'find', wraps=self.collection.find) as mock_find:
+            self.helper.get_action(self.DOMAIN, self.DOMAIN, 'shopper', 'shopper')
+        mock_find.assert_called_once_with({'entity': {'$in': [self.DOMAIN, 'shopper']}})
+
+    def test_no_records(self):
+        self.assertIsNone(self._get_action())
+
+    def test_first_record_per_entity(self):
+        self._blacklist(self.DOMAIN, 'first')
+        self._blacklist(self.DOMAIN, 'second')
+        self.assertEqual(self._get_action(), 'first')
+
+    def test_precedence(self):
+        # (records, domain_shopper, host_shopper, expected action)
+        cases = [
+            ({self.DOMAIN: 'domain'}, self.DOMAIN_SHOPPER, self.HOST_SHOPPER, 'domain'),
+            ({self.DOMAIN: 'domain', self.SUBDOMAIN: 'subdomain'}, self.DOMAIN_SHOPPER, self.HOST_SHOPPER, 'domain'),
+            ({self.SUBDOMAIN: 'subdomain', self.HOST_SHOPPER: 'host'}, self.DOMAIN_SHOPPER, self.HOST_SHOPPER, 'subdomain'),
+            ({self.HOST_SHOPPER: 'host'}, None, self.HOST_SHOPPER, 'host'),
+            ({self.DOMAIN_SHOPPER: 'shopper'}, self.DOMAIN_SHOPPER, None, 'shopper'),
+            ({self.HOST_SHOPPER: 'host'}, self.DOMAIN_SHOPPER, self.HOST_SHOPPER, None),
+            ({self.DOMAIN_SHOPPER: 'shopper'}, self.DOMAIN_SHOPPER, self.HOST_SHOPPER, None),
+            ({self.HOST_SHOPPER: 'host', self.DOMAIN_SHOPPER: 'shopper'}, self.DOMAIN_SHOPPER, self.HOST_SHOPPER, 'host'),
+            ({self.HOST_SHOPPER: 'host'}, None, None, None),
+        ]
+        for records, domain_shopper, host_shopper, expected in cases:
+            with self.subTest(records=records, domain_shopper=domain_shopper, host_shopper=host_shopper):
+                self.collection.delete_many({})
+                for entity, action in records.items():
+                    self._blacklist(entity, action)
+                self.assertEqual(self._get_action(domain_shopper=domain_shopper, host_shopper=host_shopper), expected)
+
+    def test_user_gen_drops_every_match(self):
+        for entity in (self.DOMAIN, self.SUBDOMAIN, self.HOST_SHOPPER, self.DOMAIN_SHOPPER):
+            with self.subTest(entity=entity):
+                self.collection.delete_many({})
+                self._blacklist(self.DOMAIN, 'domain')
+                self._blacklist(self.HOST_SHOPPER, 'host')
+                self._blacklist(self.DOMAIN_SHOPPER, 'shopper')
+                self.collection.update_one({'entity': entity}, {'$set': {'category': 'user_gen'}}, upsert=True)
+                self.assertIsNone(self._get_action())
+
+    def test_enrich_on_subdomain(self):
+        self._blacklist('godaddysites.com', 'domain')
+        self.assertIsNone(self._get_action(domain='godaddysites.com', domain_shopper=None, host_shopper=None))
+        self._blacklist('www.godaddysites.com', 'subdomain')
+        self.assertEqual(self._get_action(domain='godaddysites.com', domain_shopper=None, host_shopper=None),
+                         'subdomain')
@@ -0,0 +1,130 @@
+import time
+from datetime import datetime, timedelta
+from unittest.case import TestCase
+
+import mongomock
+from mock import MagicMock, patch
+from pymongo.errors import OperationFailure
+
+from dcumiddleware.utilities.blacklisthelper import BlacklistHelper
+from dcumiddleware.utilities.blacklistindex import (CHANGE_STREAM_MODE,
+                                                    POLL_MODE, BlacklistIndex)
+
+
+class TestBlacklistIndex(TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.blacklist
+        self.now = datetime(2024, 1, 1)
+        self.collection.insert_one({'entity': 'test.com', 'action': 'false_positive', 'modified': self.now})
+        self.index = None
+
+    def tearDown(self):
+        if self.index:
+            self.index.stop()
+
+    def _index(self, mode: str = POLL_MODE, collection=None, **kwargs) -> BlacklistIndex:
+        settings = dict(poll_interval=0.01, max_staleness=1, modified_field='modified', reload_interval=60)
+        settings.update(kwargs)
+        self.index = BlacklistIndex(collection or self.collection, mode, **settings)
+        return self.index
+
+    def _wait_for(self, condition):
+        deadline = time.monotonic() + 2
+        while not condition():
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_not_fresh_until_loaded(self):
+        index = self._index()
+        self.assertFalse(index.is_fresh())
+        self.assertEqual(index.find_records(['test.com']), {})
+
+    def test_load(self):
+        index = self._index().start()
+        self._wait_for(index.is_fresh)
+        records = index.find_records(['test.com', 'other.com'])
+        self.assertEqual(list(records), ['test.com'])
+        self.assertEqual(records['test.com']['action'], 'false_positive')
+
+    def test_poll_picks_up_changes(self):
+        index = self._index().start()
+        self._wait_for(index.is_fresh)
+        self.collection.insert_one({'entity': 'other.com', 'action': 'resolved_no_action',
+                                    'modified': self.now + timedelta(minutes=1)})
+        self.collection.update_one({'entity': 'test.com'},
+                                   {'$set': {'action': 'resolved', 'modified': self.now + timedelta(minutes=2)}})
+        self._wait_for(lambda: len(index.find_records(['test.com', 'other.com'])) == 2)
+        self._wait_for(lambda: index.find_records(['test.com'])['test.com']['action'] == 'resolved')
+
+    def test_poll_picks_up_deletes(self):
+        index = self._index().start()
+        self._wait_for(index.is_fresh)
+        self.collection.delete_many({})
+        self._wait_for(lambda: not index.find_records(['test.com']))
+
+    def test_reload_picks_up_unstamped_edits(self):
+        index = self._index(reload_interval=0.05).start()
+        self._wait_for(index.is_fresh)
+        self.collection.update_one({'entity': 'test.com'}, {'$set': {'action': 'resolved'}})
+        self._wait_for(lambda: index.find_records(['test.com'])['test.com']['action'] == 'resolved')
+
+    def test_missing_modified_field_fails(self):
+        index = self._index().start()
+        self._wait_for(index.is_fresh)
+        self.collection.insert_one({'entity': 'other.com', 'action': 'false_positive'})
+        self._wait_for(lambda: 'has no modified field' in (index.stats()['last_error'] or ''))
+        self.assertNotIn('other.com', index.find_records(['other.com']))
+        self._wait_for(lambda: not index.is_fresh())
+
+    def test_apply_change_events(self):
+        index = self._index(CHANGE_STREAM_MODE)
+        record = {'_id': 1, 'entity': 'test.com', 'action': 'false_positive'}
+        index._apply({'operationType': 'insert', 'fullDocument': record})
+        self.assertEqual(index.find_records(['test.com']), {'test.com': record})
+        renamed = dict(record, entity='other.com')
+        index._apply({'operationType': 'update', 'fullDocument': renamed})
+        self.assertEqual(index.find_records(['test.com', 'other.com']), {'other.com': renamed})
+        index._apply({'operationType': 'delete', 'documentKey': {'_id': 1}})
+        self.assertEqual(index.find_records(['other.com']), {})
+        with self.assertRaises(RuntimeError):
+            index._apply({'operationType': 'invalidate'})
+
+    def test_change_stream_falls_back_to_polling(self):
+        collection = MagicMock(wraps=self.collection)
+        collection.watch.side_effect = OperationFailure('The $changeStream stage is only supported on replica sets')
+        index = self._index(CHANGE_STREAM_MODE, collection).start()
+        self._wait_for(index.is_fresh)
+        self.assertEqual(index.mode, POLL_MODE)
+        self.assertIn('test.com', index.find_records(['test.com']))
+
+    def test_refresh_failure_goes_stale(self):
+        collection = MagicMock()
+        collection.find.side_effect = Exception('connection refused')
+        metrics = MagicMock()
+        index = self._index(collection=collection, metrics=metrics).start()
+        self._wait_for(lambda: index.stats()['last_error'] == 'connection refused')
+        self.assertFalse(index.is_fresh())
+        metrics.gauge.assert_any_call('blacklist_index_staleness')
+
+
+class TestBlacklistHelperIndex(TestCase):
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db.blacklist
+        self.index = MagicMock()
+        self.metrics = MagicMock()
+        self.helper = BlacklistHelper(self.collection, set(), self.index, self.metrics)
+
+    def test_fresh_index_answers(self):
+        self.index.is_fresh.return_value = True
+        self.index.find_records.return_value = {'test.com': {'entity': 'test.com', 'action': 'false_positive'}}
+        with patch.object(self.collection, 'find') as mock_find:
+            self.assertEqual(self.helper.get_action('test.com', 'www.test.com', None, None), 'false_positive')
+        mock_find.assert_not_called()
+        self.metrics.counter.assert_called_with('blacklist_index_hit', reset_on_collect=True)
+
+    def test_stale_index_falls_back(self):
+        self.index.is_fresh.return_value = False
+        self.collection.insert_one({'entity': 'test.com', 'action': 'resolved_no_action'})
+        self.assertEqual(self.helper.get_action('test.com', 'www.test.com', None, None), 'resolved_no_action')
+        self.index.find_records.assert_not_called()
+        self.metrics.counter.assert_called_with('blacklist_index_fallback', reset_on_collect=True)
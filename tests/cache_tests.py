@@ -0,0 +1,42 @@
+import time
+from unittest.case import TestCase
+
+from dcumiddleware.utilities.cache import MEMORY_BACKEND, TTLCache, get_cache
+
+
+class TestTTLCache(TestCase):
+    def test_get_set(self):
+        cache = TTLCache(10, 60)
+        self.assertIsNone(cache.get('key'))
+        cache.set('key', {'value': 1})
+        self.assertEqual(cache.get('key'), {'value': 1})
+
+    def test_values_are_copies(self):
+        cache = TTLCache(10, 60)
+        value = {'nested': {'value': 1}}
+        cache.set('key', value)
+        value['nested']['value'] = 2
+        cache.get('key')['nested']['value'] = 3
+        self.assertEqual(cache.get('key'), {'nested': {'value': 1}})
+
+    def test_expiry(self):
+        cache = TTLCache(10, 60)
+        cache.set('key', 'value', 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('key'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_get_cache(self):
+        cache = get_cache('tests', MEMORY_BACKEND, 10, 60)
+        self.assertIs(cache, get_cache('tests', MEMORY_BACKEND, 10, 60))
+        self.assertIsNone(get_cache('disabled', MEMORY_BACKEND, 0, 60))
@@ -0,0 +1,139 @@
+import asyncio
+import time
+from unittest.case import TestCase
+
+from celery.exceptions import SoftTimeLimitExceeded
+from mock import MagicMock, patch
+
+from dcumiddleware.utilities import circuitbreaker
+from dcumiddleware.utilities.circuitbreaker import (CLOSED, HALF_OPEN, OPEN,
+                                                    CircuitBreaker,
+                                                    CircuitOpenError,
+                                                    get_breaker, server_error)
+from tests.test_settings import TestingConfig
+
+
+def fail():
+    raise ConnectionError('down')
+
+
+@patch.multiple(TestingConfig, CIRCUIT_WINDOW=4, CIRCUIT_MIN_CALLS=4, CIRCUIT_FAILURE_RATE=0.5,
+                CIRCUIT_SLOW_CALL_SECONDS=0.05, CIRCUIT_OPEN_SECONDS=0.05, CIRCUIT_HALF_OPEN_PROBES=1)
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.metrics = MagicMock()
+        self.config = TestingConfig()
+
+    def _open(self, breaker: CircuitBreaker) -> None:
+        for _ in range(4):
+            with self.assertRaises(ConnectionError):
+                breaker.call(fail)
+
+    def test_opens_on_failure_rate(self):
+        breaker = CircuitBreaker('cmap', self.config, self.metrics)
+        breaker.call(len, 'a')
+        breaker.call(len, 'a')
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail)
+        self.assertEqual(breaker.state, CLOSED)
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail)
+        self.assertEqual(breaker.state, OPEN)
+        fn = MagicMock()
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(fn)
+        fn.assert_not_called()
+        self.metrics.counter.assert_any_call('circuit_breaker_rejected', reset_on_collect=True, dependency='cmap')
+
+    def test_needs_min_calls(self):
+        breaker = CircuitBreaker('cmap', self.config)
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                breaker.call(fail)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_failed_results_and_slow_calls_count(self):
+        breaker = CircuitBreaker('shopper', self.config)
+        breaker.call(lambda: MagicMock(status_code=503), failed=server_error)
+        breaker.call(lambda: MagicMock(status_code=200), failed=server_error)
+        breaker.call(time.sleep, 0.06)
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.call(time.sleep, 0.06)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_half_open_probe_closes(self):
+        breaker = CircuitBreaker('cmapv2', self.config, self.metrics)
+        self._open(breaker)
+        time.sleep(0.06)
+        self.assertEqual(breaker.call(len, 'ab'), 2)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(self.metrics.gauge.return_value.val, 0)
+        transitions = [c[1]['state'] for c in self.metrics.counter.call_args_list
+                       if c[0][0] == 'circuit_breaker_transitions']
+        self.assertEqual(transitions, [OPEN, HALF_OPEN, CLOSED])
+
+    def test_half_open_probe_failure_reopens(self):
+        breaker = CircuitBreaker('irm', self.config)
+        self._open(breaker)
+        time.sleep(0.06)
+        with self.assertRaises(ConnectionError):
+            breaker.call(fail)
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(len, 'a')
+
+    def test_half_open_limits_probes(self):
+        breaker = CircuitBreaker('abuse-api', self.config)
+        self._open(breaker)
+        time.sleep(0.06)
+        breaker._before_call()
+        self.assertEqual(breaker.state, HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(len, 'a')
+
+    def test_half_open_probe_released_on_base_exception(self):
+        breaker = CircuitBreaker('cmap', self.config)
+        self._open(breaker)
+        time.sleep(0.06)
+        with self.assertRaises(SoftTimeLimitExceeded):
+            breaker.call(MagicMock(side_effect=SoftTimeLimitExceeded()))
+        self.assertEqual(breaker.state, OPEN)
+        time.sleep(0.06)
+        self.assertEqual(breaker.call(len, 'a'), 1)
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_call_async(self):
+        breaker = CircuitBreaker('cmap', self.config)
+
+        async def lookup(value):
+            return value
+
+        async def failing():
+            raise ConnectionError('down')
+
+        self.assertEqual(asyncio.run(breaker.call_async(lookup, 'a')), 'a')
+        for _ in range(3):
+            with self.assertRaises(ConnectionError):
+                asyncio.run(breaker.call_async(failing))
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError):
+            asyncio.run(breaker.call_async(lookup, 'a'))
+
+
+class TestGetBreaker(TestCase):
+    def setUp(self):
+        self.config = TestingConfig()
+        circuitbreaker._breakers.clear()
+        self.addCleanup(circuitbreaker._breakers.clear)
+
+    def test_shared_per_dependency(self):
+        breaker = get_breaker('cmap', self.config)
+        self.assertIs(get_breaker('cmap', self.config), breaker)
+        self.assertIsNot(get_breaker('shopper', self.config), breaker)
+
+    def test_metrics_attached_once(self):
+        metrics = MagicMock()
+        breaker = get_breaker('cmap', self.config)
+        self.assertIs(get_breaker('cmap', self.config, metrics).metrics, metrics)
+        self.assertIs(get_breaker('cmap', self.config, MagicMock()).metrics, metrics)
+        self.assertIs(breaker.metrics, metrics)
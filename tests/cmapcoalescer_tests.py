@@ -0,0 +1,66 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.case import TestCase
+
+from mock import MagicMock
+
+from dcumiddleware.utilities.asyncclient import AsyncEnrichmentExecutor
+from dcumiddleware.utilities.cmapcoalescer import (AsyncDomainQueryCoalescer,
+                                                   DomainQueryCoalescer,
+                                                   get_coalescer)
+from dcumiddleware.utilities.cmapservicehelper import (AsyncCmapServiceHelper,
+                                                       CmapServiceHelper)
+from tests.fakecmapserver import FakeCmapServer
+from tests.test_settings import TestingConfig
+
+
+class TestDomainQueryCoalescer(TestCase):
+    def setUp(self):
+        self.server = FakeCmapServer().__enter__()
+        self.config = TestingConfig()
+        self.config.CMAP_SERVICE = self.config.SSO_URL = self.server.url
+        self.metrics = MagicMock()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _graphql_requests(self) -> list:
+        return [request for request in self.server.requests if request[1] == '/graphql']
+
+    def _query_all(self, coalescer: DomainQueryCoalescer, domains: list) -> list:
+        with ThreadPoolExecutor(len(domains)) as pool:
+            lookups = [pool.submit(coalescer.domain_query, domain, '/') for domain in domains]
+            return [lookup.exception() or lookup.result()['data']['domainQuery']['domain'] for lookup in lookups]
+
+    def test_concurrent_callers_share_a_request(self):
+        coalescer = DomainQueryCoalescer(CmapServiceHelper(self.config), 0.2, 25, self.metrics)
+        domains = [f'example{i}.com' for i in range(5)]
+        self.assertEqual(self._query_all(coalescer, domains), domains)
+        self.assertEqual(len(self._graphql_requests()), 1)
+        self.metrics.counter.assert_any_call('cmap_batched_queries', reset_on_collect=True)
+
+    def test_full_batch_is_sent_early(self):
+        coalescer = DomainQueryCoalescer(CmapServiceHelper(self.config), 5, 3)
+        start = time.monotonic()
+        self._query_all(coalescer, ['a.example', 'b.example', 'c.example'])
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_failure_only_reaches_its_caller(self):
+        self.server.failing_domains.add('bad.example')
+        coalescer = DomainQueryCoalescer(CmapServiceHelper(self.config), 0.2, 25)
+        good, bad = self._query_all(coalescer, ['good.example', 'bad.example'])
+        self.assertEqual(good, 'good.example')
+        self.assertIsInstance(bad, Exception)
+
+    def test_async_coalescer(self):
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        coalescer = AsyncDomainQueryCoalescer(AsyncCmapServiceHelper(self.config), 0.1, 25)
+        domains = [f'example{i}.com' for i in range(5)]
+        lookups = [enrichment.submit(coalescer.domain_query, domain, '/') for domain in domains]
+        self.assertEqual([enrichment.result(lookup)['data']['domainQuery']['domain'] for lookup in lookups], domains)
+        self.assertEqual(len(self._graphql_requests()), 1)
+
+    def test_get_coalescer(self):
+        coalescer = get_coalescer(self.config)
+        self.assertIs(get_coalescer(self.config), coalescer)
+        self.assertIsInstance(get_coalescer(self.config, asynchronous=True), AsyncDomainQueryCoalescer)
@@ -1,9 +1,17 @@
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
 from unittest.case import TestCase
 
 from dateutil import parser
-from mock import patch
+from mock import MagicMock, call, patch
 
-from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
+from dcumiddleware.utilities.asyncclient import AsyncEnrichmentExecutor
+from dcumiddleware.utilities.cmapqueries import DOMAIN_QUERY, KELVINDB_QUERY
+from dcumiddleware.utilities.cmapservicehelper import (AsyncCmapServiceHelper,
+                                                       CmapServiceHelper)
+from tests.fakecmapserver import FakeCmapServer
 from tests.test_settings import TestingConfig
 
 
@@ -211,3 +219,201 @@ class TestCmapServiceHelper(TestCase):
         result = self.cmapservice.shopper_lookup('shopper')
         cmap_query.assert_called_with('{"shopper_id": "shopper"}', '/v1/shopper/lookup')
         self.assertDictEqual(result, cmap_query.return_value)
+
+
+class TestCmapServiceHelperCache(TestCase):
+    QUERY_RESULT = {
+        'data': {
+            'domainQuery': {
+                'apiReseller': {},
+                'host': {'privateLabelId': '525844', 'createdDate': '2020-01-01'},
+                'registrar': {},
+                'securitySubscription': {},
+                'shopperInfo': {}
+            }
+        }
+    }
+
+    def setUp(self):
+        config = TestingConfig()
+        config.CMAP_CACHE_SIZE = 2
+        self.metrics = MagicMock()
+        self.cmapservice = CmapServiceHelper(config, self.metrics)
+        self.cmapservice._cache.clear()
+
+    def tearDown(self):
+        self.cmapservice._cache.clear()
+
+    @patch.object(CmapServiceHelper, 'cmap_query')
+    def test_domain_query_cached(self, cmap_query):
+        cmap_query.side_effect = lambda *args: deepcopy(self.QUERY_RESULT)
+        first = self.cmapservice.domain_query('example.com', '/a')
+        first['data']['domainQuery']['host']['reseller'] = 'mutated'
+        second = self.cmapservice.domain_query('example.com', '/a')
+        self.assertEqual(cmap_query.call_count, 1)
+        self.assertEqual(second['data']['domainQuery']['host']['reseller'], '123REG')
+        self.metrics.counter.assert_any_call('cmap_cache_miss', reset_on_collect=True)
+        self.metrics.counter.assert_any_call('cmap_cache_hit', reset_on_collect=True)
+
+    @patch.object(CmapServiceHelper, 'cmap_query')
+    def test_domain_query_keyed_by_path(self, cmap_query):
+        cmap_query.side_effect = lambda *args: deepcopy(self.QUERY_RESULT)
+        self.cmapservice.domain_query('example.com', '/a')
+        self.cmapservice.domain_query('example.com', '/b')
+        self.assertEqual(cmap_query.call_count, 2)
+
+    @patch.object(CmapServiceHelper, 'cmap_query')
+    def test_domain_query_bypass_refreshes(self, cmap_query):
+        cmap_query.side_effect = lambda *args: deepcopy(self.QUERY_RESULT)
+        self.cmapservice.domain_query('example.com', '/a')
+        self.cmapservice.domain_query('example.com', '/a', False)
+        self.cmapservice.domain_query('example.com', '/a')
+        self.assertEqual(cmap_query.call_count, 2)
+        self.metrics.counter.assert_any_call('cmap_cache_bypass', reset_on_collect=True)
+
+    @patch.object(CmapServiceHelper, 'cmap_query')
+    def test_domain_query_errors_not_cached(self, cmap_query):
+        cmap_query.return_value = {'errors': ['bad']}
+        self.assertRaises(Exception, self.cmapservice.domain_query, 'example.com', '/a')
+        self.assertRaises(Exception, self.cmapservice.domain_query, 'example.com', '/a')
+        self.assertEqual(cmap_query.call_count, 2)
+
+
+class TestCmapServiceHelperGraphQL(TestCase):
+    def setUp(self):
+        self.server = FakeCmapServer().__enter__()
+        self.config = TestingConfig()
+        self.config.CMAP_SERVICE = self.config.SSO_URL = self.server.url
+        self.metrics = MagicMock()
+        DOMAIN_QUERY.persisted_supported = True
+
+    def tearDown(self):
+        self.server.__exit__()
+        DOMAIN_QUERY.persisted_supported = True
+
+    def _graphql_bodies(self) -> list:
+        return [json.loads(body) for _, path, _, body in self.server.requests if path == '/graphql']
+
+    def test_prebuilt_body(self):
+        body = json.loads(DOMAIN_QUERY.body({'domain': 'example.com', 'path': '/a'}))
+        self.assertEqual(body, {'query': DOMAIN_QUERY.document, 'variables': {'domain': 'example.com', 'path': '/a'}})
+        self.assertTrue(body['query'].startswith('query DomainQuery($domain: String!, $path: String!)'))
+        body = json.loads(KELVINDB_QUERY.persisted_body({'domain': 'example.com'}))
+        self.assertEqual(body, {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': KELVINDB_QUERY.sha256_hash}},
+                                'variables': {'domain': 'example.com'}})
+
+    def test_variables_are_escaped(self):
+        path = '/a"b\\c") { __typename } #'
+        result = CmapServiceHelper(self.config).domain_query('example.com', path)
+        self.assertEqual(result['data']['domainQuery']['domain'], 'example.com')
+        request = self._graphql_bodies()[-1]
+        self.assertEqual(request['variables'], {'domain': 'example.com', 'path': path})
+        self.assertEqual(request['query'], DOMAIN_QUERY.document)
+        self.assertEqual(self.server.requests[-1][2]['Content-Type'], 'application/json')
+
+    def test_persisted_queries(self):
+        self.config.CMAP_PERSISTED_QUERIES = True
+        cmapservice = CmapServiceHelper(self.config, self.metrics)
+        cmapservice.domain_query('example.com', '/a')
+        cmapservice.domain_query('example.net', '/a')
+        first, registering, repeat = self._graphql_bodies()
+        self.assertNotIn('query', first)
+        self.assertEqual(registering['extensions']['persistedQuery']['sha256Hash'], DOMAIN_QUERY.sha256_hash)
+        self.assertEqual(registering['query'], DOMAIN_QUERY.document)
+        self.assertNotIn('query', repeat)
+        self.assertEqual(repeat['variables']['domain'], 'example.net')
+        self.assertEqual(self.metrics.counter.call_args_list.count(call('cmap_persisted_query_miss', reset_on_collect=True)), 1)
+
+    def test_persisted_queries_not_supported(self):
+        self.server.persisted_queries = False
+        self.config.CMAP_PERSISTED_QUERIES = True
+        cmapservice = CmapServiceHelper(self.config)
+        result = cmapservice.domain_query('example.com', '/a')
+        self.assertEqual(result['data']['domainQuery']['domain'], 'example.com')
+        cmapservice.domain_query('example.net', '/a')
+        first, fallback, repeat = self._graphql_bodies()
+        self.assertNotIn('query', first)
+        self.assertNotIn('extensions', fallback)
+        self.assertNotIn('extensions', repeat)
+        self.assertFalse(DOMAIN_QUERY.persisted_supported)
+
+    def test_domain_query_many(self):
+        self.server.failing_domains.add('bad.example')
+        cmapservice = CmapServiceHelper(self.config)
+        good, bad, other = cmapservice.domain_query_many([('example.com', '/a'), ('bad.example', '/a'), ('example.net', '/b')])
+        self.assertEqual(good['data']['domainQuery']['domain'], 'example.com')
+        self.assertEqual(good['data']['domainQuery']['host']['createdDate'].year, 2020)
+        self.assertIsInstance(bad, Exception)
+        self.assertEqual(other['data']['domainQuery']['domain'], 'example.net')
+        request, = self._graphql_bodies()
+        self.assertEqual(request['variables'], {'domain0': 'example.com', 'path0': '/a', 'domain1': 'bad.example',
+                                                'path1': '/a', 'domain2': 'example.net', 'path2': '/b'})
+
+    def test_domain_query_many_batches(self):
+        self.config.CMAP_BATCH_MAX_SIZE = 2
+        self.config.CMAP_CACHE_SIZE = 10
+        cmapservice = CmapServiceHelper(self.config)
+        cmapservice._cache.clear()
+        self.addCleanup(cmapservice._cache.clear)
+        cmapservice.domain_query('cached.example', '/')
+        queries = [('a.example', '/'), ('cached.example', '/'), ('a.example', '/'), ('b.example', '/'), ('c.example', '/')]
+        results = cmapservice.domain_query_many(queries)
+        self.assertEqual([result['data']['domainQuery']['domain'] for result in results], [domain for domain, _ in queries])
+        self.assertIsNot(results[0], results[2])
+        self.assertEqual(len(self._graphql_bodies()), 3)
+
+    @patch.object(CmapServiceHelper, 'graphql_query', side_effect=ConnectionError('down'))
+    def test_domain_query_many_request_failure(self, graphql_query):
+        results = CmapServiceHelper(self.config).domain_query_many([('example.com', '/'), ('example.net', '/')])
+        self.assertEqual([type(result) for result in results], [ConnectionError, ConnectionError])
+
+    def test_domain_query_many_async(self):
+        self.config.CMAP_BATCH_MAX_SIZE = 2
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        cmapservice = AsyncCmapServiceHelper(self.config)
+        queries = [('a.example', '/'), ('b.example', '/'), ('c.example', '/')]
+        results = enrichment.result(enrichment.submit(cmapservice.domain_query_many, queries))
+        self.assertEqual([result['data']['domainQuery']['domain'] for result in results], [domain for domain, _ in queries])
+        self.assertEqual(len(self._graphql_bodies()), 2)
+
+
+class TestCmapServiceHelperConcurrency(TestCase):
+    THREADS = 16
+    QUERIES = 25
+
+    def setUp(self):
+        self.servers = [FakeCmapServer(name=name, check_tokens=True).__enter__() for name in ('a', 'b')]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.__exit__()
+
+    def _helper(self, server: FakeCmapServer) -> CmapServiceHelper:
+        config = TestingConfig()
+        config.CMAP_SERVICE = config.SSO_URL = server.url
+        return CmapServiceHelper(config)
+
+    def _run_task(self, thread: int) -> list:
+        domains = []
+        for i in range(self.QUERIES):
+            # Like a task, each query builds its own helper, for one of two services with their own tokens.
+            server = self.servers[(thread + i) % 2]
+            if thread == 0 and i == self.QUERIES // 2:
+                server.revoke()
+            result = self._helper(server).domain_query(f'{thread}-{i}.example', '/')
+            domains.append(result['data']['domainQuery']['domain'])
+        return domains
+
+    def test_each_request_uses_its_own_token(self):
+        # Switch threads as often as possible, so that requests interleave at every step.
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        with patch.object(TestingConfig, 'JWT_MIN_REFRESH_INTERVAL', 0):
+            with ThreadPoolExecutor(self.THREADS) as pool:
+                results = list(pool.map(self._run_task, range(self.THREADS)))
+        self.assertEqual(results, [[f'{thread}-{i}.example' for i in range(self.QUERIES)] for thread in range(self.THREADS)])
+        for server in self.servers:
+            tokens = {headers['Authorization'] for _, path, headers, _ in server.requests if path == '/graphql'}
+            self.assertTrue(all(token.startswith(f'sso-jwt {server.name}-') for token in tokens), tokens)
+            # Only tokens revoked mid-run were refused, never one issued by the other service.
+            self.assertTrue(set(server.rejected) <= server.revoked, server.rejected)
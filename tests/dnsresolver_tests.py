@@ -0,0 +1,156 @@
+import json
+import socket
+import subprocess
+import sys
+import time
+from unittest.case import TestCase
+
+import dns.asyncresolver
+import dns.resolver
+from mock import MagicMock, patch
+
+from dcumiddleware.utilities import dnsresolver
+from dcumiddleware.utilities.asyncclient import AsyncEnrichmentExecutor
+from dcumiddleware.utilities.dnsresolver import (AsyncDnsResolver, DnsResolver,
+                                                 get_resolver)
+from tests.fakednsserver import FakeDnsServer
+from tests.test_settings import TestingConfig
+
+ZONE = {
+    'example.com.': {'A': (['192.0.2.1'], 300), 'AAAA': (['2001:db8::1'], 300)},
+    'www.example.com.': {'A': (['192.0.2.3'], 1)},
+    'ipv6.example.com.': {'AAAA': (['2001:db8::2'], 300)},
+    'empty.example.com.': {}
+}
+
+# Resolves ZONE's names on a gevent pool in a fresh process, as a --pool gevent worker would, with asyncio's event
+# loop accessors disabled.
+GEVENT_SCRIPT = '''
+from gevent import monkey
+monkey.patch_all()
+
+import asyncio
+import json
+import sys
+import time
+
+from gevent.pool import Pool
+
+
+def no_event_loop(*args, **kwargs):
+    raise AssertionError('the sync resolver used asyncio')
+
+
+asyncio.get_event_loop = asyncio.new_event_loop = asyncio.get_running_loop = no_event_loop
+
+from dcumiddleware.utilities.dnsresolver import DnsResolver
+from tests.test_settings import TestingConfig
+
+config = TestingConfig()
+config.DNS_NAMESERVERS, config.DNS_PORT, config.DNS_CACHE_SIZE = ['127.0.0.1'], int(sys.argv[1]), 0
+resolver = DnsResolver(config)
+start = time.monotonic()
+addresses = Pool(3).map(resolver.resolve, ['example.com', 'www.example.com', 'ipv6.example.com'])
+print(json.dumps({'addresses': addresses, 'elapsed': time.monotonic() - start}))
+'''
+
+
+class TestDnsResolver(TestCase):
+    def setUp(self):
+        self.server = FakeDnsServer(ZONE).__enter__()
+        self.config = TestingConfig()
+        self.config.DNS_NAMESERVERS = ['127.0.0.1']
+        self.config.DNS_PORT = self.server.port
+        self.config.DNS_TIMEOUT = 0.5
+        self.config.DNS_CACHE_SIZE = 100
+        self.metrics = MagicMock()
+        self.resolver = DnsResolver(self.config, self.metrics)
+        self.resolver._cache.clear()
+
+    def tearDown(self):
+        self.server.__exit__()
+        self.resolver._cache.clear()
+
+    def test_prefers_ipv4(self):
+        self.assertEqual(self.resolver.resolve('example.com'), '192.0.2.1')
+
+    def test_ipv6_fallback(self):
+        self.assertEqual(self.resolver.resolve('ipv6.example.com'), '2001:db8::2')
+        self.assertIn(('ipv6.example.com.', 'AAAA'), self.server.queries)
+
+    def test_not_found(self):
+        for name in ('missing.example.com', 'empty.example.com', None):
+            with self.subTest(name=name):
+                with self.assertRaises(socket.gaierror):
+                    self.resolver.resolve(name)
+
+    def test_positive_cache(self):
+        self.resolver.resolve('example.com')
+        queries = len(self.server.queries)
+        self.assertEqual(self.resolver.resolve('example.com'), '192.0.2.1')
+        self.assertEqual(len(self.server.queries), queries)
+        self.metrics.counter.assert_called_with('dns_cache_hit', reset_on_collect=True)
+
+    def test_cache_respects_ttl(self):
+        self.resolver.resolve('www.example.com')
+        time.sleep(1.1)
+        self.resolver.resolve('www.example.com')
+        self.assertEqual(self.server.queries.count(('www.example.com.', 'A')), 2)
+
+    def test_negative_cache(self):
+        with self.assertRaises(socket.gaierror):
+            self.resolver.resolve('missing.example.com')
+        queries = len(self.server.queries)
+        with self.assertRaises(socket.gaierror):
+            self.resolver.resolve('missing.example.com')
+        self.assertEqual(len(self.server.queries), queries)
+
+    def test_timeout_not_cached(self):
+        self.server.latency = 1
+        with self.assertRaises(TimeoutError):
+            self.resolver.resolve('example.com')
+        self.server.latency = 0
+        self.assertEqual(self.resolver.resolve('example.com'), '192.0.2.1')
+
+    def test_lifetime_capped_at_deadline(self):
+        self.server.latency = 1
+        self.config.ENRICHMENT_DEADLINE = 0.1
+        start = time.monotonic()
+        with self.assertRaises(TimeoutError):
+            DnsResolver(self.config).resolve('example.com')
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_blocking_resolver_without_event_loop(self):
+        self.assertIs(type(self.resolver._resolver), dns.resolver.Resolver)
+        with patch('asyncio.get_event_loop', side_effect=AssertionError('no event loop')), \
+                patch('dcumiddleware.utilities.asyncclient.get_client', side_effect=AssertionError('no event loop')):
+            self.assertEqual(self.resolver.resolve('ipv6.example.com'), '2001:db8::2')
+        self.assertIs(type(AsyncDnsResolver(self.config)._resolver), dns.asyncresolver.Resolver)
+
+    def test_blocking_resolver_on_gevent_pool(self):
+        self.server.latency = 0.2
+        output = subprocess.run([sys.executable, '-c', GEVENT_SCRIPT, str(self.server.port)],
+                                check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual(result['addresses'], ['192.0.2.1', '192.0.2.3', '2001:db8::2'])
+        # The three lookups wait on the server together; ipv6.example.com needs a second round trip for AAAA.
+        self.assertLess(result['elapsed'], 0.6)
+
+    def test_resolver_shared_per_process(self):
+        dnsresolver._resolvers.clear()
+        self.addCleanup(dnsresolver._resolvers.clear)
+        resolver = get_resolver(self.config)
+        self.assertIs(get_resolver(self.config), resolver)
+        self.assertIsInstance(get_resolver(self.config, asynchronous=True), AsyncDnsResolver)
+        with patch('dcumiddleware.utilities.dnsresolver.os.getpid', return_value=-1):
+            self.assertIsNot(get_resolver(self.config), resolver)
+
+    def test_async_resolver_concurrent(self):
+        self.server.latency = 0.2
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        resolver = AsyncDnsResolver(self.config)
+        start = time.monotonic()
+        names = ('example.com', 'www.example.com', 'ipv6.example.com')
+        lookups = [enrichment.submit(resolver.resolve, name) for name in names]
+        self.assertEqual([enrichment.result(lookup) for lookup in lookups], ['192.0.2.1', '192.0.2.3', '2001:db8::2'])
+        self.assertLess(time.monotonic() - start, 0.45)
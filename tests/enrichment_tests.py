@@ -0,0 +1,73 @@
+import time
+from unittest.case import TestCase
+
+from mock import patch
+
+from dcumiddleware.utilities import enrichment as enrichment_module
+from dcumiddleware.utilities.enrichment import EnrichmentExecutor, get_pool
+from tests.test_settings import TestingConfig
+
+
+class TestEnrichmentExecutor(TestCase):
+    def test_lookups_run_concurrently(self):
+        enrichment = EnrichmentExecutor(5, TestingConfig())
+        start = time.monotonic()
+        lookups = [enrichment.submit(time.sleep, 0.2) for _ in range(4)]
+        for lookup in lookups:
+            enrichment.result(lookup)
+        self.assertLess(time.monotonic() - start, 0.6)
+
+    def test_lookup_timeout(self):
+        enrichment = EnrichmentExecutor(5, TestingConfig())
+        lookup = enrichment.submit(time.sleep, 0.5)
+        with self.assertRaises(TimeoutError):
+            enrichment.result(lookup, 0.05)
+
+    def test_deadline_caps_timeout(self):
+        enrichment = EnrichmentExecutor(0.05, TestingConfig())
+        lookup = enrichment.submit(time.sleep, 0.5)
+        with self.assertRaises(TimeoutError):
+            enrichment.result(lookup, 10)
+
+    @patch.object(TestingConfig, 'ENRICHMENT_MAX_WORKERS', 1)
+    def test_deadline_cancels_pending_lookups(self):
+        enrichment_module._pool = None
+        self.addCleanup(setattr, enrichment_module, '_pool', None)
+        enrichment = EnrichmentExecutor(0.05, TestingConfig())
+        running = enrichment.submit(time.sleep, 0.2)
+        pending = enrichment.submit(time.sleep, 0.2)
+        with self.assertRaises(TimeoutError):
+            enrichment.result(running)
+        self.assertTrue(pending.cancelled())
+
+    def test_lookup_timeout_leaves_others_running(self):
+        enrichment = EnrichmentExecutor(5, TestingConfig())
+        slow = enrichment.submit(time.sleep, 0.2)
+        other = enrichment.submit(time.sleep, 0.1)
+        with self.assertRaises(TimeoutError):
+            enrichment.result(slow, 0.05)
+        self.assertIsNone(enrichment.result(other))
+
+    def test_lookup_exception_is_raised(self):
+        enrichment = EnrichmentExecutor(5, TestingConfig())
+        lookup = enrichment.submit(int, 'not a number')
+        with self.assertRaises(ValueError):
+            enrichment.result(lookup)
+
+
+class TestGetPool(TestCase):
+    def setUp(self):
+        enrichment_module._pool = None
+        self.addCleanup(setattr, enrichment_module, '_pool', None)
+
+    @patch.multiple(TestingConfig, WORKER_POOL='prefork', WORKER_CONCURRENCY=4)
+    def test_prefork_pool_size(self):
+        self.assertEqual(get_pool(TestingConfig())._max_workers, TestingConfig.ENRICHMENT_MAX_WORKERS)
+
+    @patch.multiple(TestingConfig, WORKER_POOL='gevent', WORKER_CONCURRENCY=4)
+    def test_green_pool_size(self):
+        self.assertEqual(get_pool(TestingConfig())._max_workers, TestingConfig.ENRICHMENT_MAX_WORKERS * 4)
+
+    @patch.multiple(TestingConfig, WORKER_POOL='threads', WORKER_CONCURRENCY=4)
+    def test_thread_pool_size(self):
+        self.assertEqual(get_pool(TestingConfig())._max_workers, TestingConfig.ENRICHMENT_MAX_WORKERS * 4)
@@ -0,0 +1,205 @@
+import base64
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Union
+from urllib.parse import parse_qs, urlparse
+
+DOMAIN_ARGUMENT = re.compile(r'domain: "([^"]*)"')
+# An optionally aliased domainQuery field and the variable holding its domain
+DOMAIN_FIELD = re.compile(r'(?:(\w+): )?domainQuery\(domain: \$(\w+)')
+
+
+def domain_query_response(domain: str, blacklist: bool = False) -> dict:
+    return {
+        'data': {
+            'domainQuery': {
+                'domain': domain,
+                'blacklist': blacklist,
+                'apiReseller': {'child': None, 'parent': None},
+                'securitySubscription': {'sucuriProduct': None},
+                'host': {
+                    'brand': 'GODADDY',
+                    'guid': f'guid-{domain}',
+                    'product': 'cPanel',
+                    'shopperId': f'shopper-{domain}',
+                    'customerId': f'customer-{domain}',
+                    'createdDate': '2020-01-01',
+                    'privateLabelId': '1'
+                },
+                'registrar': {'brand': 'GODADDY', 'domainId': f'id-{domain}', 'domainCreateDate': '2019-01-01'},
+                'shopperInfo': {'shopperId': f'shopper-{domain}', 'customerId': f'customer-{domain}'}
+            }
+        }
+    }
+
+
+class FakeCmapServer:
+    """
+    A local stand-in for CMAP Service, CMAP V2, the Shopper API and SSO, used to exercise the helpers over
+    real HTTP. Responses are derived from the request, every request is recorded, and an optional latency, in
+    seconds or as a function returning seconds, is added before each response. GraphQL requests may be raw documents or JSON bodies with variables; JSON bodies
+    may use automatic persisted queries unless persisted_queries is False, and may alias several domainQuery fields.
+
+        with FakeCmapServer(latency=0.05) as server:
+            settings.CMAP_SERVICE = settings.SSO_URL = server.url
+    """
+
+    def __init__(self, latency: Union[float, Callable[[], float]] = 0, persisted_queries: bool = True,
+                 token_ttl: int = None, name: str = 'token', check_tokens: bool = False, fallback: tuple = None):
+        self.latency = latency
+        # The (status, payload) answering requests for unknown paths instead of a 404, e.g. to stand in for IRM
+        self.fallback = fallback
+        # Tokens are named <name>-<n>. With check_tokens, other requests need a token this server issued and has
+        # not revoked, and are answered 401 otherwise.
+        self.name = name
+        self.check_tokens = check_tokens
+        self.issued = set()
+        self.revoked = set()
+        self.rejected = []
+        # SSO issues opaque tokens, or JWTs expiring after token_ttl seconds when it is set
+        self.token_ttl = token_ttl
+        self.persisted_queries = persisted_queries
+        self.documents = {}
+        # Domains whose domainQuery fails with a field error, and domains it reports as blacklisted
+        self.failing_domains = set()
+        self.blacklisted_domains = set()
+        self.requests = []
+        self.tokens_issued = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _issue_token(self) -> str:
+        with self._lock:
+            self.tokens_issued += 1
+            token = f'{self.name}-{self.tokens_issued}'
+            if self.token_ttl:
+                claims = {'jti': token, 'exp': int(time.time()) + self.token_ttl}
+                payload = base64.urlsafe_b64encode(json.dumps(claims).encode('utf-8')).rstrip(b'=').decode('utf-8')
+                token = f'eyJhbGciOiJub25lIn0.{payload}.'
+            self.issued.add(token)
+            return token
+
+    def revoke(self) -> None:
+        """
+        Revokes every token issued so far.
+        """
+        with self._lock:
+            self.revoked |= self.issued
+
+    def _authorized(self, headers) -> bool:
+        token = headers.get('Authorization', '').replace('sso-jwt ', '', 1)
+        with self._lock:
+            if token in self.issued and token not in self.revoked:
+                return True
+            self.rejected.append(token)
+            return False
+
+    def _route(self, method: str, path: str, query: dict, body: bytes):
+        if path.endswith('/api/token'):
+            return 200, {'type': 'signed-jwt', 'code': 1, 'message': 'Success', 'data': self._issue_token()}
+        if path == '/graphql':
+            return self._graphql(body)
+        if path in ('/v1/hosted/lookup', '/v1/shopper/lookup'):
+            return 200, json.loads(body or b'{}')
+        if path.startswith('/v1/nes/'):
+            _, _, _, customer_id, entitlement_id = path.split('/')
+            return 200, [{'customerId': customer_id, 'entitlementId': entitlement_id}]
+        if path == '/v1/cmap/lookupByHostAuthority':
+            return 200, {'brand': 'GODADDY', 'host': query.get('host', [''])[0], 'products': {}, 'customers': {}}
+        if path.startswith('/v1/customers/') and path.endswith('/shopper'):
+            return 200, {'shopperId': f'shopper-{path.split("/")[3]}'}
+        if path.startswith('/v1/shoppers/'):
+            return 200, {'customerId': f'customer-{path.split("/")[3]}'}
+        return self.fallback or (404, {'message': 'Not Found'})
+
+    def _graphql(self, body: bytes):
+        try:
+            request = json.loads(body)
+        except ValueError:
+            match = DOMAIN_ARGUMENT.search(body.decode('utf-8'))
+            domain = match.group(1) if match else ''
+            return 200, domain_query_response(domain, domain in self.blacklisted_domains)
+
+        persisted = request.get('extensions', {}).get('persistedQuery')
+        if persisted:
+            if not self.persisted_queries:
+                return 200, {'errors': [{'message': 'PersistedQueryNotSupported'}]}
+            sha256_hash = persisted['sha256Hash']
+            if 'query' in request:
+                if hashlib.sha256(request['query'].encode('utf-8')).hexdigest() != sha256_hash:
+                    return 400, {'errors': [{'message': 'provided sha does not match query'}]}
+                with self._lock:
+                    self.documents[sha256_hash] = request['query']
+            elif sha256_hash not in self.documents:
+                return 200, {'errors': [{'message': 'PersistedQueryNotFound'}]}
+            document = self.documents[sha256_hash]
+        elif 'query' in request:
+            document = request['query']
+        else:
+            return 400, {'errors': [{'message': 'Must provide query string.'}]}
+
+        variables = request.get('variables', {})
+        data, errors = {}, []
+        for alias, variable in DOMAIN_FIELD.findall(document):
+            alias, domain = alias or 'domainQuery', variables.get(variable, '')
+            if domain in self.failing_domains:
+                data[alias] = None
+                errors.append({'message': f'Lookup failed for {domain}', 'path': [alias]})
+            else:
+                data[alias] = domain_query_response(domain, domain in self.blacklisted_domains)['data']['domainQuery']
+        return 200, {'data': data, 'errors': errors} if errors else {'data': data}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                parsed = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with server._lock:
+                    server.requests.append((self.command, parsed.path, dict(self.headers), body))
+                latency = server.latency() if callable(server.latency) else server.latency
+                if latency:
+                    time.sleep(latency)
+                if server.check_tokens and not parsed.path.endswith('/api/token') and not server._authorized(self.headers):
+                    status, payload = 401, {'message': 'Unauthorized'}
+                else:
+                    status, payload = server._route(self.command, parsed.path, parse_qs(parsed.query), body)
+                # A 204 has no body
+                encoded = b'' if status == 204 else json.dumps(payload).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(encoded)))
+                    self.end_headers()
+                    self.wfile.write(encoded)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client gave up on the request, e.g. a cancelled lookup.
+                    self.close_connection = True
+
+            do_GET = do_POST = do_PATCH = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,74 @@
+import socket
+import threading
+import time
+from typing import Callable, Union
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class FakeDnsServer:
+    """
+    A local UDP nameserver answering from a fixed zone, used to exercise the resolver without the network.
+    Names missing from the zone are NXDOMAIN. Every question is recorded as (name, type), and an optional
+    latency, in seconds or as a function returning seconds, is added before each answer.
+
+        with FakeDnsServer({'example.com.': {'A': (['192.0.2.1'], 300)}}) as server:
+            settings.DNS_NAMESERVERS, settings.DNS_PORT = ['127.0.0.1'], server.port
+    """
+
+    def __init__(self, zone: dict, latency: Union[float, Callable[[], float]] = 0):
+        self.zone = zone
+        self.latency = latency
+        self.queries = []
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.settimeout(0.1)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._socket.getsockname()[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stopped.set()
+        self._thread.join()
+        self._socket.close()
+
+    def _answer(self, query: dns.message.Message) -> dns.message.Message:
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name, rdtype = question.name.to_text(), dns.rdatatype.to_text(question.rdtype)
+        self.queries.append((name, rdtype))
+        records = self.zone.get(name)
+        if records is None:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif rdtype in records:
+            addresses, ttl = records[rdtype]
+            response.answer.append(dns.rrset.from_text_list(name, ttl, 'IN', rdtype, addresses))
+        return response
+
+    def _respond(self, data: bytes, address) -> None:
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        try:
+            self._socket.sendto(self._answer(dns.message.from_wire(data)).to_wire(), address)
+        except OSError:
+            # The server was shut down while this answer was delayed.
+            pass
+
+    def _serve(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                data, address = self._socket.recvfrom(4096)
+            except socket.timeout:
+                continue
+            threading.Thread(target=self._respond, args=(data, address), daemon=True).start()
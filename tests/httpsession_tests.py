@@ -0,0 +1,56 @@
+from unittest.case import TestCase
+
+from mock import MagicMock, patch
+
+from dcumiddleware.utilities import httpsession
+from tests.test_settings import TestingConfig
+
+
+class TestHttpSession(TestCase):
+    def setUp(self):
+        httpsession.reset_sessions()
+        self.config = TestingConfig()
+
+    def test_session_reused_per_name(self):
+        session = httpsession.get_session('cmap', self.config)
+        self.assertIs(session, httpsession.get_session('cmap', self.config))
+        self.assertIsNot(session, httpsession.get_session('shopper', self.config))
+
+    def test_session_pool_configuration(self):
+        adapter = httpsession.get_session('cmap', self.config).get_adapter('https://cmap.example.com')
+        self.assertEqual(adapter._pool_maxsize, self.config.HTTP_POOL_MAXSIZE)
+        self.assertEqual(adapter.max_retries.total, self.config.HTTP_MAX_RETRIES)
+        self.assertEqual(adapter.max_retries.status_forcelist, httpsession.RETRY_STATUSES)
+
+    def test_writes_not_retried_by_default(self):
+        retries = httpsession.get_session('abuse-api', self.config).get_adapter('https://api.example.com').max_retries
+        self.assertEqual(retries.allowed_methods, httpsession.IDEMPOTENT_METHODS)
+        self.assertFalse(retries.is_retry('POST', 503))
+        self.assertFalse(retries.is_retry('PATCH', 503))
+        self.assertTrue(retries.is_retry('GET', 503))
+
+    def test_read_only_posts_retried_when_opted_in(self):
+        session = httpsession.get_session('cmap', self.config, httpsession.READ_ONLY_POST_METHODS)
+        retries = session.get_adapter('https://cmap.example.com').max_retries
+        self.assertTrue(retries.is_retry('POST', 503))
+        self.assertFalse(retries.is_retry('PATCH', 503))
+
+    def test_default_timeout(self):
+        adapter = httpsession.get_session('cmap', self.config).get_adapter('https://cmap.example.com')
+        request = MagicMock()
+        with patch('requests.adapters.HTTPAdapter.send') as send:
+            adapter.send(request)
+            self.assertEqual(send.call_args[1]['timeout'],
+                             (self.config.HTTP_CONNECT_TIMEOUT, self.config.HTTP_READ_TIMEOUT))
+            adapter.send(request, timeout=1)
+            self.assertEqual(send.call_args[1]['timeout'], 1)
+
+    def test_read_timeout_capped_at_deadline(self):
+        self.config.ENRICHMENT_DEADLINE = 10
+        adapter = httpsession.get_session('cmap', self.config).get_adapter('https://cmap.example.com')
+        self.assertEqual(adapter.timeout, (self.config.HTTP_CONNECT_TIMEOUT, 10))
+
+    def test_session_rebuilt_in_forked_child(self):
+        session = httpsession.get_session('cmap', self.config)
+        with patch('dcumiddleware.utilities.httpsession.os.getpid', return_value=-1):
+            self.assertIsNot(session, httpsession.get_session('cmap', self.config))
@@ -0,0 +1,52 @@
+from unittest.case import TestCase
+
+from mock import MagicMock
+
+from dcumiddleware.utilities.incidentcontext import IncidentContext
+
+
+class TestIncidentContext(TestCase):
+    TICKET_ID = 'DCU000001053'
+
+    def setUp(self):
+        self.db = MagicMock()
+        self.db.get_incident.return_value = {'ticketId': self.TICKET_ID, 'phishstory_status': 'OPEN'}
+        self.metrics = MagicMock()
+        self.incident = IncidentContext(self.db, self.TICKET_ID, metrics=self.metrics)
+
+    def test_get_reads_once(self):
+        self.assertEqual(self.incident.get(), self.incident.get())
+        self.db.get_incident.assert_called_once_with(self.TICKET_ID)
+        self.assertEqual(self.incident.round_trips, 1)
+        self.metrics.counter.assert_called_with('phishstory_round_trips', reset_on_collect=True)
+
+    def test_held_document_is_not_read(self):
+        incident = IncidentContext(self.db, self.TICKET_ID, {'phishstory_status': 'CLOSED'})
+        self.assertTrue(incident.is_closed())
+        self.db.get_incident.assert_not_called()
+
+    def test_refresh(self):
+        self.assertFalse(self.incident.is_closed())
+        self.db.get_incident.return_value = {'ticketId': self.TICKET_ID, 'phishstory_status': 'CLOSED'}
+        self.assertTrue(self.incident.is_closed(refresh=True))
+        self.assertEqual(self.incident.get()['phishstory_status'], 'CLOSED')
+        self.assertEqual(self.incident.round_trips, 2)
+
+    def test_missing_ticket(self):
+        self.db.get_incident.return_value = None
+        self.assertIsNone(self.incident.is_closed())
+        self.assertIsNone(IncidentContext(self.db, None).get())
+        self.db.get_incident.assert_called_once_with(self.TICKET_ID)
+
+    def test_update_keeps_returned_document(self):
+        self.db.update_incident.return_value = {'ticketId': self.TICKET_ID, 'phishstory_status': 'CLOSED'}
+        self.assertTrue(self.incident.update({'phishstory_status': 'CLOSED'}))
+        self.assertTrue(self.incident.is_closed())
+        self.db.get_incident.assert_not_called()
+
+    def test_add_reads_back(self):
+        self.incident.add({'ticketId': self.TICKET_ID}, 'PROCESSING')
+        self.db.add_new_incident.assert_called_once_with(self.TICKET_ID, {'ticketId': self.TICKET_ID}, status='PROCESSING')
+        self.incident.get()
+        self.db.get_incident.assert_called_once_with(self.TICKET_ID)
+        self.assertEqual(self.incident.round_trips, 2)
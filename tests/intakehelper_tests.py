@@ -0,0 +1,55 @@
+from unittest.case import TestCase
+
+import mongomock
+from mock import MagicMock, patch
+from pymongo.errors import BulkWriteError
+
+from dcumiddleware.utilities.intakehelper import IntakeHelper
+
+
+class TestIntakeHelper(TestCase):
+    def setUp(self):
+        self.incidents = mongomock.MongoClient().db.incidents
+        self.incidents.insert_one({'_id': 'DCU000000001', 'ticketId': 'DCU000000001', 'phishstory_status': 'OPEN'})
+        self.metrics = MagicMock()
+        self.intake = IntakeHelper(self.incidents, self.metrics)
+
+    def test_add_new_incidents(self):
+        tickets = [
+            {'ticketId': 'DCU000000001'},
+            {'ticketId': 'DCU000000002', 'plid': 1.0},
+            {'ticketId': 'DCU000000003', 'duplicate': True},
+            {'ticketId': 'DCU000000002'}
+        ]
+        with patch.object(self.incidents, 'find', wraps=self.incidents.find) as mock_find, \
+                patch.object(self.incidents, 'insert_many', wraps=self.incidents.insert_many) as mock_insert:
+            added = self.intake.add_new_incidents(tickets)
+        self.assertEqual([data['ticketId'] for data in added], ['DCU000000002', 'DCU000000003'])
+        mock_find.assert_called_once()
+        mock_insert.assert_called_once()
+        self.assertFalse(mock_insert.call_args[1]['ordered'])
+
+        incident = self.incidents.find_one({'_id': 'DCU000000002'})
+        self.assertEqual(incident['phishstory_status'], 'PROCESSING')
+        self.assertEqual(incident['plid'], '1')
+        self.assertIn('created', incident)
+        self.assertEqual(self.incidents.find_one({'_id': 'DCU000000003'})['phishstory_status'], 'DUPLICATE')
+        self.assertEqual(self.incidents.find_one({'_id': 'DCU000000001'})['phishstory_status'], 'OPEN')
+
+    def test_nothing_new(self):
+        with patch.object(self.incidents, 'insert_many') as mock_insert:
+            self.assertEqual(self.intake.add_new_incidents([{'ticketId': 'DCU000000001'}]), [])
+        mock_insert.assert_not_called()
+        self.metrics.counter.assert_called_with('intake_existing', reset_on_collect=True)
+
+    def test_concurrent_insert_skipped(self):
+        error = BulkWriteError({'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'duplicate key'}]})
+        with patch.object(self.incidents, 'insert_many', side_effect=error):
+            added = self.intake.add_new_incidents([{'ticketId': 'DCU000000002'}, {'ticketId': 'DCU000000003'}])
+        self.assertEqual([data['ticketId'] for data in added], ['DCU000000003'])
+
+    def test_other_write_errors_raise(self):
+        error = BulkWriteError({'writeErrors': [{'index': 0, 'code': 121, 'errmsg': 'validation failed'}]})
+        with patch.object(self.incidents, 'insert_many', side_effect=error):
+            with self.assertRaises(BulkWriteError):
+                self.intake.add_new_incidents([{'ticketId': 'DCU000000002'}])
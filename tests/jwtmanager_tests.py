@@ -0,0 +1,112 @@
+import base64
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.case import TestCase
+
+from mock import MagicMock, patch
+
+from dcumiddleware.utilities import jwtmanager
+from dcumiddleware.utilities.apihelper import APIHelper
+from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
+from dcumiddleware.utilities.httpsession import get_session
+from dcumiddleware.utilities.jwtmanager import (TokenManager,
+                                                get_cert_token_manager,
+                                                get_password_token_manager,
+                                                jwt_expiry)
+from tests.fakecmapserver import FakeCmapServer
+from tests.test_settings import TestingConfig
+
+
+class TestTokenManager(TestCase):
+    def setUp(self):
+        self.server = FakeCmapServer(latency=0.1, token_ttl=3600).__enter__()
+        self.config = TestingConfig()
+        self.config.CMAP_SERVICE = self.config.SSO_URL = self.server.url
+        self.metrics = MagicMock()
+        # Managers are process-wide and keyed by endpoint, and the fake server may reuse an earlier test's port.
+        jwtmanager._managers.clear()
+        self.addCleanup(jwtmanager._managers.clear)
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _manager(self) -> TokenManager:
+        return get_cert_token_manager(f'{self.server.url}/v1/secure/api/token', ('', ''), self.config, self.metrics)
+
+    def test_jwt_expiry(self):
+        self.server.latency = 0
+        token = self._manager().get()
+        self.assertAlmostEqual(jwt_expiry(token), time.time() + 3600, delta=5)
+        self.assertIsNone(jwt_expiry('token-1'))
+        self.assertIsNone(jwt_expiry(None))
+
+    def test_shared_between_helpers(self):
+        first, second = CmapServiceHelper(self.config), CmapServiceHelper(self.config)
+        self.assertEqual(first.get_jwt(), second.get_jwt())
+        self.assertEqual(self.server.tokens_issued, 1)
+
+    def test_rejected_token_burst(self):
+        manager = self._manager()
+        manager.get()
+        with patch.object(TestingConfig, 'JWT_MIN_REFRESH_INTERVAL', 0):
+            with ThreadPoolExecutor(10) as pool:
+                tokens = list(pool.map(lambda _: manager.get(True), range(10)))
+        self.assertEqual(self.server.tokens_issued, 2)
+        self.assertEqual(len(set(tokens)), 1)
+        self.metrics.counter.assert_any_call('jwt_coalesced_calls', reset_on_collect=True)
+
+    def test_recent_token_not_replaced(self):
+        manager = self._manager()
+        token = manager.get()
+        self.assertEqual(manager.get(True), token)
+        self.assertEqual(self.server.tokens_issued, 1)
+
+    def test_proactive_refresh(self):
+        self.server.token_ttl = 2
+        self.server.latency = 0
+        with patch.object(TestingConfig, 'JWT_REFRESH_MARGIN', 1):
+            manager = self._manager()
+            first = manager.get()
+            time.sleep(1.6)
+            self.assertGreaterEqual(self.server.tokens_issued, 2)
+            self.assertNotEqual(manager.get(), first)
+        self.metrics.counter.assert_any_call('jwt_proactive_refresh', reset_on_collect=True)
+
+    def test_token_without_expiry_stops_refresher(self):
+        claims = base64.urlsafe_b64encode(json.dumps({'exp': time.time() + 2}).encode()).decode()
+        fetch = MagicMock(side_effect=[f'a.{claims}.', 'token-2'])
+        with patch.multiple(TestingConfig, JWT_REFRESH_MARGIN=1, JWT_MIN_REFRESH_INTERVAL=0):
+            manager = TokenManager(fetch, self.config, self.metrics)
+            manager.get()
+            self.assertEqual(manager.get(True), 'token-2')
+            time.sleep(1.5)
+        self.assertEqual(manager.get(), 'token-2')
+        self.assertEqual(fetch.call_count, 2)
+        self.assertTrue(manager._refresher.is_alive())
+
+    def test_failed_refresh_keeps_valid_token(self):
+        fetch = MagicMock(side_effect=['a.' + 'eyJleHAiOiA0MTAyNDQ0ODAwfQ' + '.', ConnectionError('down')])
+        manager = TokenManager(fetch, self.config, self.metrics)
+        token = manager.get()
+        with patch.object(TestingConfig, 'JWT_MIN_REFRESH_INTERVAL', 0):
+            self.assertEqual(manager.get(True), token)
+        self.metrics.counter.assert_any_call('jwt_refresh_failed', reset_on_collect=True)
+
+    def test_password_manager(self):
+        self.server.latency = 0
+        self.config.ABUSE_API_URL = f'{self.server.url}/tickets'
+        self.assertTrue(APIHelper(self.config).get_jwt().startswith('eyJ'))
+
+    def test_session_per_credential(self):
+        endpoint = f'{self.server.url}/v1/secure/api/token'
+        with patch('dcumiddleware.utilities.jwtmanager.get_session', wraps=get_session) as mock_session:
+            for manager in (get_cert_token_manager(endpoint, ('', ''), self.config),
+                            get_cert_token_manager(endpoint, ('', 'other'), self.config),
+                            get_password_token_manager(endpoint, 'user', 'password', self.config)):
+                manager.get()
+        # A refresher may fetch again in the background, so compare the distinct sessions in first-use order.
+        names = dict.fromkeys(c[0][0] for c in mock_session.call_args_list)
+        sessions = [get_session(name, self.config) for name in names]
+        self.assertEqual(len(set(map(id, sessions))), 3)
+        self.assertEqual([session.cert for session in sessions], [('', ''), ('', 'other'), None])
@@ -0,0 +1,59 @@
+import asyncio
+from unittest.case import TestCase
+
+from mock import MagicMock
+
+from dcumiddleware.metrics import FAILURE, SUCCESS, Metrics, timed, timed_call
+
+
+class TestMetrics(TestCase):
+    def setUp(self):
+        registry = MagicMock()
+        registry.ignore_patterns = []
+        self.metrics = Metrics(registry)
+
+    def _samples(self) -> dict:
+        return {dict(sample['tags'])['stage'] + '/' + dict(sample['tags'])['outcome']: sample['samples']
+                for sample in self.metrics.collect()}
+
+    def test_record_stage(self):
+        self.metrics.record_stage('cmap', SUCCESS, 0.02)
+        self.metrics.record_stage('cmap', SUCCESS, 0.3)
+        self.metrics.record_stage('cmap', FAILURE, 1)
+        samples = self._samples()
+        self.assertEqual(samples['cmap/success']['stage.duration.sum.us']['value'], 320000)
+        self.assertEqual(samples['cmap/success']['stage.duration.count']['value'], 2)
+        self.assertEqual(samples['cmap/failure']['stage.duration.count']['value'], 1)
+        self.assertEqual(sum(samples['cmap/success']['stage.duration.histogram']['counts']), 2)
+
+    def test_stage_metrics_are_reused(self):
+        self.metrics.record_stage('dns', SUCCESS, 0.01)
+        self.metrics.record_stage('dns', SUCCESS, 0.01)
+        self.assertEqual(len(self.metrics._timers), 1)
+        self.assertEqual(len(self.metrics._histograms), 1)
+
+    def test_timed_outcome(self):
+        metrics = MagicMock()
+        with timed(metrics, 'mongo_read'):
+            pass
+        with self.assertRaises(ValueError):
+            with timed(metrics, 'mongo_write'):
+                raise ValueError()
+        self.assertEqual([(c[0][0], c[0][1]) for c in metrics.record_stage.call_args_list],
+                         [('mongo_read', SUCCESS), ('mongo_write', FAILURE)])
+
+    def test_timed_without_metrics(self):
+        with timed(None, 'irm'):
+            pass
+
+    def test_timed_call_keeps_coroutines(self):
+        metrics = MagicMock()
+
+        async def lookup(value):
+            return value
+
+        timed_lookup = timed_call(metrics, 'shopper', lookup)
+        self.assertTrue(asyncio.iscoroutinefunction(timed_lookup))
+        self.assertEqual(asyncio.run(timed_lookup('id')), 'id')
+        self.assertEqual(timed_call(metrics, 'dns', len)('abc'), 3)
+        self.assertEqual([c[0][0] for c in metrics.record_stage.call_args_list], ['shopper', 'dns'])
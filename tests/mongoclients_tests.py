@@ -0,0 +1,50 @@
+from unittest.case import TestCase
+
+from mock import MagicMock, patch
+
+from dcumiddleware.utilities import mongoclients
+from dcumiddleware.utilities.mongoclients import (get_collection,
+                                                  get_mongo_client, get_shared)
+from tests.test_settings import TestingConfig
+
+URL = 'mongodb://localhost:1/?connectTimeoutMS=10'
+
+
+class TestMongoClients(TestCase):
+    def setUp(self):
+        mongoclients.reset_clients()
+
+    def tearDown(self):
+        for client in mongoclients._clients.values():
+            client.close()
+        mongoclients.reset_clients()
+
+    def test_client_is_shared_per_url(self):
+        client = get_mongo_client(URL, TestingConfig())
+        self.assertIs(get_mongo_client(URL, TestingConfig()), client)
+        self.assertIsNot(get_mongo_client(URL + '&appname=other', TestingConfig()), client)
+
+    @patch.multiple(TestingConfig, MONGO_MAX_POOL_SIZE=7, MONGO_MIN_POOL_SIZE=2)
+    def test_pool_size(self):
+        options = get_mongo_client(URL, TestingConfig()).options.pool_options
+        self.assertEqual((options.max_pool_size, options.min_pool_size), (7, 2))
+
+    def test_collection_uses_shared_client(self):
+        collection = get_collection(URL, 'phishstory', 'incidents', TestingConfig())
+        self.assertIs(collection.database.client, get_mongo_client(URL, TestingConfig()))
+        self.assertEqual(collection.full_name, 'phishstory.incidents')
+
+    def test_shared_wrapper_is_built_once(self):
+        factory = MagicMock()
+        self.assertIs(get_shared('phishstory', factory), get_shared('phishstory', factory))
+        factory.assert_called_once_with()
+
+    def test_new_process_builds_new_clients(self):
+        client = get_mongo_client(URL, TestingConfig())
+        factory = MagicMock(side_effect=object)
+        wrapper = get_shared('kelvin', factory)
+        # As seen from a forked child, whose pid differs from the one the clients were built in
+        mongoclients._clients_pid = -1
+        client.close()
+        self.assertIsNot(get_mongo_client(URL, TestingConfig()), client)
+        self.assertIsNot(get_shared('kelvin', factory), wrapper)
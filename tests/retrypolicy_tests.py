@@ -0,0 +1,164 @@
+import json
+from unittest.case import TestCase
+
+import mongomock
+import requests
+from celery import Celery
+from mock import MagicMock, patch
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+
+from dcumiddleware.utilities import retrypolicy
+from dcumiddleware.utilities.circuitbreaker import CircuitOpenError
+from dcumiddleware.utilities.retrypolicy import (BACKOFF, BUDGET, MAX_RETRIES,
+                                                 NON_RETRYABLE, PolicyTask,
+                                                 RetryBudget, RetryPolicy,
+                                                 is_retryable)
+from tests.test_settings import TestingConfig
+
+POLICIES = {'intake': {'backoff': 2, 'backoff_max': 30, 'max_retries': 3}}
+
+
+def reasons(metrics: MagicMock, name: str) -> list:
+    return [c[1].get('reason') for c in metrics.counter.call_args_list if c[0][0] == name]
+
+
+class TestIsRetryable(TestCase):
+    def test_dependency_errors(self):
+        for exc in (ConnectionError(), TimeoutError(), requests.exceptions.JSONDecodeError('bad', '', 0),
+                    json.JSONDecodeError('truncated', '{', 1), AutoReconnect(), CircuitOpenError(), Exception()):
+            self.assertTrue(is_retryable(exc), exc)
+
+    def test_ticket_and_code_errors(self):
+        for exc in (KeyError('x'), ValueError(), TypeError(), AttributeError(), DuplicateKeyError('dup')):
+            self.assertFalse(is_retryable(exc), exc)
+
+    def test_dont_retry_for(self):
+        self.assertTrue(is_retryable(KeyError('x'), (TypeError,)))
+        self.assertFalse(is_retryable(TypeError(), (TypeError,)))
+
+
+@patch.multiple(TestingConfig, RETRY_POLICIES=POLICIES, RETRY_BUDGET_RATIO=0.5,
+                RETRY_BUDGET_MIN_PER_SECOND=0, RETRY_BUDGET_WINDOW=10)
+class TestRetryPolicy(TestCase):
+    def setUp(self):
+        retrypolicy._budgets.clear()
+        self.addCleanup(retrypolicy._budgets.clear)
+        self.config = TestingConfig()
+        self.metrics = MagicMock()
+
+    def test_full_jitter_backoff(self):
+        policy = RetryPolicy('intake', self.config)
+        with patch.object(retrypolicy, 'get_exponential_backoff_interval', return_value=5) as mock_backoff:
+            self.assertEqual(policy.countdown(3), 5)
+        mock_backoff.assert_called_with(2, 3, 30, full_jitter=True)
+        self.assertTrue(all(0 <= policy.countdown(3) <= 16 for _ in range(100)))
+        self.assertTrue(all(0 <= policy.countdown(10) <= 30 for _ in range(100)))
+
+    def test_celery_countdown_used(self):
+        policy = RetryPolicy('intake', self.config, self.metrics)
+        for _ in range(4):
+            policy.record_attempt()
+        self.assertEqual(policy.next_countdown('run.process', ConnectionError(), 1, 3), 3)
+
+    def test_next_countdown(self):
+        policy = RetryPolicy('intake', self.config, self.metrics)
+        for _ in range(4):
+            policy.record_attempt()
+        self.assertLessEqual(policy.next_countdown('run.process', ConnectionError(), 1), 4)
+        self.assertIsNone(policy.next_countdown('run.process', KeyError('x'), 0))
+        self.assertIsNone(policy.next_countdown('run.process', ConnectionError(), 3))
+        self.assertEqual(reasons(self.metrics, 'task_retries'), [BACKOFF])
+        self.assertEqual(reasons(self.metrics, 'task_retries_abandoned'), [NON_RETRYABLE, MAX_RETRIES])
+
+    def test_budget_exhausted_waits_longest_backoff(self):
+        policy = RetryPolicy('intake', self.config, self.metrics)
+        for _ in range(2):
+            policy.record_attempt()
+        policy.next_countdown('run.process', ConnectionError(), 0)
+        self.assertEqual(policy.next_countdown('run.process', ConnectionError(), 0), 30)
+        self.assertEqual(reasons(self.metrics, 'task_retries'), [BACKOFF, BUDGET])
+        self.metrics.counter.assert_any_call('task_retry_delay_seconds', reset_on_collect=True, task='run.process')
+
+    def test_budget_window(self):
+        budget = RetryBudget(self.config)
+        with patch.object(retrypolicy.time, 'monotonic', return_value=100):
+            budget.record_attempt()
+            budget.record_attempt()
+            self.assertTrue(budget.withdraw())
+            self.assertFalse(budget.withdraw())
+        with patch.object(retrypolicy.time, 'monotonic', return_value=110):
+            self.assertFalse(budget.withdraw())
+            budget.record_attempt()
+            budget.record_attempt()
+            self.assertTrue(budget.withdraw())
+
+    def test_budgets_shared_per_task_class(self):
+        self.assertIs(retrypolicy.get_budget('intake', self.config), retrypolicy.get_budget('intake', self.config))
+        self.assertIsNot(retrypolicy.get_budget('intake', self.config), retrypolicy.get_budget('pipeline', self.config))
+
+
+@patch.multiple(TestingConfig, RETRY_POLICIES=POLICIES, RETRY_BUDGET_RATIO=0.5,
+                RETRY_BUDGET_MIN_PER_SECOND=1, RETRY_BUDGET_WINDOW=10)
+class TestPolicyTask(TestCase):
+    def setUp(self):
+        retrypolicy._budgets.clear()
+        self.addCleanup(retrypolicy._budgets.clear)
+        self.config = TestingConfig()
+        self.app = Celery(set_as_current=False)
+        self.app.conf.task_always_eager = True
+        self.metrics = MagicMock()
+
+    def _task(self, fn: MagicMock, dead_letters=None):
+        def work(*args):
+            return fn()
+        policy = RetryPolicy('intake', self.config, self.metrics, dead_letters)
+        # Named after fn, since an eager retry looks its task up by name.
+        return self.app.task(work, name=f'work-{id(fn)}', base=PolicyTask, backoff_policy=policy,
+                             max_retries=policy.max_retries,
+                             autoretry_for=(Exception,), retry_backoff=policy.backoff,
+                             retry_backoff_max=policy.backoff_max, retry_jitter=True, shared=False)
+
+    def test_retries_dependency_errors(self):
+        fn = MagicMock(side_effect=[ConnectionError(), ConnectionError(), 'done'])
+        result = self._task(fn).apply()
+        self.assertEqual(result.result, 'done')
+        self.assertEqual(fn.call_count, 3)
+        self.assertEqual(reasons(self.metrics, 'task_retries'), [BACKOFF, BACKOFF])
+
+    def test_gives_up_after_max_retries(self):
+        fn = MagicMock(side_effect=ConnectionError())
+        result = self._task(fn).apply()
+        self.assertIsInstance(result.result, ConnectionError)
+        self.assertEqual(fn.call_count, 4)
+        self.assertEqual(reasons(self.metrics, 'task_retries_abandoned'), [MAX_RETRIES])
+
+    def test_does_not_retry_ticket_errors(self):
+        fn = MagicMock(side_effect=KeyError('ticketId'))
+        result = self._task(fn).apply()
+        self.assertIsInstance(result.result, KeyError)
+        fn.assert_called_once()
+        self.assertEqual(reasons(self.metrics, 'task_retries_abandoned'), [NON_RETRYABLE])
+
+    def test_retries_json_decode_errors(self):
+        fn = MagicMock(side_effect=[json.JSONDecodeError('truncated', '{', 1), 'done'])
+        self.assertEqual(self._task(fn).apply().result, 'done')
+        self.assertEqual(reasons(self.metrics, 'task_retries'), [BACKOFF])
+
+    def test_dead_letters_abandoned_tasks(self):
+        dead_letters = mongomock.MongoClient().db.deadLetters
+        self._task(MagicMock(side_effect=ConnectionError('down')), lambda: dead_letters).apply(({'ticketId': 'DCU001'},))
+        self._task(MagicMock(side_effect=KeyError('ticketId')), lambda: dead_letters).apply(({},))
+        letters = list(dead_letters.find({}, {'_id': 0, 'failed': 0}))
+        self.assertEqual([letter['args'] for letter in letters], [[{'ticketId': 'DCU001'}], [{}]])
+        self.assertEqual([letter['error'] for letter in letters], ["ConnectionError('down')", "KeyError('ticketId')"])
+        self.metrics.counter.assert_any_call('task_dead_letters', reset_on_collect=True, task=letters[0]['task'])
+
+    def test_dead_letter_failure_keeps_task_error(self):
+        dead_letters = MagicMock(side_effect=ConnectionError('mongo down'))
+        result = self._task(MagicMock(side_effect=KeyError('ticketId')), dead_letters).apply()
+        self.assertIsInstance(result.result, KeyError)
+
+    def test_called_directly_raises(self):
+        with self.assertRaises(ConnectionError):
+            self._task(MagicMock(side_effect=ConnectionError()))()
+        self.metrics.counter.assert_not_called()
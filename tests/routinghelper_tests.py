@@ -1,12 +1,13 @@
 from unittest.case import TestCase
 
 from celery import Celery
-from mock import patch
+from mock import MagicMock, patch
 
 from dcumiddleware.celeryconfig import CeleryConfig
-from dcumiddleware.utilities.apihelper import APIHelper
-from dcumiddleware.utilities.routinghelper import RoutingHelper
 from dcumiddleware.settings import UnitTestAppConfig
+from dcumiddleware.utilities.apihelper import APIHelper
+from dcumiddleware.utilities.routinghelper import (CLAIM_CHECK_MODE,
+                                                   RoutingHelper)
 
 
 class MockMongo:
@@ -116,3 +117,30 @@ class TestRoutingHelper(TestCase):
         }}
         returned_data = self._routing_helper.route(ticket_data)
         self.assertEqual(returned_data, ticket_data)
+
+    def test_route_dsa_uses_shared_db(self):
+        capp, db = MagicMock(), MagicMock()
+        routing_helper = RoutingHelper(capp, APIHelper(UnitTestAppConfig()), db)
+        ticket_data = {self.KEY_TICKET_ID: '1238', 'abuseMeta': 'DSA', self.KEY_DATA: {}}
+        routing_helper.route(ticket_data)
+        capp.send_task.assert_called_once_with('routing.run.process_external_report', args=['1238'])
+        db.update_incident.assert_called_once_with('1238', {'phishstory_status': 'FORWARDED_TO_EXTERNAL_SERVICE'})
+
+    def test_route_to_brand_payload(self):
+        capp = MagicMock()
+        routing_helper = RoutingHelper(capp, APIHelper(UnitTestAppConfig()), MockMongo())
+        ticket_data = {self.KEY_TICKET_ID: '1236', 'last_modified': 'now', self.KEY_DATA: {}}
+        routing_helper._route_to_brand(self.GODADDY, ticket_data)
+        capp.send_task.assert_called_with('run.process_gd', (ticket_data,))
+
+    def test_route_to_brand_claim_check(self):
+        capp = MagicMock()
+        routing_helper = RoutingHelper(capp, APIHelper(UnitTestAppConfig()), MockMongo(), CLAIM_CHECK_MODE)
+        ticket_data = {self.KEY_TICKET_ID: '1237', 'last_modified': 'now', self.KEY_DATA: {}}
+        routing_helper._route_to_brand(self.EMEA, ticket_data)
+        capp.send_task.assert_called_with('run.process_emea', ({
+            self.KEY_TICKET_ID: '1237',
+            self.KEY_BRAND: self.EMEA,
+            'claimCheck': 1,
+            'last_modified': 'now'
+        },))
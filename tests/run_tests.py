@@ -1,14 +1,17 @@
-import socket
 from unittest.case import TestCase
 
+from celery.exceptions import Retry
 from dcdatabase.phishstorymongo import PhishstoryMongo
 from mock import patch
 from mock.mock import MagicMock
 from pymongo.collection import Collection
 
 from dcumiddleware import run
+from dcumiddleware.utilities import jwtmanager
 from dcumiddleware.utilities.apihelper import APIHelper
 from dcumiddleware.utilities.cmapv2helper import CmapV2Helper
+from dcumiddleware.utilities.dnsresolver import DnsResolver
+from tests.test_settings import TestingConfig
 
 HOSTED = 'HOSTED'
 KEY_BLACKLIST = 'blacklist'
@@ -48,7 +51,7 @@ class MockCmapServiceHelper:
     def __init__(self, _settings):
         self._path = None
 
-    def domain_query(self, _domain, _path):
+    def domain_query(self, _domain, _path, _use_cache=True):
         self._path = _path
         return {'status': 'good'}
 
@@ -133,6 +136,9 @@ class TestRun(TestCase):
     }
 
     def setUp(self):
+        # The SSO tokens are shared by the process, so each test starts without one.
+        jwtmanager._managers.clear()
+        self.addCleanup(jwtmanager._managers.clear)
         self.incident = {
             run.KEY_METADATA: {
                 run.KEY_PRODUCT: 'test',
@@ -169,7 +175,8 @@ class TestRun(TestCase):
 
         self.NOT_BLACKLISTED_TICKET = {run.DATA_KEY: {run.DOMAIN_Q_KEY: {KEY_BLACKLIST: False}}}
         self.BLACKLISTED_TICKET = {run.DATA_KEY: {run.DOMAIN_Q_KEY: {KEY_BLACKLIST: True}}}
-        self.cmapv2service = CmapV2Helper('mock_service_url', 'mock_sso_host', 'mock_client_cert_path', 'mock_client_key_path')
+        self.cmapv2service = CmapV2Helper('mock_service_url', 'mock_sso_host', 'mock_client_cert_path',
+                                          'mock_client_key_path', TestingConfig())
 
     # Test sync_attribute
     @patch.object(PhishstoryMongo, 'update_incident', return_value=None)
@@ -178,43 +185,85 @@ class TestRun(TestCase):
         mock_db.assert_called_with(KEY_TICKET_ID, {'field': 'value'})
 
     # Test successful load and enrichment
-    @patch('csetutils.services.jwt_base.post')
-    @patch('dcumiddleware.utilities.cmapv2helper.requests.get')
-    @patch.object(PhishstoryMongo, 'remove_field', return_value=None)
-    @patch.object(PhishstoryMongo, 'update_incident', return_value=None)
-    @patch.object(PhishstoryMongo, 'get_incident', return_value=AUTO_SUSPEND_DOMAIN)
+    @patch.object(Collection, 'find_one', return_value=OPEN_TICKET)
+    @patch('dcumiddleware.utilities.jwtmanager.get_session')
+    @patch('dcumiddleware.utilities.cmapv2helper.get_session')
+    @patch.object(PhishstoryMongo, 'get_incident', return_value=OPEN_TICKET)
+    @patch.object(PhishstoryMongo, 'remove_field')
+    @patch.object(PhishstoryMongo, 'update_incident', return_value=OPEN_TICKET)
     @patch('dcumiddleware.run.CmapServiceHelper', return_value=MockCmapServiceHelper({}))
-    @patch.object(socket, 'gethostbyname', return_value='1.1.1.1')
-    def test_load_and_enrich_data_success(self, mock_socket, mock_cmap, mock_db_update, mock_db_remove, mock_db_get, mock_get, mock_post):
-        mock_post.return_value = MagicMock(json=MagicMock(return_value={'data': 'mock_token'}))
-        mock_get.return_value = MagicMock(json=MagicMock(return_value=self.cmapv2_data), status_code=200)
-        run._load_and_enrich_data(AUTO_SUSPEND_DOMAIN)
-        result = run.is_closed(AUTO_SUSPEND_DOMAIN[KEY_TICKET_ID])
-        mock_socket.assert_called()
+    @patch.object(DnsResolver, 'resolve', return_value='1.1.1.1')
+    def test_load_and_enrich_data_success(self, mock_resolve, mock_cmap, mock_update, mock_remove, mock_db_get,
+                                          mock_session, mock_sso, mock_find_one):
+        mock_sso.return_value.post.return_value = MagicMock(text='{"data": "mock_token"}')
+        mock_session.return_value.get.return_value = MagicMock(json=MagicMock(return_value=self.cmapv2_data), status_code=200)
+        result = run._load_and_enrich_data(dict(AUTO_SUSPEND_DOMAIN))
+        mock_resolve.assert_called()
         self.assertEqual(mock_cmap.return_value._path, '/test%20me')
-        self.assertFalse(result)
-        mock_db_update.assert_called()
-        mock_db_remove.assert_called()
-        mock_db_get.assert_called()
-        mock_get.assert_called_with('https://cmapv2.cset.int.test-gdcorp.tools/v1/cmap/lookupByHostAuthority?host=test1.godaddysites.com', headers={'Authorization': 'sso-jwt mock_token', 'Content-Type': 'application/json'})
+        self.assertEqual(result, OPEN_TICKET)
+        self.assertEqual(mock_update.call_args[0][0], 'DCU001')
+        mock_remove.assert_called_with('DCU001', KEY_FAILED_ENRICHMENT)
+        mock_find_one.assert_called_once_with({'_id': 'DCU001'}, {KEY_PHISHSTORY_STATUS: 1})
+        mock_session.return_value.get.assert_called_with('https://cmapv2.cset.int.test-gdcorp.tools/v1/cmap/lookupByHostAuthority?host=test1.godaddysites.com', headers={'Authorization': 'sso-jwt mock_token', 'Content-Type': 'application/json'})
 
-    @patch('csetutils.services.jwt_base.post')
-    @patch('dcumiddleware.utilities.cmapv2helper.requests.get')
-    @patch.object(PhishstoryMongo, 'update_incident', return_value=None)
+    @patch.object(Collection, 'find_one', return_value=OPEN_TICKET)
+    @patch.object(PhishstoryMongo, 'get_incident', return_value=OPEN_TICKET)
+    @patch('dcumiddleware.utilities.jwtmanager.get_session')
+    @patch('dcumiddleware.utilities.cmapv2helper.get_session')
+    @patch.object(PhishstoryMongo, 'update_incident', return_value=OPEN_TICKET)
     @patch('dcumiddleware.run.CmapServiceHelper')
-    @patch.object(socket, 'gethostbyname', return_value='1.1.1.1')
-    def test_load_and_enrich_entitlement(self, mock_socket, mock_cmap, mock_db, mock_get, mock_post):
-        mock_post.return_value = MagicMock(json=MagicMock(return_value={'data': 'mock_token'}))
-        mock_get.return_value = MagicMock(json=MagicMock(return_value=self.cmapv2_data), status_code=200)
+    @patch.object(DnsResolver, 'resolve', return_value='1.1.1.1')
+    def test_load_and_enrich_entitlement(self, mock_resolve, mock_cmap, mock_db, mock_session, mock_sso, mock_db_get,
+                                         mock_find_one):
+        mock_sso.return_value.post.return_value = MagicMock(text='{"data": "mock_token"}')
+        mock_session.return_value.get.return_value = MagicMock(json=MagicMock(return_value=self.cmapv2_data), status_code=200)
         mock_cmap.return_value = MagicMock(
             product_lookup_entitlement=MagicMock(return_value={run.KEY_SHOPPER_ID: 'test_shopper'}),
             domain_query=MagicMock(return_value={})
         )
         run._load_and_enrich_data(self.enrichment_with_entitlement)
-        mock_socket.assert_called()
+        mock_resolve.assert_called()
         mock_cmap.return_value.product_lookup_entitlement.assert_called_with('test-customer', 'test-entitlement')
         mock_db.assert_called()
-        mock_get.assert_called_with('https://cmapv2.cset.int.test-gdcorp.tools/v1/cmap/lookupByHostAuthority?host=test1.godaddysites.com', headers={'Authorization': 'sso-jwt mock_token', 'Content-Type': 'application/json'})
+        mock_session.return_value.get.assert_called_with('https://cmapv2.cset.int.test-gdcorp.tools/v1/cmap/lookupByHostAuthority?host=test1.godaddysites.com', headers={'Authorization': 'sso-jwt mock_token', 'Content-Type': 'application/json'})
+
+    # Test closed tickets are not enriched
+    @patch.object(PhishstoryMongo, 'get_incident')
+    @patch.object(Collection, 'find_one', return_value=CLOSED_TICKET)
+    @patch('dcumiddleware.run.CmapServiceHelper')
+    @patch.object(DnsResolver, 'resolve')
+    def test_load_and_enrich_closed_ticket(self, mock_resolve, mock_cmap, mock_find_one, mock_db_get):
+        result = run._load_and_enrich_data(dict(AUTO_SUSPEND_DOMAIN))
+        # Only the status is read.
+        mock_find_one.assert_called_with({'_id': 'DCU001'}, {KEY_PHISHSTORY_STATUS: 1})
+        mock_db_get.assert_not_called()
+        mock_resolve.assert_not_called()
+        mock_cmap.assert_not_called()
+        self.assertEqual(result[KEY_PHISHSTORY_STATUS], 'CLOSED')
+
+    # Test tickets closed during enrichment are not saved
+    @patch.object(Collection, 'find_one', return_value=OPEN_TICKET)
+    @patch.object(PhishstoryMongo, 'get_incident', return_value=CLOSED_TICKET)
+    @patch.object(PhishstoryMongo, 'update_incident')
+    @patch('dcumiddleware.run.CmapV2Helper')
+    @patch('dcumiddleware.run.CmapServiceHelper', return_value=MockCmapServiceHelper({}))
+    @patch.object(DnsResolver, 'resolve', return_value='1.1.1.1')
+    def test_load_and_enrich_closed_during_enrichment(self, mock_resolve, mock_cmap, mock_cmapv2, mock_update, mock_db_get,
+                                                      mock_find_one):
+        mock_cmapv2.return_value.lookup_host_by_authority.return_value = {}
+        mock_cmapv2.return_value.convert_cmapv2data.return_value = {}
+        result = run._load_and_enrich_data(dict(AUTO_SUSPEND_DOMAIN))
+        mock_update.assert_not_called()
+        self.assertEqual(result, CLOSED_TICKET)
+
+    @patch.object(Collection, 'find_one')
+    def test_closed_before_enrichment_carried_status(self, mock_find_one):
+        self.assertTrue(run.closed_before_enrichment(CLOSED_TICKET))
+        mock_find_one.assert_not_called()
+
+    @patch.object(Collection, 'find_one', side_effect=Exception('down'))
+    def test_closed_before_enrichment_read_failure(self, mock_find_one):
+        self.assertFalse(run.closed_before_enrichment(OPEN_TICKET))
 
     def build_cmap_data_object(self, shopper_brand='GODADDY', shopper_id='123456', customer_id='123456', domain_brand='GODADDY', domain_id='123456', domain_shopper='123456', domain_customer='123456'):
         data = {
@@ -319,79 +368,80 @@ class TestRun(TestCase):
         status = run.enrichment_succeeded(data)
         self.assertFalse(status)
 
-    @patch.object(Collection, 'find_one', return_value=None)
-    def test_blacklist_is_false(self, mock_find_one):
+    @patch.object(Collection, 'find', return_value=[])
+    def test_blacklist_is_false(self, mock_find):
         result = run._check_for_blacklist_auto_actions(self.NOT_BLACKLISTED_TICKET)
-        mock_find_one.assert_not_called()
+        mock_find.assert_not_called()
         self.assertDictEqual(result, self.NOT_BLACKLISTED_TICKET)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
-    @patch.object(Collection, 'find_one', return_value={'entity': 'test.com'})
-    def test_blacklisted_no_action(self, mock_find_one, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test.com'}])
+    def test_blacklisted_no_action(self, mock_find, mock_update_actions):
+        self.BLACKLISTED_TICKET[KEY_SOURCE_DOMAIN] = 'test.com'
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called_once()
         mock_update_actions.assert_not_called()
         self.assertDictEqual(result, self.BLACKLISTED_TICKET)
 
-    @patch.object(Collection, 'find_one')
-    def test_blacklisted_user_gen(self, mock_find_one):
-        mock_find_one.side_effect = [
+    @patch.object(Collection, 'find')
+    def test_blacklisted_user_gen(self, mock_find):
+        mock_find.return_value = [
             {'entity': 'test.com', 'category': 'godaddy_asset', 'action': 'resolved'},
-            None,
             {'entity': '123456789', 'category': 'godaddy_asset', 'action': 'resolved'},
             {'entity': '987654321', 'category': 'user_gen', 'action': 'resolved'}
         ]
         result = run.get_blacklist_info('test.com', 'www.test.com', '123456789', '987654321')
         self.assertIsNone(result)
-        mock_find_one.side_effect = [
+        mock_find.return_value = [
             {'entity': 'test.com', 'category': 'godaddy_asset', 'action': 'resolved'},
-            None,
             {'entity': '123456789', 'category': 'user_gen', 'action': 'resolved'},
             {'entity': '987654321', 'category': 'godaddy_asset', 'action': 'resolved'}
         ]
         result = run.get_blacklist_info('test.com', 'www.test.com', '123456789', '987654321')
         self.assertIsNone(result)
-        mock_find_one.side_effect = [
+        mock_find.return_value = [
             {'entity': 'test.com', 'category': 'user_gen', 'action': 'resolved'},
-            None,
             {'entity': '123456789', 'category': 'godaddy_asset', 'action': 'resolved'},
             {'entity': '987654321', 'category': 'godaddy_asset', 'action': 'resolved'}
         ]
         result = run.get_blacklist_info('test.com', 'www.test.com', '123456789', '987654321')
         self.assertIsNone(result)
-        mock_find_one.side_effect = [
+        mock_find.return_value = [
             {'entity': 'test.com', 'category': 'godaddy_asset', 'action': 'resolved'},
-            None,
             {'entity': '123456789', 'category': 'godaddy_asset', 'action': 'resolved'},
             {'entity': '987654321', 'category': 'godaddy_asset', 'action': 'resolved'}
         ]
         result = run.get_blacklist_info('test.com', 'www.test.com', '123456789', '987654321')
         self.assertEqual(result, 'resolved')
+        mock_find.assert_called_with({'entity': {'$in': ['test.com', 'www.test.com', '987654321', '123456789']}})
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
-    @patch.object(Collection, 'find_one', return_value={'entity': 'test.com', 'action': ['nonsense']})
-    def test_invalid_action(self, mock_find_one, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test.com', 'action': ['nonsense']}])
+    def test_invalid_action(self, mock_find, mock_update_actions):
+        self.BLACKLISTED_TICKET[KEY_SOURCE_DOMAIN] = 'test.com'
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_update_actions.assert_not_called()
         self.assertDictEqual(result, self.BLACKLISTED_TICKET)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', return_value={'entity': 'test.com', 'action': ['false_positive']})
-    def test_fp_auto_action(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test.com', 'action': ['false_positive']}])
+    def test_fp_auto_action(self, mock_find, mock_close_incident, mock_update_actions):
+        self.BLACKLISTED_TICKET[KEY_SOURCE_DOMAIN] = 'test.com'
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_called()
         mock_update_actions.assert_called()
         self.assertIsNone(result)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', return_value={'entity': 'test.com', 'action': ['resolved_no_action']})
-    def test_resolved_auto_action(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test.com', 'action': ['resolved_no_action']}])
+    def test_resolved_auto_action(self, mock_find, mock_close_incident, mock_update_actions):
+        self.BLACKLISTED_TICKET[KEY_SOURCE_DOMAIN] = 'test.com'
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_called()
         mock_update_actions.assert_called()
         self.assertIsNone(result)
@@ -422,70 +472,70 @@ class TestRun(TestCase):
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', side_effect=[None, None, {'entity': 'test.com', 'action': ['false_positive']}, None])
-    def test_host_shopper_only_bl(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test', 'action': ['false_positive']}])
+    def test_host_shopper_only_bl(self, mock_find, mock_close_incident, mock_update_actions):
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.HOST_KEY] = {run.SHOPPER_KEY: 'test'}
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_called()
         mock_update_actions.assert_called()
         self.assertIsNone(result)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', side_effect=[None, None, None, {'entity': 'test.com', 'action': ['false_positive']}])
-    def test_domain_shopper_only_bl(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test', 'action': ['false_positive']}])
+    def test_domain_shopper_only_bl(self, mock_find, mock_close_incident, mock_update_actions):
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.SHOPPER_INFO_KEY] = {run.SHOPPER_KEY: 'test'}
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_called()
         mock_update_actions.assert_called()
         self.assertIsNone(result)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', side_effect=[None, None, {'entity': 'test.com', 'action': ['false_positive']}, {'entity': 'test.com', 'action': ['false_positive']}, None])
-    def test_both_shopper_bl(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'test', 'action': ['false_positive']}])
+    def test_both_shopper_bl(self, mock_find, mock_close_incident, mock_update_actions):
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.SHOPPER_INFO_KEY] = {run.SHOPPER_KEY: 'test'}
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.HOST_KEY] = {run.SHOPPER_KEY: 'test'}
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_called()
         mock_update_actions.assert_called()
         self.assertIsNone(result)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', side_effect=[None, None, None, None])
-    def test_no_shopper_bl(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[])
+    def test_no_shopper_bl(self, mock_find, mock_close_incident, mock_update_actions):
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.SHOPPER_INFO_KEY] = {run.SHOPPER_KEY: 'test'}
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.HOST_KEY] = {run.SHOPPER_KEY: 'test'}
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_not_called()
         mock_update_actions.assert_not_called()
         self.assertEqual(self.BLACKLISTED_TICKET, result)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', side_effect=[None, None, None, None])
-    def test_failed_enrichment_bl(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[])
+    def test_failed_enrichment_bl(self, mock_find, mock_close_incident, mock_update_actions):
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.SHOPPER_INFO_KEY] = {run.SHOPPER_KEY: 'test'}
         self.BLACKLISTED_TICKET[run.DATA_KEY][run.DOMAIN_Q_KEY][run.HOST_KEY] = {run.SHOPPER_KEY: 'test'}
         self.BLACKLISTED_TICKET[run.FAILED_ENRICHMENT_KEY] = True
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_not_called()
+        mock_find.assert_not_called()
         mock_close_incident.assert_not_called()
         mock_update_actions.assert_not_called()
         self.assertEqual(self.BLACKLISTED_TICKET, result)
 
     @patch.object(PhishstoryMongo, 'update_actions_sub_document', return_value=None)
     @patch.object(APIHelper, 'close_incident', return_value=None)
-    @patch.object(Collection, 'find_one', side_effect=[None, {'entity': 'www.test.com', 'action': ['false_positive']}, None, None])
-    def test_subdomain_only_bl(self, mock_find_one, mock_close_incident, mock_update_actions):
+    @patch.object(Collection, 'find', return_value=[{'entity': 'www.test.com', 'action': ['false_positive']}])
+    def test_subdomain_only_bl(self, mock_find, mock_close_incident, mock_update_actions):
         self.BLACKLISTED_TICKET['sourceSubDomain'] = 'www.test.com'
         result = run._check_for_blacklist_auto_actions(self.BLACKLISTED_TICKET)
-        mock_find_one.assert_called()
+        mock_find.assert_called()
         mock_close_incident.assert_called()
         mock_update_actions.assert_called()
         self.assertIsNone(result)
@@ -543,3 +593,71 @@ class TestRun(TestCase):
         result = run.is_closed(None)
         mock_db.assert_not_called()
         self.assertIsNone(result)
+
+    @patch.object(run, '_route_to_brand_services', side_effect=lambda data: data)
+    @patch.object(run, '_check_for_blacklist_auto_actions', side_effect=lambda data: data)
+    @patch.object(run, 'enrich_incident', side_effect=lambda data, last_attempt: dict(data, enriched=True))
+    @patch.object(PhishstoryMongo, 'get_incident', return_value=OPEN_TICKET)
+    def test_process_fused(self, mock_db_get, mock_enrich, mock_blacklist, mock_route):
+        result = run.process_fused({KEY_TICKET_ID: 'DCU001'})
+        mock_db_get.assert_called_once_with('DCU001')
+        mock_enrich.assert_called_with(OPEN_TICKET, False)
+        mock_route.assert_called_with(dict(OPEN_TICKET, enriched=True))
+        self.assertEqual(result, dict(OPEN_TICKET, enriched=True))
+
+    @patch.object(PhishstoryMongo, 'get_incident', return_value=OPEN_TICKET)
+    @patch.object(run.process_fused, 'retry', side_effect=Retry())
+    @patch.object(run, '_check_for_blacklist_auto_actions')
+    @patch.object(run, 'enrich_incident', side_effect=ConnectionError())
+    def test_process_fused_retries_stage(self, mock_enrich, mock_blacklist, mock_retry, mock_db_get):
+        with self.assertRaises(Retry):
+            run.process_fused(OPEN_TICKET)
+        mock_blacklist.assert_not_called()
+        mock_retry.assert_called_once()
+        self.assertEqual(mock_retry.call_args[1]['args'], (OPEN_TICKET,))
+        self.assertEqual(mock_retry.call_args[1]['kwargs'], {'stage': 1, 'stage_retries': 1})
+        self.assertEqual(mock_retry.call_args[1]['countdown'], run._load_and_enrich_data.default_retry_delay)
+
+    @patch.object(run.process_fused, 'retry')
+    @patch.object(run, '_route_to_brand_services', side_effect=lambda data: data)
+    @patch.object(run, '_check_for_blacklist_auto_actions', side_effect=lambda data: data)
+    @patch.object(run, 'enrich_incident', side_effect=lambda data, last_attempt: data)
+    def test_process_fused_last_enrich_attempt(self, mock_enrich, mock_blacklist, mock_route, mock_retry):
+        run.process_fused(OPEN_TICKET, stage=1, stage_retries=run._load_and_enrich_data.max_retries)
+        mock_enrich.assert_called_with(OPEN_TICKET, True)
+        mock_retry.assert_not_called()
+
+    @patch.object(PhishstoryMongo, 'get_incident', return_value=OPEN_TICKET)
+    @patch.object(run, '_load_and_enrich_data')
+    @patch.object(run, 'chain')
+    def test_process_reads_incident(self, mock_chain, mock_enrich, mock_db_get):
+        run.process({KEY_TICKET_ID: 'DCU001'})
+        mock_db_get.assert_called_once_with('DCU001')
+        mock_enrich.s.assert_called_with(OPEN_TICKET)
+
+    @patch.object(run, 'start_pipeline')
+    @patch.object(PhishstoryMongo, 'add_new_incident')
+    @patch.object(PhishstoryMongo, 'get_incident', side_effect=[None, OPEN_TICKET])
+    def test_sync_customer_security(self, mock_db_get, mock_add, mock_start):
+        run.sync_customer_security({KEY_TICKET_ID: 'DCU001', 'plid': 1.0})
+        mock_add.assert_called_with('DCU001', {KEY_TICKET_ID: 'DCU001', 'plid': '1'}, status='PROCESSING')
+        mock_start.assert_called_once()
+        run.sync_customer_security({KEY_TICKET_ID: 'DCU001'})
+        mock_add.assert_called_once()
+        mock_start.assert_called_once()
+
+    @patch.object(run, 'process_fused')
+    @patch.object(run, 'chain')
+    def test_start_pipeline_fused(self, mock_chain, mock_fused):
+        with patch.object(run.app_settings, 'PIPELINE_MODE', run.FUSED_PIPELINE):
+            run.start_pipeline(OPEN_TICKET)
+        mock_fused.delay.assert_called_with(OPEN_TICKET)
+        mock_chain.assert_not_called()
+
+    def test_stage_countdown(self):
+        enrich = run._load_and_enrich_data
+        self.assertEqual(run.stage_countdown(enrich, ConnectionError(), 0), enrich.default_retry_delay)
+        self.assertIsNone(run.stage_countdown(enrich, ConnectionError(), enrich.max_retries))
+        self.assertIsNone(run.stage_countdown(run._route_to_brand_services, KeyError('ticketId'), 0))
+        self.assertLessEqual(run.stage_countdown(run._route_to_brand_services, ConnectionError(), 0),
+                             run.pipeline_retries.backoff)
@@ -0,0 +1,54 @@
+from datetime import datetime, timezone
+from unittest.case import TestCase
+
+from kombu.serialization import dumps as kombu_dumps
+from kombu.serialization import loads as kombu_loads
+
+from dcumiddleware.utilities import serialization
+from tests.benchmarks.payloads import enriched_incident
+
+
+class TestSerialization(TestCase):
+    def test_round_trip_incident(self):
+        incident = enriched_incident()
+        self.assertEqual(serialization.loads(serialization.dumps(incident, 0)), incident)
+        self.assertEqual(serialization.loads(serialization.dumps(incident, 1)), incident)
+
+    def test_datetimes(self):
+        naive = datetime(2020, 1, 1, 12, 30, 15, 123456)
+        aware = datetime(2020, 1, 1, 12, 30, tzinfo=timezone.utc)
+        result = serialization.loads(serialization.dumps({'naive': naive, 'aware': aware, 'old': datetime(1900, 1, 1)}))
+        self.assertEqual(result, {'naive': naive, 'aware': aware, 'old': datetime(1900, 1, 1)})
+        self.assertIsNone(result['naive'].tzinfo)
+        self.assertEqual(result['aware'].tzinfo, timezone.utc)
+
+    def test_json_like_types(self):
+        payload = ((1, 'a', b'bytes', None, True), {1: 'int key'})
+        self.assertEqual(serialization.loads(serialization.dumps(payload)), [[1, 'a', b'bytes', None, True], {1: 'int key'}])
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            serialization.dumps({'obj': object()})
+
+    def test_compression_threshold(self):
+        small = serialization.dumps({'a': 'b'}, 100)
+        large = serialization.dumps({'a': 'b' * 1000}, 100)
+        self.assertEqual(small[:2], bytes([serialization.SCHEMA_VERSION, 0]))
+        self.assertEqual(large[:2], bytes([serialization.SCHEMA_VERSION, serialization.FLAG_COMPRESSED]))
+        self.assertLess(len(large), 100)
+        self.assertEqual(serialization.loads(large), {'a': 'b' * 1000})
+
+    def test_unknown_version(self):
+        payload = bytearray(serialization.dumps({'a': 'b'}))
+        payload[0] = serialization.SCHEMA_VERSION + 1
+        with self.assertRaises(ValueError):
+            serialization.loads(bytes(payload))
+
+    def test_kombu_registration(self):
+        serialization.register_serializer()
+        incident = enriched_incident()
+        content_type, content_encoding, body = kombu_dumps(((incident,), {}, {}), serializer=serialization.SERIALIZER_NAME)
+        self.assertEqual(content_type, serialization.CONTENT_TYPE)
+        self.assertEqual(content_encoding, 'binary')
+        args, kwargs, embed = kombu_loads(body, content_type, content_encoding, accept=[serialization.CONTENT_TYPE])
+        self.assertEqual(args, [incident])
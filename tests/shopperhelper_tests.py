@@ -1,26 +1,63 @@
+import time
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
+from dcumiddleware.utilities.cache import TTLCache
 from dcumiddleware.utilities.shopperhelper import ShopperApiHelper
+from tests.test_settings import TestingConfig
 
 
 class TestShopperApiHelper(TestCase):
 
-    @patch('dcumiddleware.utilities.shopperhelper.requests.get')
-    def test_valid_get_shopper_id(self, mock_get):
-        shopperApiHelper = ShopperApiHelper('', '', '')
+    @patch('dcumiddleware.utilities.shopperhelper.get_session')
+    def test_valid_get_shopper_id(self, mock_session):
+        shopperApiHelper = ShopperApiHelper('', '', '', TestingConfig())
         mock_response = Mock(status_code=201)
         mock_response.json.return_value = {
             'shopperId': '123'
         }
-        mock_get.return_value = mock_response
+        mock_session.return_value.get.return_value = mock_response
         shopperId = shopperApiHelper.get_shopper_id('1')
         self.assertEqual(shopperId, '123')
 
-    @patch('dcumiddleware.utilities.shopperhelper.requests.get')
+    @patch('dcumiddleware.utilities.shopperhelper.get_session')
     @patch('dcumiddleware.utilities.shopperhelper.logging.getLogger')
-    def test_invalid_get_shopper_id(self, mock_log, mock_get):
-        shopperApiHelper = ShopperApiHelper('', '', '')
-        mock_get.return_value = Mock(status_code=400)
+    def test_invalid_get_shopper_id(self, mock_log, mock_session):
+        shopperApiHelper = ShopperApiHelper('', '', '', TestingConfig())
+        mock_session.return_value.get.return_value = Mock(status_code=400)
         shopperId = shopperApiHelper.get_shopper_id('')
         self.assertEqual(shopperId, '')
+
+
+class TestShopperApiHelperCache(TestCase):
+    def setUp(self):
+        self.metrics = MagicMock()
+        self.shopperApiHelper = ShopperApiHelper('', '', '', TestingConfig(), self.metrics, cache_size=10,
+                                                 cache_ttl=60, negative_ttl=0.05)
+        self.shopperApiHelper._cache.clear()
+        self.addCleanup(self.shopperApiHelper._cache.clear)
+
+    def test_cache_configured_from_arguments(self):
+        self.assertIsInstance(self.shopperApiHelper._cache, TTLCache)
+        self.assertIsNone(ShopperApiHelper('', '', '', TestingConfig(), cache_size=0)._cache)
+
+    @patch('dcumiddleware.utilities.shopperhelper.get_session')
+    def test_translation_cached_both_directions(self, mock_session):
+        mock_response = Mock(status_code=200)
+        mock_response.json.return_value = {'shopperId': '123'}
+        mock_session.return_value.get.return_value = mock_response
+        self.assertEqual(self.shopperApiHelper.get_shopper_id('c1'), '123')
+        self.assertEqual(self.shopperApiHelper.get_shopper_id('c1'), '123')
+        self.assertEqual(self.shopperApiHelper.get_customer_id('123'), 'c1')
+        mock_session.return_value.get.assert_called_once()
+        self.metrics.counter.assert_any_call('shopper_cache_hit', reset_on_collect=True)
+
+    @patch('dcumiddleware.utilities.shopperhelper.get_session')
+    def test_failed_lookup_negative_cached(self, mock_session):
+        mock_session.return_value.get.side_effect = Exception('Shopper API down')
+        self.assertEqual(self.shopperApiHelper.get_customer_id('123'), '')
+        self.assertEqual(self.shopperApiHelper.get_customer_id('123'), '')
+        self.assertEqual(mock_session.return_value.get.call_count, 1)
+        time.sleep(0.06)
+        self.assertEqual(self.shopperApiHelper.get_customer_id('123'), '')
+        self.assertEqual(mock_session.return_value.get.call_count, 2)
@@ -0,0 +1,93 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.case import TestCase
+
+from mock import MagicMock
+
+from dcumiddleware.utilities.asyncclient import AsyncEnrichmentExecutor
+from dcumiddleware.utilities.cmapservicehelper import CmapServiceHelper
+from dcumiddleware.utilities.shopperhelper import AsyncShopperApiHelper
+from dcumiddleware.utilities.singleflight import (AsyncSingleFlight,
+                                                  SingleFlight,
+                                                  get_single_flight)
+from tests.fakecmapserver import FakeCmapServer
+from tests.test_settings import TestingConfig
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        self.flight = SingleFlight('test')
+        self.metrics = MagicMock()
+        self.calls = 0
+        self.release = threading.Event()
+
+    def _lookup(self) -> dict:
+        self.calls += 1
+        self.release.wait(1)
+        return {'calls': self.calls}
+
+    def _join(self, callers: int, fn) -> list:
+        with ThreadPoolExecutor(callers) as pool:
+            futures = [pool.submit(self.flight.do, 'key', fn, self.metrics) for _ in range(callers)]
+            time.sleep(0.1)
+            self.release.set()
+            return [future.exception() or future.result() for future in futures]
+
+    def test_joins_in_flight_call(self):
+        results = self._join(5, self._lookup)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [{'calls': 1}] * 5)
+        self.assertEqual(len({id(result) for result in results}), 5)
+        self.metrics.counter.assert_called_with('test_coalesced_calls', reset_on_collect=True)
+        self.assertEqual(self.metrics.counter.return_value.inc.call_count, 4)
+
+    def test_exception_shared(self):
+        def failing_lookup():
+            self._lookup()
+            raise ConnectionError('down')
+
+        results = self._join(3, failing_lookup)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([type(result) for result in results], [ConnectionError] * 3)
+
+    def test_finished_call_not_reused(self):
+        self.release.set()
+        self.flight.do('key', self._lookup)
+        self.assertEqual(self.flight.do('key', self._lookup), {'calls': 2})
+
+    def test_get_single_flight(self):
+        self.assertIs(get_single_flight('test'), get_single_flight('test'))
+        self.assertIsInstance(get_single_flight('test', asynchronous=True), AsyncSingleFlight)
+
+
+class TestSingleFlightHelpers(TestCase):
+    def setUp(self):
+        self.server = FakeCmapServer(latency=0.2).__enter__()
+        self.config = TestingConfig()
+        self.config.CMAP_SERVICE = self.config.SSO_URL = self.server.url
+        self.metrics = MagicMock()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _requests(self, path: str) -> int:
+        return len([request for request in self.server.requests if request[1] == path])
+
+    def test_domain_query(self):
+        helper = CmapServiceHelper(self.config, self.metrics)
+        helper.get_jwt()
+        with ThreadPoolExecutor(4) as pool:
+            lookups = [pool.submit(helper.domain_query, 'example.com', '/') for _ in range(4)]
+            results = [lookup.result() for lookup in lookups]
+        self.assertEqual([result['data']['domainQuery']['domain'] for result in results], ['example.com'] * 4)
+        self.assertEqual(self._requests('/graphql'), 1)
+        self.metrics.counter.assert_any_call('cmap_coalesced_calls', reset_on_collect=True)
+
+    def test_async_shopper_lookup(self):
+        enrichment = AsyncEnrichmentExecutor(5, self.config)
+        helper = AsyncShopperApiHelper(self.server.url, '', '', self.config, self.metrics)
+        lookups = [enrichment.submit(helper.get_shopper_id, 'c1') for _ in range(4)]
+        self.assertEqual([enrichment.result(lookup) for lookup in lookups], ['shopper-c1'] * 4)
+        self.assertEqual(self._requests('/v1/customers/c1/shopper'), 1)
+        self.metrics.counter.assert_any_call('shopper_coalesced_calls', reset_on_collect=True)
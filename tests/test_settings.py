@@ -10,8 +10,59 @@ class TestingConfig:
     DBURL = 'mongodb://localhost/devphishstory'
     DB = 'test'
     COLLECTION = 'test'
+    DEAD_LETTER_COLLECTION = 'deadLetters'
     API_UPDATE_URL = None
     CMAP_SERVICE = 'http://localhost:5000'
     SSO_URL = ''
+    SSO_USER = 'user'
+    SSO_PASSWORD = 'password'
+    ABUSE_API_URL = None
     CMAP_CLIENT_CERT = ''
     CMAP_CLIENT_KEY = ''
+    CMAP_CACHE_BACKEND = 'memory'
+    CMAP_CACHE_URL = None
+    CMAP_CACHE_SIZE = 0
+    CMAP_CACHE_TTL = 300
+    CMAP_PERSISTED_QUERIES = False
+    CMAP_BATCH_WINDOW = 0
+    CMAP_BATCH_MAX_SIZE = 25
+    DNS_NAMESERVERS = []
+    DNS_PORT = 53
+    DNS_TIMEOUT = 2
+    DNS_CACHE_SIZE = 0
+    DNS_MAX_TTL = 300
+    DNS_NEGATIVE_TTL = 60
+    HTTP_POOL_CONNECTIONS = 4
+    HTTP_POOL_MAXSIZE = 10
+    HTTP_MAX_RETRIES = 2
+    HTTP_RETRY_BACKOFF = 0.2
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 30
+    ASYNC_HTTP_LIMIT = 100
+    ASYNC_HTTP_KEEPALIVE = 30
+    MONGO_MAX_POOL_SIZE = 100
+    MONGO_MIN_POOL_SIZE = 0
+    CIRCUIT_WINDOW = 20
+    CIRCUIT_MIN_CALLS = 10
+    CIRCUIT_FAILURE_RATE = 0.5
+    CIRCUIT_SLOW_CALL_SECONDS = 10
+    CIRCUIT_OPEN_SECONDS = 30
+    CIRCUIT_HALF_OPEN_PROBES = 1
+    RETRY_POLICIES = {
+        'intake': {'backoff': 2, 'backoff_max': 600, 'max_retries': 20},
+        'pipeline': {'backoff': 2, 'backoff_max': 600, 'max_retries': 20},
+        'attribute_sync': {'backoff': 1, 'backoff_max': 300, 'max_retries': 10},
+    }
+    RETRY_BUDGET_RATIO = 0.2
+    RETRY_BUDGET_MIN_PER_SECOND = 1
+    RETRY_BUDGET_WINDOW = 60
+    ENRICHMENT_MAX_WORKERS = 8
+    ENRICHMENT_DEADLINE = 60
+    WORKER_POOL = 'prefork'
+    WORKER_CONCURRENCY = 1
+    SHOPPER_CACHE_SIZE = 0
+    SHOPPER_CACHE_TTL = 24 * 60 * 60
+    SHOPPER_CACHE_NEGATIVE_TTL = 60
+    JWT_REFRESH_MARGIN = 300
+    JWT_MIN_REFRESH_INTERVAL = 5
+    JWT_RETRY_INTERVAL = 10